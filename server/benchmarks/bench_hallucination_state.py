@@ -0,0 +1,54 @@
+"""
+Measures the per-token cost of HallucinationState pattern matching on long tool call
+streams, with the rolling content suffix and with all tokens joined on every token.
+
+Usage:
+    python -m benchmarks.bench_hallucination_state [--num-tokens 100 1000 4000] [--repeat 5]
+"""
+
+import argparse
+import timeit
+
+from src.core.utils.hallucination_utils import HallucinationState
+from tests.core.fakes import get_weather_api, make_chunks, repeat_tool_calls
+
+
+class FullJoinHallucinationState(HallucinationState):
+    def _append_content(self, token):
+        self.content_suffix = "".join(self.tokens).replace(" ", "")
+
+
+def consume(state_cls, chunks):
+    state = state_cls(response_iterator=iter(chunks), function=[get_weather_api])
+    for _ in state:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num-tokens", type=int, nargs="+", default=[100, 1000, 4000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'tokens':>7} {'full join (us)':>15} {'rolling (us)':>13} {'speedup':>8}")
+
+    for num_tokens in args.num_tokens:
+        chunks = make_chunks(repeat_tool_calls(num_tokens)[:num_tokens])
+
+        results = {}
+        for state_cls in (FullJoinHallucinationState, HallucinationState):
+            seconds = timeit.timeit(
+                lambda: consume(state_cls, chunks), number=args.repeat
+            )
+            results[state_cls] = seconds / args.repeat / num_tokens * 1e6
+
+        full_join = results[FullJoinHallucinationState]
+        rolling = results[HallucinationState]
+        print(
+            f"{num_tokens:>7} {full_join:>15.2f} {rolling:>13.2f} "
+            f"{full_join / rolling:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Measures request decoding and response encoding of the model server endpoints with the
+default FastAPI path and the fast path of `CURVE_FAST_SERIALIZATION`, for payloads from
+1 KB to 1 MB, with and without floats in the response. The responses of both paths are
+checked to be byte-for-byte identical.
+
+Usage:
+    python -m benchmarks.bench_serialization [--sizes 1000 10000 100000 1000000] [--repeat 20]
+"""
+
+import json
+import argparse
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from src.commons.serialization import ModelJSONResponse
+from src.core.utils.model_utils import ChatCompletionResponse, ChatMessage, Choice
+from tests.core.fakes import get_weather_api
+
+
+def make_request(size: int) -> bytes:
+    """
+    Builds a multi-turn conversation of about `size` bytes.
+    """
+
+    turn = {"role": "user", "content": "What's the weather in Seattle, WA? " * 8}
+    num_turns = max(1, size // len(json.dumps(turn)))
+
+    return json.dumps(
+        {
+            "messages": [turn] * num_turns,
+            "tools": [get_weather_api],
+            "metadata": {"x-curve-intent-cache": "bypass"},
+        }
+    ).encode("utf-8")
+
+
+def make_response(size: int, floats: bool = False) -> ChatCompletionResponse:
+    """
+    Builds a response of about `size` bytes, with a tool call and a long answer. With
+    `floats`, the tool call has a float argument, which the fast path encodes with `json`.
+    """
+
+    arguments = {"location": "Seattle, WA", "days": 7}
+    if floats:
+        arguments["threshold"] = 1e-05
+
+    tool_call = {
+        "id": "call_1234",
+        "type": "function",
+        "function": {"name": "get_current_weather", "arguments": arguments},
+    }
+    content = "Sunny with a chance of rain, 12°C. " * max(1, size // 36)
+
+    return ChatCompletionResponse(
+        choices=[
+            Choice(message={"role": "assistant", "content": content}),
+            Choice(message={"role": "assistant", "tool_calls": [tool_call]}),
+        ],
+        model="Curve-Function",
+        metadata={"intent_latency": "12.345", "function_latency": "234.567"},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000]
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    adapter = TypeAdapter(ChatMessage)
+
+    print(
+        f"{'bytes':>8} {'floats':>6} {'decode (us)':>12} {'fast (us)':>10} {'speedup':>8}"
+        f" {'encode (us)':>12} {'fast (us)':>10} {'speedup':>8}"
+    )
+
+    for size in args.sizes:
+        body = make_request(size)
+        assert adapter.validate_json(body) == adapter.validate_python(json.loads(body))
+
+        for floats in (False, True):
+            response = make_response(size, floats)
+            assert (
+                ModelJSONResponse(response).body
+                == JSONResponse(jsonable_encoder(response)).body
+            )
+
+            timings = [
+                timeit.timeit(fn, number=args.repeat) / args.repeat * 1e6
+                for fn in (
+                    lambda: adapter.validate_python(json.loads(body)),
+                    lambda: adapter.validate_json(body),
+                    lambda: JSONResponse(jsonable_encoder(response)),
+                    lambda: ModelJSONResponse(response),
+                )
+            ]
+            decode, fast_decode, encode, fast_encode = timings
+
+            print(
+                f"{len(body):>8} {'yes' if floats else 'no':>6}"
+                f" {decode:>12.1f} {fast_decode:>10.1f} {decode / fast_decode:>7.1f}x"
+                f" {encode:>12.1f} {fast_encode:>10.1f} {encode / fast_encode:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures the per-request cost of building the Curve-Intent and Curve-Function system
+prompts with and without the system prompt cache.
+
+Usage:
+    python -m benchmarks.bench_system_prompt [--num-tools 5 50 500] [--repeat 200]
+"""
+
+import argparse
+import timeit
+
+from src.core.function_calling import (
+    CurveFunctionConfig,
+    CurveFunctionHandler,
+    CurveIntentConfig,
+    CurveIntentHandler,
+)
+from src.core.utils.model_utils import ChatMessage, Message, PipelineContext
+
+
+def get_tools(num_tools):
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": f"tool_{idx}",
+                "description": f"Description of the tool number {idx}.",
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "location": {"type": "str", "description": "A location."},
+                        "days": {"type": "int", "description": "Number of days."},
+                        "unit": {"type": "str", "enum": ["celsius", "fahrenheit"]},
+                    },
+                    "required": ["location"],
+                },
+            },
+        }
+        for idx in range(num_tools)
+    ]
+
+
+def build_prompts(handlers, req):
+    # one context per request, as in `/function_calling`
+    ctx = PipelineContext(req)
+    for handler in handlers:
+        handler._format_system_prompt(req.tools, ctx.tools_fingerprint)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--num-tools", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    handlers = [
+        CurveIntentHandler(None, "Curve-Intent", CurveIntentConfig),
+        CurveFunctionHandler(None, "Curve-Function", CurveFunctionConfig),
+    ]
+
+    print(f"{'tools':>6} {'uncached (us)':>14} {'cached (us)':>12} {'speedup':>8}")
+
+    for num_tools in args.num_tools:
+        req = ChatMessage(
+            messages=[Message(role="user", content="How is the weather?")],
+            tools=get_tools(num_tools),
+        )
+
+        results = {}
+        for cache_size in (0, 16):
+            for handler in handlers:
+                handler.system_prompt_cache.max_size = cache_size
+                handler.system_prompt_cache.clear()
+
+            # warm up the cache before timing
+            build_prompts(handlers, req)
+
+            seconds = timeit.timeit(
+                lambda: build_prompts(handlers, req), number=args.repeat
+            )
+            results[cache_size] = seconds / args.repeat * 1e6
+
+        print(
+            f"{num_tools:>6} {results[0]:>14.1f} {results[16]:>12.1f} "
+            f"{results[0] / results[16]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -23,7 +23,7 @@ def get_version():
 
 
 def wait_for_health_check(url, timeout=300):
-    """Wait for the Uvicorn server to respond to health-check requests."""
+    """Wait for the Uvicorn server to respond to health-check requests with 200."""
 
     start_time = time.time()
     while time.time() - start_time < timeout:
@@ -32,7 +32,10 @@ def wait_for_health_check(url, timeout=300):
             if response.status_code == 200:
                 return True
         except requests.ConnectionError:
-            time.sleep(1)
+            pass
+
+        # not started yet, or still warming up (503 from /readyz)
+        time.sleep(1)
 
     return False
 
@@ -56,7 +59,7 @@ def ensure_killed(process):
         process.kill()
 
 
-def start_server(port=51000, foreground=False):
+def start_server(port=51000, foreground=False, workers=1):
     """Start the Uvicorn server."""
 
     logger.info("model server version: %s", get_version())
@@ -64,47 +67,53 @@ def start_server(port=51000, foreground=False):
     stop_server()
 
     logger.info(
-        "starting model server, port: %s, foreground: %s. Please wait ...",
+        "starting model server, port: %s, foreground: %s, workers: %s. Please wait ...",
         port,
         foreground,
+        workers,
     )
 
+    if workers > 1:
+        # the models are loaded once and shared by forked workers
+        command = [
+            "python",
+            "-m",
+            "src.workers",
+            "--host",
+            "0.0.0.0",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+        ]
+    else:
+        command = [
+            "python",
+            "-m",
+            "uvicorn",
+            "src.main:app",
+            "--host",
+            "0.0.0.0",
+            "--port",
+            str(port),
+        ]
+
+    # the workers share the process group of the server, so that they are stopped with it
     if foreground:
-        process = subprocess.Popen(
-            [
-                "python",
-                "-m",
-                "uvicorn",
-                "src.main:app",
-                "--host",
-                "0.0.0.0",
-                "--port",
-                str(port),
-            ],
-        )
+        process = subprocess.Popen(command, start_new_session=workers > 1)
     else:
         process = subprocess.Popen(
-            [
-                "python",
-                "-m",
-                "uvicorn",
-                "src.main:app",
-                "--host",
-                "0.0.0.0",
-                "--port",
-                str(port),
-            ],
+            command,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE,
+            start_new_session=workers > 1,
         )
 
     try:
-        if wait_for_health_check(f"http://0.0.0.0:{port}/healthz"):
-            logger.info(
-                f"model server health check passed, port {port}, pid: {process.pid}"
-            )
+        if wait_for_health_check(f"http://0.0.0.0:{port}/readyz"):
+            logger.info(f"model server is ready, port {port}, pid: {process.pid}")
         else:
-            logger.error("health check failed, shutting it down.")
+            logger.error("readiness check failed, shutting it down.")
             process.terminate()
     except KeyboardInterrupt:
         logger.info("model server stopped by user during initialization.")
@@ -135,7 +144,11 @@ def stop_server():
             pid = int(f.read())
             logger.info(f"Killing model server {pid}")
             try:
-                os.kill(pid, signal.SIGKILL)
+                # a multi-worker server leads its own process group
+                if os.getpgid(pid) == pid:
+                    os.killpg(pid, signal.SIGKILL)
+                else:
+                    os.kill(pid, signal.SIGKILL)
             except ProcessLookupError:
                 logger.info(f"Process {pid} not found")
         os.remove(pid_file)
@@ -143,10 +156,10 @@ def stop_server():
         logger.info("No PID file found, server is not running.")
 
 
-def restart_server(port=51000, foreground=False):
+def restart_server(port=51000, foreground=False, workers=1):
     """Restart the Uvicorn server."""
     stop_server()
-    start_server(port, foreground)
+    start_server(port, foreground, workers)
 
 
 def parse_args():
@@ -171,6 +184,13 @@ def parse_args():
         action="store_true",
         help="Run the server in the foreground (default: False).",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server workers sharing the preloaded models, each with its own "
+        "share of the admission limits, metrics are summed over the workers (default: 1).",
+    )
 
     return parser.parse_args()
 
@@ -184,13 +204,13 @@ def main():
 
     if args.action == "start":
         logger.info("[CLI] - Starting server")
-        start_server(args.port, args.foreground)
+        start_server(args.port, args.foreground, args.workers)
     elif args.action == "stop":
         logger.info("[CLI] - Stopping server")
         stop_server()
     elif args.action == "restart":
         logger.info("[CLI] - Restarting server")
-        restart_server(args.port)
+        restart_server(args.port, workers=args.workers)
     else:
         logger.error(f"[CLI] - Unknown action: {args.action}")
         sys.exit(1)
@@ -0,0 +1,182 @@
+import time
+import asyncio
+
+from collections import deque
+from contextlib import asynccontextmanager
+from src.commons.metrics import Counter, Gauge, Histogram
+
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "curve_admission_queue_depth",
+    "Requests waiting for a concurrency slot, by endpoint.",
+    ["endpoint"],
+)
+ADMISSION_IN_FLIGHT = Gauge(
+    "curve_admission_in_flight",
+    "Requests holding a concurrency slot, by endpoint.",
+    ["endpoint"],
+)
+ADMISSION_REJECTIONS = Counter(
+    "curve_admission_rejections_total",
+    "Requests rejected by admission control, by endpoint and reason (queue_full or queue_timeout).",
+    ["endpoint", "reason"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "curve_admission_wait_seconds",
+    "Time a request waited for a concurrency slot, by endpoint.",
+    ["endpoint"],
+)
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is not admitted.
+
+    Attributes:
+        endpoint (str): The endpoint of the request.
+        reason (str): Either "queue_full" or "queue_timeout".
+        status_code (int): 429 when the queue is full, 503 when the wait timed out.
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, endpoint: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(
+            f"{endpoint} is overloaded ({reason}), retry after {retry_after}s"
+        )
+        self.endpoint = endpoint
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the concurrent requests of an endpoint. Requests above the limit wait in a bounded
+    FIFO queue for at most `max_queue_ms`; requests that find the queue full or wait too long
+    are rejected right away instead of piling up on the event loop and the backend.
+
+    Attributes:
+        endpoint (str): The endpoint name, used as metric label.
+        max_concurrency (int): The maximum number of requests served at once, 0 for no limit.
+        max_queue_size (int): The maximum number of waiting requests.
+        max_queue_ms (float): The maximum time a request waits for a slot.
+        retry_after (int): The `Retry-After` hint of rejected requests in seconds.
+        in_flight (int): The number of requests holding a slot.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        max_concurrency: int = 0,
+        max_queue_size: int = 0,
+        max_queue_ms: float = 0,
+        retry_after: int = 1,
+    ):
+        self.endpoint = endpoint
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.max_queue_ms = max_queue_ms
+        self.retry_after = retry_after
+        self.in_flight = 0
+
+        self._waiters: deque = deque()
+
+        self._queue_depth = ADMISSION_QUEUE_DEPTH.labels(endpoint=endpoint)
+        self._in_flight = ADMISSION_IN_FLIGHT.labels(endpoint=endpoint)
+        self._wait_seconds = ADMISSION_WAIT_SECONDS.labels(endpoint=endpoint)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str, status_code: int):
+        ADMISSION_REJECTIONS.labels(endpoint=self.endpoint, reason=reason).inc()
+        raise AdmissionRejected(self.endpoint, reason, status_code, self.retry_after)
+
+    async def acquire(self, deadline: float = None):
+        """
+        Waits for a concurrency slot.
+
+        Args:
+            deadline (float, optional): The `time.monotonic()` deadline of the request, which
+                shortens the wait if it comes before `max_queue_ms`. Defaults to None.
+
+        Raises:
+            AdmissionRejected: If the queue is full or no slot was free in time.
+        """
+
+        if not self.enabled:
+            return
+
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            self._in_flight.inc()
+            self._wait_seconds.observe(0.0)
+            return
+
+        if len(self._waiters) >= self.max_queue_size:
+            self._reject("queue_full", 429)
+
+        timeout = self.max_queue_ms / 1000
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._queue_depth.inc()
+        start_time = time.perf_counter()
+
+        try:
+            # a released slot is handed over to the waiter, see `release()`
+            await asyncio.wait_for(asyncio.shield(waiter), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # the slot may have been handed over just as the client went away
+            if waiter.done():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            self._wait_seconds.observe(time.perf_counter() - start_time)
+
+        if not waiter.done():
+            self._discard(waiter)
+            self._reject("queue_timeout", 503)
+
+    def _discard(self, waiter: asyncio.Future):
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        self._queue_depth.dec()
+
+    def release(self):
+        """
+        Releases a slot, handing it over to the oldest waiting request if any.
+        """
+
+        if not self.enabled:
+            return
+
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+            self._queue_depth.dec()
+        else:
+            self.in_flight -= 1
+            self._in_flight.dec()
+
+    @asynccontextmanager
+    async def admit(self, deadline: float = None):
+        """
+        Holds a concurrency slot for the duration of the block.
+        """
+
+        await self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
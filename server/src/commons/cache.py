@@ -0,0 +1,134 @@
+import sys
+import json
+import time
+import hashlib
+import threading
+
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def fingerprint(obj: Any) -> str:
+    """
+    Computes a stable hash of a JSON-serializable object, independent of key order.
+
+    Args:
+        obj (Any): A JSON-serializable object.
+
+    Returns:
+        str: The hex digest of the canonical JSON representation of the object.
+    """
+
+    canonical = json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded LRU cache with an optional time-to-live for each entry.
+
+    Attributes:
+        max_size (int): The maximum number of entries. A size of 0 disables the cache.
+        ttl (float): Seconds an entry stays valid, or None to keep entries until evicted.
+        max_bytes (int): The maximum estimated memory of all entries, or None for no limit.
+        sizeof (Callable): Estimates the memory of a (key, value) entry in bytes.
+        hits (int): Number of lookups that found a valid entry.
+        misses (int): Number of lookups that found no valid entry.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        ttl: float = None,
+        max_bytes: int = None,
+        sizeof: Callable[[Hashable, Any], int] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (
+            lambda key, value: sys.getsizeof(key) + sys.getsizeof(value)
+        )
+        self.hits = 0
+        self.misses = 0
+        self.current_bytes = 0
+
+        # key -> (expiry time, value, size in bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Looks up a key and marks it as most recently used.
+
+        Args:
+            key (Hashable): The cache key.
+            default (Any, optional): The value to return if the key is missing or expired.
+
+        Returns:
+            Any: The cached value or `default`.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if (
+                entry is not None
+                and entry[0] is not None
+                and entry[0] < time.monotonic()
+            ):
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        """
+        Inserts or replaces an entry, evicting the least recently used entries if needed.
+
+        Args:
+            key (Hashable): The cache key.
+            value (Any): The value to cache.
+        """
+
+        if not self.enabled:
+            return
+
+        expiry = time.monotonic() + self.ttl if self.ttl else None
+        size = self.sizeof(key, value) if self.max_bytes else 0
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (expiry, value, size)
+            self.current_bytes += size
+
+            while len(self._entries) > self.max_size or (
+                self.max_bytes and self.current_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits, self.misses, self.current_bytes = 0, 0, 0
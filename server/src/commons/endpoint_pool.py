@@ -0,0 +1,303 @@
+import time
+import openai
+import asyncio
+import src.commons.utils as utils
+
+from types import SimpleNamespace
+from typing import Any, Callable, List
+from src.commons.metrics import Counter, Gauge
+from src.core.utils.model_utils import STAGE_TIMEOUT_CANCEL_MESSAGE
+
+
+logger = utils.get_server_logger()
+
+
+ENDPOINT_IN_FLIGHT = Gauge(
+    "curve_endpoint_in_flight",
+    "Requests in flight to an LLM endpoint, including open streams.",
+    ["endpoint"],
+)
+ENDPOINT_REQUESTS = Counter(
+    "curve_endpoint_requests_total",
+    "Requests to an LLM endpoint by result (success or failure).",
+    ["endpoint", "result"],
+)
+ENDPOINT_EJECTIONS = Counter(
+    "curve_endpoint_ejections_total",
+    "Number of times an LLM endpoint was ejected after consecutive failures.",
+    ["endpoint"],
+)
+
+ENDPOINT_POLICIES = ["least_outstanding", "ewma"]
+
+
+def is_endpoint_failure(e: BaseException) -> bool:
+    """
+    Checks whether an error is caused by the endpoint rather than by the request. A call
+    cancelled because it exceeded its stage timeout counts as a failure of a hanging
+    endpoint, a call cancelled because the client went away does not.
+    """
+
+    if isinstance(e, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+
+    if isinstance(e, asyncio.CancelledError):
+        return STAGE_TIMEOUT_CANCEL_MESSAGE in e.args
+
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+
+class Endpoint:
+    """
+    An OpenAI-compatible endpoint of the pool and its load and health statistics.
+
+    Attributes:
+        name (str): The name of the endpoint, usually its base URL.
+        client: The OpenAI-compatible client of the endpoint.
+        in_flight (int): The number of requests in flight, including open streams.
+        ewma (float): The exponentially weighted moving average of the response latency in seconds.
+        consecutive_failures (int): The number of failures since the last success.
+        ejected_until (float): The monotonic time until which the endpoint is not selected.
+    """
+
+    def __init__(self, name: str, client: Any):
+        self.name = name
+        self.client = client
+        self.in_flight = 0
+        self.ewma = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+        self._in_flight = ENDPOINT_IN_FLIGHT.labels(endpoint=name)
+        self._successes = ENDPOINT_REQUESTS.labels(endpoint=name, result="success")
+        self._failures = ENDPOINT_REQUESTS.labels(endpoint=name, result="failure")
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+
+class PooledStream:
+    """
+    Wraps a streamed response of an endpoint and releases the endpoint once the stream
+    is exhausted, fails or is closed.
+    """
+
+    def __init__(self, stream, release: Callable[[BaseException], None]):
+        self.stream = stream
+        self._release = release
+        self._released = False
+
+    def _done(self, error: BaseException = None):
+        if not self._released:
+            self._released = True
+            self._release(error)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.stream.__anext__()
+        except StopAsyncIteration:
+            self._done()
+            raise
+        except BaseException as e:
+            self._done(e)
+            raise
+
+    async def close(self):
+        try:
+            await self.stream.close()
+        finally:
+            self._done()
+
+
+class EndpointPool:
+    """
+    Spreads chat completions over a pool of OpenAI-compatible endpoints. It is used in place
+    of a single `AsyncOpenAI` client through `pool.chat.completions.create(...)`.
+
+    Two selection policies are supported:
+        - "least_outstanding": the endpoint with the fewest requests in flight.
+        - "ewma": the endpoint with the lowest latency EWMA weighted by its requests in flight.
+
+    An endpoint failing `eject_failures` times in a row is ejected for `eject_seconds`. When
+    every endpoint is ejected, the ejected ones are used rather than failing the request.
+
+    Attributes:
+        endpoints (List[Endpoint]): The endpoints of the pool.
+        policy (str): The selection policy.
+        max_in_flight (int): The maximum number of requests in flight per endpoint, 0 for no limit.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        policy: str = "least_outstanding",
+        max_in_flight: int = 0,
+        eject_failures: int = 3,
+        eject_seconds: float = 30.0,
+        ewma_alpha: float = 0.3,
+    ):
+        if not endpoints:
+            raise ValueError("An endpoint pool requires at least one endpoint.")
+
+        if policy not in ENDPOINT_POLICIES:
+            raise ValueError(
+                f"Unknown policy `{policy}`, expected one of {ENDPOINT_POLICIES}"
+            )
+
+        self.endpoints = endpoints
+        self.policy = policy
+        self.max_in_flight = max_in_flight
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.ewma_alpha = ewma_alpha
+
+        self._slot_released: asyncio.Event = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+        # duck-types `AsyncOpenAI().chat.completions`
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _has_slot(self, endpoint: Endpoint) -> bool:
+        return not self.max_in_flight or endpoint.in_flight < self.max_in_flight
+
+    def _cost(self, endpoint: Endpoint) -> tuple:
+        if self.policy == "ewma":
+            return (endpoint.ewma * (endpoint.in_flight + 1), endpoint.in_flight)
+
+        return (endpoint.in_flight, endpoint.ewma)
+
+    def _select(self) -> Endpoint:
+        """
+        Selects the endpoint with the lowest cost among the healthy endpoints with a free slot.
+        """
+
+        available = [
+            endpoint for endpoint in self.endpoints if self._has_slot(endpoint)
+        ]
+        healthy = [endpoint for endpoint in available if not endpoint.ejected]
+
+        candidates = healthy or available
+        if not candidates:
+            return None
+
+        return min(candidates, key=self._cost)
+
+    async def _acquire(self) -> Endpoint:
+        loop = asyncio.get_running_loop()
+
+        # the event is bound to the event loop that serves requests
+        if self._loop is not loop:
+            self._loop = loop
+            self._slot_released = asyncio.Event()
+
+        endpoint = self._select()
+        while endpoint is None:
+            self._slot_released.clear()
+            await self._slot_released.wait()
+            endpoint = self._select()
+
+        endpoint.in_flight += 1
+        endpoint._in_flight.inc()
+
+        return endpoint
+
+    def _release(self, endpoint: Endpoint, latency: float, error: BaseException = None):
+        endpoint.in_flight -= 1
+        endpoint._in_flight.dec()
+
+        if error is not None and is_endpoint_failure(error):
+            self._record_failure(endpoint, error)
+        elif error is None:
+            self._record_success(endpoint, latency)
+
+        if self._slot_released is not None:
+            self._slot_released.set()
+
+    def _record_success(self, endpoint: Endpoint, latency: float):
+        endpoint._successes.inc()
+        endpoint.consecutive_failures = 0
+        endpoint.ewma = (
+            latency
+            if endpoint.ewma == 0.0
+            else self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma
+        )
+
+    def _record_failure(self, endpoint: Endpoint, error: BaseException):
+        endpoint._failures.inc()
+        endpoint.consecutive_failures += 1
+
+        if endpoint.consecutive_failures >= self.eject_failures:
+            endpoint.consecutive_failures = 0
+            endpoint.ejected_until = time.monotonic() + self.eject_seconds
+            ENDPOINT_EJECTIONS.labels(endpoint=endpoint.name).inc()
+            logger.warning(
+                f"[Endpoint Pool] - ejecting {endpoint.name} for {self.eject_seconds}s: {error}"
+            )
+
+    async def warm_up(self, connections: int = 1, timeout: float = 5.0) -> int:
+        """
+        Opens keep-alive connections to every endpoint by listing its models, so that the
+        first requests do not pay for connection setup. Failures are logged, not raised.
+
+        Args:
+            connections (int, optional): The number of connections to open per endpoint. Defaults to 1.
+            timeout (float, optional): The timeout of each request in seconds. Defaults to 5.0.
+
+        Returns:
+            int: The number of connections opened.
+        """
+
+        async def connect(endpoint: Endpoint) -> bool:
+            try:
+                await endpoint.client.with_options(
+                    max_retries=0, timeout=timeout
+                ).models.list()
+                return True
+            except Exception as e:
+                logger.warning(
+                    f"[Endpoint Pool] - cannot connect to {endpoint.name}: {e}"
+                )
+                return False
+
+        # concurrent requests cannot share a connection, so each one opens its own
+        results = await asyncio.gather(
+            *[
+                connect(endpoint)
+                for endpoint in self.endpoints
+                for _ in range(connections)
+            ]
+        )
+
+        return sum(results)
+
+    async def create(self, *args, stream: bool = False, **kwargs):
+        """
+        Creates a chat completion on the selected endpoint. Streamed responses keep the
+        endpoint busy until the stream is exhausted or closed.
+        """
+
+        endpoint = await self._acquire()
+        start_time = time.perf_counter()
+
+        try:
+            response = await endpoint.client.chat.completions.create(
+                *args, stream=stream, **kwargs
+            )
+        except BaseException as e:
+            self._release(endpoint, time.perf_counter() - start_time, e)
+            raise
+
+        latency = time.perf_counter() - start_time
+
+        if not stream:
+            self._release(endpoint, latency)
+            return response
+
+        # a stream is timed to its first byte, but keeps the endpoint busy until it is done
+        return PooledStream(
+            response, lambda error=None: self._release(endpoint, latency, error)
+        )
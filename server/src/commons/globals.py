@@ -1,7 +1,11 @@
 import os
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
+from src.commons.admission import AdmissionController
+from src.commons.endpoint_pool import Endpoint, EndpointPool
 from src.commons.utils import get_server_logger
-from src.core.guardrails import get_guardrail_handler
+from src.core.guardrails import CurveGuardExecutor, get_guardrail_handler
+from src.core.utils.batching import MicroBatcher
 from src.core.function_calling import (
     CurveIntentConfig,
     CurveIntentHandler,
@@ -14,16 +18,114 @@ from src.core.function_calling import (
 logger = get_server_logger()
 
 
-# Define the client
+# Define the client, a comma-separated list of endpoints is load balanced
 CURVE_ENDPOINT = os.getenv("CURVE_ENDPOINT", "https://api.fc.curve.com/v1")
+CURVE_ENDPOINTS = [
+    endpoint.strip() for endpoint in CURVE_ENDPOINT.split(",") if endpoint.strip()
+]
 CURVE_API_KEY = "EMPTY"
-CURVE_CLIENT = OpenAI(base_url=CURVE_ENDPOINT, api_key=CURVE_API_KEY)
+
+# Connection pool shared by all requests to each LLM endpoint
+CURVE_MAX_CONNECTIONS = int(os.getenv("CURVE_MAX_CONNECTIONS", "100"))
+CURVE_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("CURVE_MAX_KEEPALIVE_CONNECTIONS", "20")
+)
+CURVE_KEEPALIVE_EXPIRY = float(os.getenv("CURVE_KEEPALIVE_EXPIRY", "30"))
+
+# Endpoint selection (least_outstanding or ewma), in-flight limit (0 for no limit) and ejection
+CURVE_ENDPOINT_POLICY = os.getenv("CURVE_ENDPOINT_POLICY", "least_outstanding")
+CURVE_ENDPOINT_MAX_IN_FLIGHT = int(os.getenv("CURVE_ENDPOINT_MAX_IN_FLIGHT", "0"))
+CURVE_ENDPOINT_EJECT_FAILURES = int(os.getenv("CURVE_ENDPOINT_EJECT_FAILURES", "3"))
+CURVE_ENDPOINT_EJECT_SECONDS = float(os.getenv("CURVE_ENDPOINT_EJECT_SECONDS", "30"))
+
+
+def get_client(base_url: str) -> AsyncOpenAI:
+    return AsyncOpenAI(
+        base_url=base_url,
+        api_key=CURVE_API_KEY,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=CURVE_MAX_CONNECTIONS,
+                max_keepalive_connections=CURVE_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=CURVE_KEEPALIVE_EXPIRY,
+            )
+        ),
+    )
+
+
+CURVE_CLIENT = EndpointPool(
+    [Endpoint(base_url, get_client(base_url)) for base_url in CURVE_ENDPOINTS],
+    policy=CURVE_ENDPOINT_POLICY,
+    max_in_flight=CURVE_ENDPOINT_MAX_IN_FLIGHT,
+    eject_failures=CURVE_ENDPOINT_EJECT_FAILURES,
+    eject_seconds=CURVE_ENDPOINT_EJECT_SECONDS,
+)
+
+# Start Curve-Function together with Curve-Intent and cancel it if no intent is detected
+CURVE_SPECULATIVE_FUNCTION_CALLING = (
+    os.getenv("CURVE_SPECULATIVE_FUNCTION_CALLING", "false").lower() == "true"
+)
+
+# Decode request bodies with `validate_json` and render response models with `pydantic_core`
+# instead of `jsonable_encoder` and `json.dumps`, see benchmarks/bench_serialization.py
+CURVE_FAST_SERIALIZATION = (
+    os.getenv("CURVE_FAST_SERIALIZATION", "false").lower() == "true"
+)
+
+# Maximum number of conversations of a `/function_calling/batch` request served at once
+CURVE_BATCH_MAX_CONCURRENCY = int(os.getenv("CURVE_BATCH_MAX_CONCURRENCY", "16"))
+
+# Concurrent guard requests are batched into one forward pass
+CURVE_GUARD_MAX_BATCH_SIZE = int(os.getenv("CURVE_GUARD_MAX_BATCH_SIZE", "16"))
+CURVE_GUARD_MAX_WAIT_MS = float(os.getenv("CURVE_GUARD_MAX_WAIT_MS", "5"))
+
+# Curve-Guard inference backend: eager, int8 or onnx
+CURVE_GUARD_BACKEND = os.getenv("CURVE_GUARD_BACKEND", "eager")
+
+# Curve-Guard inference runs off the event loop, on a thread pool or a process pool
+CURVE_GUARD_EXECUTOR = os.getenv("CURVE_GUARD_EXECUTOR", "thread")
+CURVE_GUARD_NUM_WORKERS = int(os.getenv("CURVE_GUARD_NUM_WORKERS", "1"))
+CURVE_GUARD_INTRA_OP_THREADS = int(os.getenv("CURVE_GUARD_INTRA_OP_THREADS", "0"))
+CURVE_GUARD_INTER_OP_THREADS = int(os.getenv("CURVE_GUARD_INTER_OP_THREADS", "0"))
+
+# Curve-Guard results are cached by input, optionally on disk to survive restarts
+CURVE_GUARD_CACHE_CONFIG = {
+    "max_size": int(os.getenv("CURVE_GUARD_CACHE_SIZE", "10000")),
+    "max_bytes": int(float(os.getenv("CURVE_GUARD_CACHE_MAX_MB", "64")) * 1024 * 1024),
+    "path": os.getenv("CURVE_GUARD_CACHE_PATH") or None,
+}
+
+# Admission control: requests above the concurrency limit of an endpoint wait in a bounded
+# queue, requests that find the queue full (429) or wait too long (503) are rejected
+CURVE_RETRY_AFTER_S = int(os.getenv("CURVE_RETRY_AFTER_S", "1"))
+CURVE_FUNCTION_ADMISSION_CONFIG = {
+    "max_concurrency": int(os.getenv("CURVE_FUNCTION_MAX_CONCURRENCY", "64")),
+    "max_queue_size": int(os.getenv("CURVE_FUNCTION_MAX_QUEUE_SIZE", "128")),
+    "max_queue_ms": float(os.getenv("CURVE_FUNCTION_MAX_QUEUE_MS", "10000")),
+    "retry_after": CURVE_RETRY_AFTER_S,
+}
+CURVE_GUARD_ADMISSION_CONFIG = {
+    "max_concurrency": int(os.getenv("CURVE_GUARD_MAX_CONCURRENCY", "64")),
+    "max_queue_size": int(os.getenv("CURVE_GUARD_MAX_QUEUE_SIZE", "256")),
+    "max_queue_ms": float(os.getenv("CURVE_GUARD_MAX_QUEUE_MS", "2000")),
+    "retry_after": CURVE_RETRY_AFTER_S,
+}
+
+# Warm up Curve-Guard at these sequence lengths and pre-open upstream connections at startup
+CURVE_WARM_UP = os.getenv("CURVE_WARM_UP", "true").lower() == "true"
+CURVE_WARM_UP_SEQ_LENGTHS = [
+    int(seq_length)
+    for seq_length in os.getenv("CURVE_WARM_UP_SEQ_LENGTHS", "16,128,512").split(",")
+]
+CURVE_WARM_UP_CONNECTIONS = int(os.getenv("CURVE_WARM_UP_CONNECTIONS", "1"))
 
 # Define model names
 CURVE_INTENT_MODEL_ALIAS = "Curve-Intent"
 CURVE_FUNCTION_MODEL_ALIAS = "Curve-Function"
 CURVE_GUARD_MODEL_ALIAS = "curvelaboratory/Curve-Guard"
 
+MODEL_NAMES = ["Curve-Intent", "Curve-Function", "Curve-Guard"]
+
 # Define model handlers
 handler_map = {
     "Curve-Intent": CurveIntentHandler(
@@ -32,5 +134,36 @@ handler_map = {
     "Curve-Function": CurveFunctionHandler(
         CURVE_CLIENT, CURVE_FUNCTION_MODEL_ALIAS, CurveFunctionConfig
     ),
-    "Curve-Guard": get_guardrail_handler(CURVE_GUARD_MODEL_ALIAS),
 }
+
+# With a process pool, every worker loads its own Curve-Guard model instead
+if CURVE_GUARD_EXECUTOR == "thread":
+    handler_map["Curve-Guard"] = get_guardrail_handler(
+        CURVE_GUARD_MODEL_ALIAS,
+        backend=CURVE_GUARD_BACKEND,
+        cache_config=CURVE_GUARD_CACHE_CONFIG,
+    )
+
+guard_executor = CurveGuardExecutor(
+    handler=handler_map.get("Curve-Guard"),
+    executor_type=CURVE_GUARD_EXECUTOR,
+    num_workers=CURVE_GUARD_NUM_WORKERS,
+    intra_op_threads=CURVE_GUARD_INTRA_OP_THREADS,
+    inter_op_threads=CURVE_GUARD_INTER_OP_THREADS,
+    model_name=CURVE_GUARD_MODEL_ALIAS,
+    backend=CURVE_GUARD_BACKEND,
+    cache_config=CURVE_GUARD_CACHE_CONFIG,
+)
+
+guard_batcher = MicroBatcher(
+    guard_executor.predict_batch,
+    max_batch_size=CURVE_GUARD_MAX_BATCH_SIZE,
+    max_wait_ms=CURVE_GUARD_MAX_WAIT_MS,
+    max_concurrent_batches=CURVE_GUARD_NUM_WORKERS,
+    name="Curve-Guard",
+)
+
+function_admission = AdmissionController(
+    "function_calling", **CURVE_FUNCTION_ADMISSION_CONFIG
+)
+guard_admission = AdmissionController("guardrails", **CURVE_GUARD_ADMISSION_CONFIG)
@@ -0,0 +1,476 @@
+import os
+import json
+import math
+import bisect
+import threading
+
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Latency buckets in seconds, from a cached lookup up to the gateway timeout
+DEFAULT_LATENCY_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+
+
+class MetricRegistry:
+    """
+    Keeps track of every metric created by the model server.
+
+    When the server runs several forked workers, each worker publishes its values to
+    `shared_dir` and `generate_latest` renders the sum over all workers, so that any
+    worker answers a scrape with the metrics of the whole server.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, "Metric"] = {}
+        self.shared_dir: Optional[str] = None
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> "Metric":
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric `{metric.name}` is already registered!")
+            self.metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> "Metric":
+        return self.metrics.get(name)
+
+    def snapshot(self, gauges: bool = True) -> Dict[str, List]:
+        """
+        Returns the values of all metrics as {name: [[label values, totals], ...]}.
+        """
+
+        return {
+            name: [
+                [list(labelvalues), child.totals()]
+                for labelvalues, child in metric.samples()
+            ]
+            for name, metric in list(self.metrics.items())
+            if gauges or not isinstance(metric, Gauge)
+        }
+
+    def reset(self):
+        """
+        Zeroes all metrics, e.g. in a worker forked from a process that recorded values.
+        """
+
+        for metric in list(self.metrics.values()):
+            for _, child in metric.samples():
+                child._shards.reset()
+
+
+REGISTRY = MetricRegistry()
+
+
+class Metric:
+    """
+    Base class of a metric with optional labels. Calling `labels()` returns the child
+    metric for the given label values, which is created on first use.
+
+    Attributes:
+        name (str): The metric name.
+        documentation (str): A short description of the metric.
+        labelnames (Tuple[str]): The label names of the metric.
+    """
+
+    metric_type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: MetricRegistry = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+        self._lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self) -> "Metric":
+        raise NotImplementedError()
+
+    def totals(self) -> List[float]:
+        return self._shards.totals()
+
+    def merge(self, totals: List[float], other: List[float]) -> List[float]:
+        """
+        Combines the totals of the same sample recorded by two workers.
+        """
+
+        return [value + other_value for value, other_value in zip(totals, other)]
+
+    def labels(self, *labelvalues, **labelkwargs) -> "Metric":
+        """
+        Returns the child metric for the given label values.
+        """
+
+        if labelkwargs:
+            labelvalues = tuple(labelkwargs[name] for name in self.labelnames)
+
+        key = tuple(str(value) for value in labelvalues)
+
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames}, got {key}")
+
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+
+        return child
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], "Metric"]]:
+        """
+        Returns a list of (label values, metric) pairs of this metric.
+        """
+
+        if self.labelnames:
+            return list(self._children.items())
+
+        return [((), self)]
+
+
+class ThreadShards:
+    """
+    Per-thread cells of a metric. Only the owning thread writes to its cell, so recording
+    needs no lock, and reading sums all cells.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._cells: Dict[int, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def cell(self) -> List[float]:
+        thread_id = threading.get_ident()
+        cell = self._cells.get(thread_id)
+        if cell is None:
+            with self._lock:
+                cell = self._cells.setdefault(thread_id, [0.0] * self.size)
+        return cell
+
+    def totals(self) -> List[float]:
+        totals = [0.0] * self.size
+        for cell in list(self._cells.values()):
+            for idx, value in enumerate(cell):
+                totals[idx] += value
+        return totals
+
+    def reset(self):
+        for cell in list(self._cells.values()):
+            cell[:] = [0.0] * self.size
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._shards = ThreadShards(1)
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation, registry=None)
+
+    @property
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+    def inc(self, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Counters can only be increased.")
+        self._shards.cell()[0] += amount
+
+    def render(
+        self, name: str, labels: Dict[str, str], totals: List[float]
+    ) -> List[str]:
+        return [f"{name}{format_labels(labels)} {format_value(totals[0])}"]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. `merge` sets how the values of several workers are
+    combined: "sum" for amounts such as requests in flight, "min" or "max" for states
+    and durations that each worker records for itself.
+    """
+
+    metric_type = "gauge"
+
+    def __init__(self, *args, merge: str = "sum", **kwargs):
+        if merge not in ("sum", "min", "max"):
+            raise ValueError(f"Unknown gauge merge mode `{merge}`")
+
+        self.merge_mode = merge
+        super().__init__(*args, **kwargs)
+        self._shards = ThreadShards(1)
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(
+            self.name, self.documentation, merge=self.merge_mode, registry=None
+        )
+
+    def merge(self, totals: List[float], other: List[float]) -> List[float]:
+        if self.merge_mode == "min":
+            return [min(totals[0], other[0])]
+        if self.merge_mode == "max":
+            return [max(totals[0], other[0])]
+        return super().merge(totals, other)
+
+    @property
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+    def set(self, value: float):
+        with self._lock:
+            self._shards.reset()
+            self._shards.cell()[0] = value
+
+    def inc(self, amount: float = 1.0):
+        self._shards.cell()[0] += amount
+
+    def dec(self, amount: float = 1.0):
+        self._shards.cell()[0] -= amount
+
+    @contextmanager
+    def track_inprogress(self):
+        """
+        Increases the gauge while the block is running.
+        """
+
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def render(
+        self, name: str, labels: Dict[str, str], totals: List[float]
+    ) -> List[str]:
+        return [f"{name}{format_labels(labels)} {format_value(totals[0])}"]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self, *args, buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS, **kwargs
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+        # one count per bucket and the +Inf bucket, then the sum and the count
+        self._shards = ThreadShards(len(self.buckets) + 3)
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(
+            self.name, self.documentation, buckets=self.buckets, registry=None
+        )
+
+    @property
+    def bucket_counts(self) -> List[int]:
+        return [int(count) for count in self._shards.totals()[:-2]]
+
+    @property
+    def sum(self) -> float:
+        return self._shards.totals()[-2]
+
+    @property
+    def count(self) -> int:
+        return int(self._shards.totals()[-1])
+
+    def observe(self, value: float):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-2] += value
+        cell[-1] += 1
+
+    def render(
+        self, name: str, labels: Dict[str, str], totals: List[float]
+    ) -> List[str]:
+        lines, cumulative = [], 0
+        for upper_bound, count in zip(self.buckets + (math.inf,), totals[:-2]):
+            cumulative += count
+            bucket_labels = format_labels({**labels, "le": format_value(upper_bound)})
+            lines.append(f"{name}_bucket{bucket_labels} {format_value(cumulative)}")
+
+        lines.append(f"{name}_sum{format_labels(labels)} {format_value(totals[-2])}")
+        lines.append(f"{name}_count{format_labels(labels)} {format_value(totals[-1])}")
+
+        return lines
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def escape(value: str, quote: bool = False) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"') if quote else value
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    pairs = (f'{name}="{escape(value, quote=True)}"' for name, value in labels.items())
+    return "{" + ",".join(pairs) + "}"
+
+
+def published_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"{pid}.json")
+
+
+def publish(registry: MetricRegistry = REGISTRY, gauges: bool = True):
+    """
+    Writes the values of this process to the shared directory of the registry. The file is
+    replaced atomically, so readers never see a partial write and the published counters
+    never go backwards.
+
+    Args:
+        registry (MetricRegistry, optional): The registry to publish. Defaults to `REGISTRY`.
+        gauges (bool, optional): Whether to publish the gauges, which only make sense while
+            the process is alive. Defaults to True.
+    """
+
+    path = published_path(registry.shared_dir, os.getpid())
+
+    with registry._publish_lock:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(registry.snapshot(gauges=gauges), f)
+        os.replace(f"{path}.tmp", path)
+
+
+def retire(pid: int, registry: MetricRegistry = REGISTRY):
+    """
+    Drops the gauges published by an exited worker, its counters and histograms keep
+    counting towards the totals of the server.
+    """
+
+    path = published_path(registry.shared_dir, pid)
+
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    snapshot = {
+        name: samples
+        for name, samples in snapshot.items()
+        if not isinstance(registry.get(name), Gauge)
+    }
+
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_published(directory: str) -> List[Dict[str, List]]:
+    """
+    Reads the values published by all processes to a shared directory.
+    """
+
+    snapshots = []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if not entry.name.endswith(".json"):
+            continue
+
+        try:
+            with open(entry.path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # the file of a worker may be removed while reading the directory
+            continue
+
+    return snapshots
+
+
+def merge_snapshots(
+    registry: MetricRegistry, snapshots: List[Dict[str, List]]
+) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+    """
+    Combines the snapshots of several processes into {name: {label values: totals}}.
+    """
+
+    merged: Dict[str, Dict[Tuple[str, ...], List[float]]] = {}
+    for snapshot in snapshots:
+        for name, samples in snapshot.items():
+            metric = registry.get(name)
+            if metric is None:
+                continue
+
+            metric_samples = merged.setdefault(name, {})
+            for labelvalues, totals in samples:
+                key = tuple(labelvalues)
+                if key in metric_samples:
+                    totals = metric.merge(metric_samples[key], totals)
+                metric_samples[key] = totals
+
+    return merged
+
+
+def generate_latest(registry: MetricRegistry = REGISTRY) -> str:
+    """
+    Renders all metrics of a registry in the Prometheus text exposition format. With a
+    shared directory, the values of this process are published first and the values of
+    all processes are rendered.
+
+    Args:
+        registry (MetricRegistry, optional): The registry to render. Defaults to `REGISTRY`.
+
+    Returns:
+        str: The metrics in the Prometheus text format, version 0.0.4.
+    """
+
+    if registry.shared_dir is None:
+        snapshots = [registry.snapshot()]
+    else:
+        publish(registry)
+        snapshots = read_published(registry.shared_dir)
+
+    merged = merge_snapshots(registry, snapshots)
+
+    lines = []
+    for metric in list(registry.metrics.values()):
+        lines.append(f"# HELP {metric.name} {escape(metric.documentation)}")
+        lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+
+        for labelvalues, totals in merged.get(metric.name, {}).items():
+            lines.extend(
+                metric.render(
+                    metric.name, dict(zip(metric.labelnames, labelvalues)), totals
+                )
+            )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,137 @@
+import json
+import pydantic_core
+
+from typing import Any, List, Type
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from fastapi import Depends, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+
+
+def _is_plain_json(value: Any) -> bool:
+    """
+    Checks whether a dumped value only holds JSON types: strings, numbers, booleans, null,
+    lists and objects with string or integer keys. Other values are left to `JSONResponse`.
+    """
+
+    if value is None or isinstance(value, (str, int, float)):
+        return True
+
+    if isinstance(value, dict):
+        return all(
+            isinstance(key, (str, int)) and _is_plain_json(item)
+            for key, item in value.items()
+        )
+
+    if isinstance(value, (list, tuple)):
+        return all(_is_plain_json(item) for item in value)
+
+    return False
+
+
+def _has_floats(value: Any) -> bool:
+    if isinstance(value, float):
+        return True
+
+    if isinstance(value, dict):
+        return any(_has_floats(item) for item in value.values())
+
+    if isinstance(value, (list, tuple)):
+        return any(_has_floats(item) for item in value)
+
+    return False
+
+
+def _encode_float(value: float) -> bytes:
+    # `json.dumps(allow_nan=False)` formats floats with `float.__repr__`
+    if value != value or value in (float("inf"), float("-inf")):
+        raise ValueError(f"Out of range float values are not JSON compliant: {value!r}")
+
+    return float.__repr__(value).encode("utf-8")
+
+
+def _encode(value: Any, parts: List[bytes]):
+    """
+    Encodes a plain JSON value like `json.dumps` with the arguments of `JSONResponse`, but
+    with the strings, where the time goes, encoded by `pydantic_core.to_json`.
+    """
+
+    if isinstance(value, float):
+        parts.append(_encode_float(value))
+    elif isinstance(value, dict):
+        parts.append(b"{")
+        for idx, (key, item) in enumerate(value.items()):
+            if idx:
+                parts.append(b",")
+            # `json.dumps` turns integer and boolean keys into strings, e.g. "1" or "true"
+            if not isinstance(key, str):
+                key = json.dumps(key)
+            parts.append(pydantic_core.to_json(key))
+            parts.append(b":")
+            _encode(item, parts)
+        parts.append(b"}")
+    elif isinstance(value, (list, tuple)):
+        parts.append(b"[")
+        for idx, item in enumerate(value):
+            if idx:
+                parts.append(b",")
+            _encode(item, parts)
+        parts.append(b"]")
+    else:
+        parts.append(pydantic_core.to_json(value))
+
+
+class ModelJSONResponse(JSONResponse):
+    """
+    A JSON response rendered straight from a pydantic model.
+
+    FastAPI runs `jsonable_encoder` over returned models, which walks every field in Python
+    before the response is encoded. This response dumps the model once and encodes it with
+    `pydantic_core.to_json`, which is several times faster than `json.dumps` on long text.
+    Both escape strings the same way but format floats differently (1e-5 vs 1e-05), so
+    floats are formatted like `json.dumps` and the body is byte-for-byte identical to the
+    body of `JSONResponse`.
+    """
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            content = content.model_dump()
+
+        if not _is_plain_json(content):
+            return super().render(content)
+
+        if not _has_floats(content):
+            return pydantic_core.to_json(content)
+
+        parts = []
+        _encode(content, parts)
+        return b"".join(parts)
+
+
+def json_body(body_type: Type) -> Any:
+    """
+    Creates a dependency that parses and validates a JSON request body in a single pass
+    with `TypeAdapter.validate_json`, instead of `json.loads` followed by validation.
+
+    Args:
+        body_type (Type): The type of the body, e.g. a pydantic model or `List[Model]`.
+
+    Returns:
+        Any: A `Depends` marker to use as the default value of the body parameter.
+    """
+
+    adapter = TypeAdapter(body_type)
+
+    async def parse(request: Request):
+        body = await request.body()
+        try:
+            return adapter.validate_json(body)
+        except ValidationError as e:
+            # same error layout as the body validation of FastAPI
+            errors = [
+                {**error, "loc": ("body", *error["loc"])}
+                for error in e.errors(include_url=False)
+            ]
+            raise RequestValidationError(errors, body=body)
+
+    return Depends(parse)
@@ -1,7 +1,154 @@
-import torch
+import os
+import queue
+import atexit
+import random
 import logging
+import pydantic
+import contextvars
+import pydantic_core
+import logging.handlers
 
 from datetime import datetime
+from typing import Any, Dict, List
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """
+    Parses per-route sampling rates, e.g. "/function_calling=0.1,/guardrails=0.01".
+    """
+
+    rates = {}
+    for item in value.split(","):
+        if item.strip():
+            route, rate = item.split("=")
+            rates[route.strip()] = float(rate)
+
+    return rates
+
+
+# Log level of the model server, payloads are only logged in full at DEBUG
+LOG_LEVEL = os.getenv("CURVE_LOG_LEVEL", "INFO").upper()
+
+# Characters of a payload logged above DEBUG, 0 to only log payloads at DEBUG
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("CURVE_LOG_PAYLOAD_MAX_CHARS", 1024))
+
+# Fraction of requests whose payloads are logged, by route and for other routes
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("CURVE_LOG_SAMPLE_RATES", ""))
+LOG_DEFAULT_SAMPLE_RATE = float(os.getenv("CURVE_LOG_SAMPLE_RATE", 1.0))
+
+# Whether the payloads of the current request are logged, requests outside a route are
+_log_sampled = contextvars.ContextVar("log_sampled", default=True)
+
+
+def _bound_payload(value: Any, budget: List[int]) -> Any:
+    """
+    Copies a payload, cutting strings and containers once `budget[0]` characters are used,
+    so that serializing the copy costs O(budget) however large the payload is. Each value
+    is charged less than its JSON size, so the JSON of the copy starts like the JSON of the
+    payload and is longer than the budget whenever the JSON of the payload is.
+    """
+
+    if budget[0] <= 0:
+        return None
+
+    if isinstance(value, str):
+        remaining = budget[0]
+        budget[0] -= len(value) + 1
+        return value[:remaining]
+
+    if isinstance(value, pydantic.BaseModel):
+        value = {name: getattr(value, name) for name in type(value).model_fields}
+
+    if isinstance(value, dict):
+        budget[0] -= 1
+        bounded = {}
+        for key, item in value.items():
+            if budget[0] <= 0:
+                break
+            budget[0] -= len(str(key)) + 1
+            bounded[key] = _bound_payload(item, budget)
+        return bounded
+
+    if isinstance(value, (list, tuple)):
+        budget[0] -= 1
+        bounded = []
+        for item in value:
+            if budget[0] <= 0:
+                break
+            bounded.append(_bound_payload(item, budget))
+        return bounded
+
+    budget[0] -= 1
+    return value
+
+
+class LazyJSON:
+    """
+    A log argument that serializes its payload only when the record is emitted. With
+    `max_chars`, only the part of the payload that can appear in the output is serialized.
+
+    Attributes:
+        payload (Any): A JSON-serializable object or a pydantic model.
+        max_chars (int): The maximum number of characters to log, 0 for no limit.
+    """
+
+    __slots__ = ("payload", "max_chars")
+
+    def __init__(self, payload: Any, max_chars: int = 0):
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self):
+        if not self.max_chars:
+            return pydantic_core.to_json(self.payload, fallback=str).decode("utf-8")
+
+        payload = _bound_payload(self.payload, [self.max_chars])
+        text = pydantic_core.to_json(payload, fallback=str).decode("utf-8")
+
+        if len(text) > self.max_chars:
+            return f"{text[: self.max_chars]}... (truncated)"
+
+        return text
+
+
+def sample_request_logs(route: str):
+    """
+    Decides once per request whether the payloads of the request are logged.
+    """
+
+    rate = LOG_SAMPLE_RATES.get(route, LOG_DEFAULT_SAMPLE_RATE)
+    _log_sampled.set(rate >= 1.0 or random.random() < rate)
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any):
+    """
+    Logs a request or response payload of a sampled request, in full at DEBUG and
+    truncated to `LOG_PAYLOAD_MAX_CHARS` at INFO.
+    """
+
+    if not _log_sampled.get():
+        return
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[%s]: %s", label, LazyJSON(payload))
+    elif LOG_PAYLOAD_MAX_CHARS > 0 and logger.isEnabledFor(logging.INFO):
+        logger.info("[%s]: %s", label, LazyJSON(payload, LOG_PAYLOAD_MAX_CHARS))
+
+
+# Writes the records of the queue handler to the console
+_log_listener: logging.handlers.QueueListener = None
+
+
+def stop_log_listener():
+    """
+    Writes the pending records and stops the listener, e.g. before a worker calls `os._exit`.
+    """
+
+    global _log_listener
+
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
 
 
 def get_server_logger():
@@ -19,17 +166,39 @@ def get_server_logger():
     if logger.hasHandlers():
         return logger
 
-    # Configure logging to only log to console
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        handlers=[logging.StreamHandler()],
+    # Write to the console on a listener thread, so that requests only enqueue records
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     )
 
+    # the console handler formats the record, the queue handler only renders the message
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def start_listener():
+        global _log_listener
+
+        # a fresh queue, the listener thread of a parent process is not forked
+        queue_handler.queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(
+            queue_handler.queue, console_handler
+        )
+        _log_listener.start()
+
+    start_listener()
+    atexit.register(stop_log_listener)
+    os.register_at_fork(after_in_child=start_listener)
+
+    logging.basicConfig(level=LOG_LEVEL, handlers=[queue_handler])
+
     return logger
 
 
 def get_device():
+    # torch is only needed here, the function calling path does not load it
+    import torch
+
     if torch.cuda.is_available():
         device = "cuda"
     elif torch.backends.mps.is_available():
@@ -1,26 +1,80 @@
+import os
 import ast
 import json
+import time
+import asyncio
 import random
 import builtins
 import textwrap
 import src.commons.utils as utils
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 from typing import Any, Dict, List
 from overrides import override
-from src.core.utils.hallucination_utils import HallucinationState
+from src.commons.cache import LRUCache, fingerprint
+from src.commons.metrics import Counter, Histogram
+from src.core.utils.hallucination_utils import (
+    END_TOOL_CALL_TOKEN,
+    HallucinationState,
+    check_threshold,
+)
 from src.core.utils.model_utils import (
     Message,
     ChatMessage,
     Choice,
     ChatCompletionResponse,
     CurveBaseHandler,
+    PipelineContext,
 )
 
 
 logger = utils.get_server_logger()
 
 
+# Request metadata key to skip the intent cache, e.g. {"x-curve-intent-cache": "bypass"}
+INTENT_CACHE_METADATA_KEY = "x-curve-intent-cache"
+
+INTENT_CACHE_REQUESTS = Counter(
+    "curve_intent_cache_requests_total",
+    "Curve-Intent cache lookups by result (hit, miss or bypass).",
+    ["result"],
+)
+
+FUNCTION_STREAM_CANCELLATIONS = Counter(
+    "curve_function_stream_cancellations_total",
+    "Curve-Function streams closed before the end of generation by reason (no_tool_call or hallucination).",
+    ["reason"],
+)
+FUNCTION_SAVED_TOKENS = Counter(
+    "curve_function_saved_tokens_total",
+    "Upper bound of the tokens not generated because a Curve-Function stream was closed early.",
+)
+FUNCTION_LATENCY_SECONDS = Histogram(
+    "curve_function_latency_seconds",
+    "Curve-Function latency by path (tool_call, prefill or hedged_prefill).",
+    ["path"],
+)
+HEDGED_PREFILLS = Counter(
+    "curve_function_hedged_prefills_total",
+    "Parameter gathering requests started before the end of the stream, by outcome (used or cancelled).",
+    ["outcome"],
+)
+FUNCTION_HALLUCINATIONS = Counter(
+    "curve_function_hallucinations_total",
+    "Curve-Function streams in which a hallucinated parameter was detected.",
+)
+FUNCTION_PARAMETER_GATHERINGS = Counter(
+    "curve_function_parameter_gatherings_total",
+    "Parameter gathering (prefill) requests engaged, by reason (hallucination or no_tool_call).",
+    ["reason"],
+)
+FUNCTION_INVALID_TOOL_CALLS = Counter(
+    "curve_function_invalid_tool_calls_total",
+    "Generated tool calls that failed validation, by reason (extraction or verification).",
+    ["reason"],
+)
+
+
 class CurveIntentConfig:
     TASK_PROMPT = textwrap.dedent(
         """
@@ -54,14 +108,20 @@ class CurveIntentConfig:
         "stop_token_ids": [151645],
     }
 
+    # Intent decisions are near-deterministic, so they are cached per tools and conversation
+    CACHE_CONFIG = {
+        "max_size": int(os.getenv("CURVE_INTENT_CACHE_SIZE", "4096")),
+        "ttl": float(os.getenv("CURVE_INTENT_CACHE_TTL", "300")),
+    }
+
 
 class CurveIntentHandler(CurveBaseHandler):
-    def __init__(self, client: OpenAI, model_name: str, config: CurveIntentConfig):
+    def __init__(self, client: AsyncOpenAI, model_name: str, config: CurveIntentConfig):
         """
         Initializes the intent handler.
 
         Args:
-            client (OpenAI): An OpenAI client instance.
+            client (AsyncOpenAI): An async OpenAI client instance.
             model_name (str): Name of the model to use.
             config (CurveIntentConfig): The configuration for Curve-Intent.
         """
@@ -77,6 +137,8 @@ class CurveIntentHandler(CurveBaseHandler):
 
         self.extra_instruction = config.EXTRA_INSTRUCTION
 
+        self.cache = LRUCache(**config.CACHE_CONFIG)
+
     @override
     def _convert_tools(self, tools: List[Dict[str, Any]]) -> str:
         """
@@ -94,6 +156,41 @@ class CurveIntentHandler(CurveBaseHandler):
         ]
         return "\n".join(converted)
 
+    def _get_cache_key(
+        self, tools_fingerprint: str, messages: List[Dict[str, str]]
+    ) -> str:
+        """
+        Builds the cache key of an intent decision from the tools and the processed messages.
+
+        Args:
+            tools_fingerprint (str): The fingerprint of the request tools.
+            messages (List[Dict[str, str]]): The processed messages sent to the model.
+
+        Returns:
+            str: A stable cache key.
+        """
+
+        # the system prompt is derived from the tools, so only the conversation is hashed
+        conversation = [
+            [message["role"], " ".join((message["content"] or "").split())]
+            for message in messages
+            if message["role"] != "system"
+        ]
+
+        return tools_fingerprint + fingerprint(conversation)
+
+    def _use_cache(self, req: ChatMessage) -> bool:
+        """
+        Checks whether the intent cache can be used for a given request.
+        """
+
+        if not self.cache.enabled:
+            return False
+
+        metadata = req.metadata or {}
+
+        return metadata.get(INTENT_CACHE_METADATA_KEY, "").lower() != "bypass"
+
     def detect_intent(self, content: str) -> bool:
         """
         Detect if any intent match with prompts
@@ -110,12 +207,15 @@ class CurveIntentHandler(CurveBaseHandler):
             return False
 
     @override
-    async def chat_completion(self, req: ChatMessage) -> ChatCompletionResponse:
+    async def chat_completion(
+        self, req: ChatMessage, ctx: PipelineContext = None
+    ) -> ChatCompletionResponse:
         """
         Generates a chat completion for a given request.
 
         Args:
             req (ChatMessage): A chat message request object.
+            ctx (PipelineContext, optional): The per-request pipeline context.
 
         Returns:
             ChatCompletionResponse: The model's response to the chat request.
@@ -125,29 +225,56 @@ class CurveIntentHandler(CurveBaseHandler):
         """
         logger.info("[Curve-Intent] - ChatCompletion")
 
+        if ctx is None:
+            ctx = PipelineContext(req)
+
         # In the case that no tools are available, simply return `No` to avoid making a call
         if len(req.tools) == 0:
             model_response = Message(content="No", tool_calls=[])
             logger.info("No tools found, return `No` as the model response.")
         else:
             messages = self._process_messages(
-                req.messages, req.tools, self.extra_instruction
+                req.messages,
+                req.tools,
+                self.extra_instruction,
+                tools_fingerprint=ctx.tools_fingerprint,
             )
 
-            logger.info(f"[request]: {json.dumps(messages)}")
+            utils.log_payload(logger, "request", messages)
 
-            model_response = self.client.chat.completions.create(
-                messages=messages,
-                model=self.model_name,
-                stream=False,
-                extra_body=self.generation_params,
-            )
+            use_cache = self._use_cache(req)
 
-            logger.info(f"[response]: {json.dumps(model_response.model_dump())}")
+            content = None
+            if use_cache:
+                cache_key = self._get_cache_key(ctx.tools_fingerprint, messages)
+                content = self.cache.get(cache_key)
 
-            model_response = Message(
-                content=model_response.choices[0].message.content, tool_calls=[]
-            )
+            if content is not None:
+                INTENT_CACHE_REQUESTS.labels(result="hit").inc()
+                logger.info(f"[response]: `{content}` (cached)")
+            else:
+                INTENT_CACHE_REQUESTS.labels(
+                    result="miss" if use_cache else "bypass"
+                ).inc()
+
+                model_response = await ctx.run_stage(
+                    "intent",
+                    self.client.chat.completions.create(
+                        messages=messages,
+                        model=self.model_name,
+                        stream=False,
+                        extra_body=self.generation_params,
+                    ),
+                )
+
+                utils.log_payload(logger, "response", model_response)
+
+                content = model_response.choices[0].message.content
+
+                if use_cache and content is not None:
+                    self.cache.put(cache_key, content)
+
+            model_response = Message(content=content, tool_calls=[])
 
         chat_completion_response = ChatCompletionResponse(
             choices=[Choice(message=model_response)], model=self.model_name
@@ -218,13 +345,22 @@ class CurveFunctionConfig:
         ],
     }
 
+    # Start parameter gathering as soon as a checked token is uncertain at `threshold_ratio`
+    # times the hallucination thresholds, and race it against the rest of the stream
+    HEDGE_CONFIG = {
+        "enabled": os.getenv("CURVE_HEDGED_PREFILL", "false").lower() == "true",
+        "threshold_ratio": float(
+            os.getenv("CURVE_HEDGED_PREFILL_THRESHOLD_RATIO", "0.5")
+        ),
+    }
+
     SUPPORT_DATA_TYPES = ["int", "float", "bool", "str", "list", "tuple", "set", "dict"]
 
 
 class CurveFunctionHandler(CurveBaseHandler):
     def __init__(
         self,
-        client: OpenAI,
+        client: AsyncOpenAI,
         model_name: str,
         config: CurveFunctionConfig,
     ):
@@ -232,7 +368,7 @@ class CurveFunctionHandler(CurveBaseHandler):
         Initializes the function handler.
 
         Args:
-            client (OpenAI): An OpenAI client instance.
+            client (AsyncOpenAI): An async OpenAI client instance.
             model_name (str): Name of the model to use.
             config (CurveFunctionConfig): The configuration for Curve-Function
         """
@@ -249,7 +385,8 @@ class CurveFunctionHandler(CurveBaseHandler):
         self.prefill_params = config.PREFILL_CONFIG["prefill_params"]
         self.prefill_prefix = config.PREFILL_CONFIG["prefill_prefix"]
 
-        self.hallucination_state = None
+        self.hedge_prefill = config.HEDGE_CONFIG["enabled"]
+        self.hedge_threshold_ratio = config.HEDGE_CONFIG["threshold_ratio"]
 
         # Predefine data types for verification. Only support Python for now.
         # TODO: Extend the list of support data types
@@ -487,13 +624,13 @@ class CurveFunctionHandler(CurveBaseHandler):
             }
         ]
 
-    def _engage_parameter_gathering(self, messages: List[Dict[str, str]]):
+    async def _engage_parameter_gathering(self, messages: List[Dict[str, str]]):
         """
         Engage parameter gathering for tool calls
         """
 
         # TODO: log enaging parameter gathering
-        prefill_response = self.client.chat.completions.create(
+        prefill_response = await self.client.chat.completions.create(
             messages=self._add_prefill_message(messages),
             model=self.model_name,
             extra_body={
@@ -503,14 +640,87 @@ class CurveFunctionHandler(CurveBaseHandler):
         )
         return prefill_response
 
+    def _is_likely_hallucination(
+        self, hallucination_state: HallucinationState, num_checks: int
+    ) -> bool:
+        """
+        Checks whether the last token, if it was checked, is uncertain at the hedging thresholds.
+
+        Args:
+            hallucination_state (HallucinationState): The hallucination state of the stream.
+            num_checks (int): The number of checked tokens before the last token.
+
+        Returns:
+            bool: True if the last token was checked and exceeds the hedging thresholds.
+        """
+
+        if len(hallucination_state.token_probs_map) == num_checks:
+            return False
+
+        _, entropy, varentropy, _ = hallucination_state.token_probs_map[-1]
+        thd = hallucination_state.HALLUCINATION_THRESHOLD_DICT[
+            hallucination_state.mask[-1].value
+        ]
+
+        return check_threshold(
+            entropy,
+            varentropy,
+            {key: value * self.hedge_threshold_ratio for key, value in thd.items()},
+        )
+
+    @staticmethod
+    async def _cancel_prefill(prefill_task: asyncio.Task):
+        """
+        Cancels a hedged parameter gathering call and waits for it, so that a call that
+        already failed does not leave its exception unretrieved.
+        """
+
+        prefill_task.cancel()
+        await asyncio.gather(prefill_task, return_exceptions=True)
+
+    def _emit_tool_calls(
+        self, req: ChatMessage, ctx: PipelineContext, start: int
+    ) -> int:
+        """
+        Extracts and verifies the tool calls generated since `start` and passes each valid
+        one to `ctx.on_tool_call`.
+
+        Args:
+            req (ChatMessage): A chat message request object.
+            ctx (PipelineContext): The per-request pipeline context.
+            start (int): The index of the first token not emitted yet.
+
+        Returns:
+            int: The index of the first token after the emitted tool calls.
+        """
+
+        tokens = ctx.hallucination_state.tokens
+        extracted = self._extract_tool_calls("".join(tokens[start:]))
+
+        if len(extracted["result"]) and extracted["status"]:
+            verified = self._verify_tool_calls(
+                tools=req.tools, tool_calls=extracted["result"]
+            )
+
+            if verified["status"]:
+                for tool_call in extracted["result"]:
+                    ctx.tool_calls.append(tool_call)
+                    ctx.on_tool_call(tool_call)
+
+        return len(tokens)
+
     @override
-    async def chat_completion(self, req: ChatMessage) -> ChatCompletionResponse:
+    async def chat_completion(
+        self, req: ChatMessage, ctx: PipelineContext = None
+    ) -> ChatCompletionResponse:
         """
         Generates a chat completion response for a given request.
 
         Args:
             req (ChatMessage): A chat message request object.
-            enable_prefilling (bool, optional): Whether to enable prefill responses. Defaults to True.
+            ctx (PipelineContext, optional): The per-request pipeline context. The stream, hallucination
+                state and prefill decision of this request are recorded on it. Defaults to a new context.
+
         Returns:
             ChatCompletionResponse: The model's response to the chat request.
 
@@ -519,80 +729,195 @@ class CurveFunctionHandler(CurveBaseHandler):
         """
         logger.info("[Curve-Function] - ChatCompletion")
 
-        messages = self._process_messages(req.messages, req.tools)
+        start_time = time.perf_counter()
+
+        if ctx is None:
+            ctx = PipelineContext(req)
+
+        messages = self._process_messages(
+            req.messages, req.tools, tools_fingerprint=ctx.tools_fingerprint
+        )
 
-        logger.info(f"[request]: {json.dumps(messages)}")
+        utils.log_payload(logger, "request", messages)
 
         # always enable `stream=True` to collect model responses
-        response = self.client.chat.completions.create(
+        stream_start_time = time.perf_counter()
+        ctx.stream = await self.client.chat.completions.create(
             messages=messages,
             model=self.model_name,
             stream=True,
             extra_body=self.generation_params,
         )
 
-        # initialize the hallucination handler, which is an iterator
-        self.hallucination_state = HallucinationState(
-            response_iterator=response, function=req.tools
-        )
-
         model_response = ""
 
         has_tool_calls, has_hallucination = None, False
-        for _ in self.hallucination_state:
-            # check if the first token is <tool_call>
-            if len(self.hallucination_state.tokens) > 0 and has_tool_calls is None:
-                if self.hallucination_state.tokens[0] == "<tool_call>":
-                    has_tool_calls = True
-                else:
-                    has_tool_calls = False
+        emitted_tokens, stop_reason = 0, None
+        prefill_task: asyncio.Task = None
+        num_checks = 0
+        try:
+            # initialize the hallucination handler, which is an async iterator. Invalid
+            # tools fail here, after the stream was opened, so it is built within the `try`
+            hallucination_state = HallucinationState(
+                response_iterator=ctx.stream, function=req.tools
+            )
+            ctx.hallucination_state = hallucination_state
+
+            async for token in hallucination_state:
+                if "ttft" not in ctx.timings:
+                    ctx.timings["ttft"] = time.perf_counter() - stream_start_time
+
+                # check if the first token is <tool_call>
+                if len(hallucination_state.tokens) > 0 and has_tool_calls is None:
+                    if hallucination_state.tokens[0] == "<tool_call>":
+                        has_tool_calls = True
+                    else:
+                        has_tool_calls = False
+                        stop_reason = "no_tool_call"
+                        break
+
+                # if the model is hallucinating, start parameter gathering
+                if hallucination_state.hallucination is True:
+                    has_hallucination = True
+                    stop_reason = "hallucination"
                     break
 
-            # if the model is hallucinating, start parameter gathering
-            if self.hallucination_state.hallucination is True:
-                has_hallucination = True
-                break
+                # hedge: start parameter gathering early if a hallucination is likely
+                if (
+                    self.hedge_prefill
+                    and prefill_task is None
+                    and self._is_likely_hallucination(hallucination_state, num_checks)
+                ):
+                    logger.info(
+                        f"[Curve-Function] - uncertain token `{token}`, starting parameter gathering"
+                    )
+                    prefill_task = asyncio.create_task(
+                        self._engage_parameter_gathering(messages)
+                    )
+                num_checks = len(hallucination_state.token_probs_map)
+
+                # a tool call is complete once its closing tag arrives
+                if token == END_TOOL_CALL_TOKEN and ctx.on_tool_call is not None:
+                    emitted_tokens = self._emit_tool_calls(req, ctx, emitted_tokens)
+        except BaseException:
+            if prefill_task is not None:
+                await self._cancel_prefill(prefill_task)
+            raise
+        finally:
+            # close the upstream connection so that the backend can abort the generation,
+            # whether the loop stopped early or the request was cancelled
+            await ctx.stream.close()
+
+        if stop_reason is not None:
+            saved_tokens = max(
+                0,
+                self.generation_params["max_tokens"] - len(hallucination_state.tokens),
+            )
+            FUNCTION_STREAM_CANCELLATIONS.labels(reason=stop_reason).inc()
+            FUNCTION_SAVED_TOKENS.inc(saved_tokens)
+            logger.info(
+                f"[Curve-Function] - stream closed early ({stop_reason}), up to {saved_tokens} tokens saved"
+            )
 
-        if has_tool_calls:
-            if has_hallucination:
+        if has_tool_calls and not has_hallucination:
+            model_response = "".join(hallucination_state.tokens)
+            path = "tool_call"
+
+            if prefill_task is not None:
+                await self._cancel_prefill(prefill_task)
+                HEDGED_PREFILLS.labels(outcome="cancelled").inc()
+        elif ctx.tool_calls:
+            # tool calls already streamed to the client are final, so the hallucinated tool
+            # call is dropped instead of gathering parameters, which would contradict them
+            logger.info(f"[Hallucination]: {hallucination_state.error_message}")
+            FUNCTION_HALLUCINATIONS.inc()
+            path = "tool_call"
+
+            if prefill_task is not None:
+                await self._cancel_prefill(prefill_task)
+                HEDGED_PREFILLS.labels(outcome="cancelled").inc()
+        else:
+            if has_tool_calls:
                 # start prompt prefilling if hallcuination is found in tool calls
-                logger.info(
-                    f"[Hallucination]: {self.hallucination_state.error_message}"
-                )
-                prefill_response = self._engage_parameter_gathering(messages)
-                model_response = prefill_response.choices[0].message.content
+                logger.info(f"[Hallucination]: {hallucination_state.error_message}")
+                FUNCTION_HALLUCINATIONS.inc()
+
+            # start parameter gathering if the model is hallucinating or not generating tool calls
+            ctx.prefill = True
+            FUNCTION_PARAMETER_GATHERINGS.labels(
+                reason="hallucination" if has_tool_calls else "no_tool_call"
+            ).inc()
+            prefill_start_time = time.perf_counter()
+            if prefill_task is not None:
+                prefill_response = await ctx.run_stage("prefill", prefill_task)
+                path = "hedged_prefill"
+                HEDGED_PREFILLS.labels(outcome="used").inc()
             else:
-                model_response = "".join(self.hallucination_state.tokens)
-        else:
-            # start parameter gathering if the model is not generating tool calls
-            prefill_response = self._engage_parameter_gathering(messages)
+                prefill_response = await ctx.run_stage(
+                    "prefill", self._engage_parameter_gathering(messages)
+                )
+                path = "prefill"
+            ctx.timings["prefill"] = time.perf_counter() - prefill_start_time
             model_response = prefill_response.choices[0].message.content
 
-        # Extract tool calls from model response
-        extracted = self._extract_tool_calls(model_response)
-
-        if len(extracted["result"]) and extracted["status"]:
-            verified = self._verify_tool_calls(
-                tools=req.tools, tool_calls=extracted["result"]
-            )
+        if has_hallucination and ctx.tool_calls:
+            model_response = Message(content="", tool_calls=list(ctx.tool_calls))
+        else:
+            # Extract tool calls from model response
+            extracted = self._extract_tool_calls(model_response)
 
-            if verified["status"]:
-                logger.info(
-                    f"[Tool calls]: {json.dumps([tool_call['function'] for tool_call in extracted['result']])}"
+            if len(extracted["result"]) and extracted["status"]:
+                verified = self._verify_tool_calls(
+                    tools=req.tools, tool_calls=extracted["result"]
                 )
-                model_response = Message(content="", tool_calls=extracted["result"])
+
+                if verified["status"]:
+                    # keep the ids of the tool calls already emitted while streaming
+                    if not ctx.prefill:
+                        for tool_call, emitted in zip(
+                            extracted["result"], ctx.tool_calls
+                        ):
+                            tool_call["id"] = emitted["id"]
+
+                    logger.info(
+                        "[Tool calls]: %s",
+                        utils.LazyJSON(
+                            [tool_call["function"] for tool_call in extracted["result"]]
+                        ),
+                    )
+                    model_response = Message(content="", tool_calls=extracted["result"])
+                else:
+                    logger.error(f"Invalid tool call - {verified['message']}")
+                    FUNCTION_INVALID_TOOL_CALLS.labels(reason="verification").inc()
+                    # raise ValueError(
+                    #     f"[Curve-Function]: Invalid tool call - {verified['message']}"
+                    # )
+
+                    # keep the tool calls already streamed, dropping the invalid one
+                    if ctx.tool_calls:
+                        model_response = Message(
+                            content="", tool_calls=list(ctx.tool_calls)
+                        )
             else:
-                logger.error(f"Invalid tool call - {verified['message']}")
-                # raise ValueError(
-                #     f"[Curve-Function]: Invalid tool call - {verified['message']}"
-                # )
-        else:
-            model_response = Message(content=model_response, tool_calls=[])
+                if not extracted["status"]:
+                    logger.error(f"Invalid tool call - {extracted['message']}")
+                    FUNCTION_INVALID_TOOL_CALLS.labels(reason="extraction").inc()
+
+                if ctx.tool_calls:
+                    model_response = Message(
+                        content="", tool_calls=list(ctx.tool_calls)
+                    )
+                else:
+                    model_response = Message(content=model_response, tool_calls=[])
 
         chat_completion_response = ChatCompletionResponse(
             choices=[Choice(message=model_response)], model=self.model_name
         )
 
-        logger.info(f"[response]: {json.dumps(chat_completion_response.model_dump())}")
+        FUNCTION_LATENCY_SECONDS.labels(path=path).observe(
+            time.perf_counter() - start_time
+        )
+
+        utils.log_payload(logger, "response", chat_completion_response)
 
         return chat_completion_response
@@ -1,63 +1,284 @@
+import time
 import torch
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import multiprocessing
 import numpy as np
 import src.commons.utils as utils
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Tuple
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from src.commons.cache import LRUCache
+from src.commons.metrics import Counter
 from src.core.utils.model_utils import GuardRequest, GuardResponse
 
 
 logger = utils.get_server_logger()
 
 
+GUARD_CACHE_REQUESTS = Counter(
+    "curve_guard_cache_requests_total",
+    "Curve-Guard result cache lookups by result (hit or miss).",
+    ["result"],
+)
+
+
+class GuardResultCache:
+    """
+    Caches Curve-Guard results by the hash of their normalized input, so that repeated system
+    prompts, canned inputs and retried requests skip the forward pass.
+
+    Results are kept in a bounded in-memory LRU cache. With a `path`, they are also written to
+    a memory-mapped SQLite database, which survives restarts and is shared by process workers.
+
+    Attributes:
+        memory (LRUCache): The in-memory tier.
+        path (str): The path of the on-disk tier, or None to keep results in memory only.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        max_bytes: int = None,
+        path: str = None,
+        mmap_size: int = 256 * 1024 * 1024,
+    ):
+        """
+        Args:
+            max_size (int, optional): The maximum number of results kept in memory. A size of 0 disables the cache. Defaults to 10000.
+            max_bytes (int, optional): The maximum estimated memory of the results kept in memory. Defaults to None.
+            path (str, optional): The path of the SQLite database of the on-disk tier. Defaults to None.
+            mmap_size (int, optional): The number of bytes of the database mapped into memory. Defaults to 256 MiB.
+        """
+
+        self.memory = LRUCache(max_size=max_size, max_bytes=max_bytes)
+        self.path = path if self.memory.enabled else None
+
+        self.mmap_size = mmap_size
+
+        self._db: sqlite3.Connection = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # opened on first use, so that server workers forked after the cache is created
+        # open their own connection instead of sharing one across processes
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            # lets process workers read while another worker writes
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS guard_results "
+                "(key TEXT PRIMARY KEY, prob REAL NOT NULL, verdict INTEGER NOT NULL)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.enabled
+
+    @staticmethod
+    def make_key(
+        task: str, model_name: str, backend: str, threshold: float, text: str
+    ) -> str:
+        """
+        Builds the cache key of a result. Inputs that only differ in whitespace share a key.
+
+        Args:
+            task (str): The task to perform (e.g., "jailbreak").
+            model_name (str): The name of the model producing the result.
+            backend (str): The inference backend of the model, whose scores differ slightly.
+            threshold (float): The threshold of the verdict.
+            text (str): The input text.
+
+        Returns:
+            str: A stable cache key.
+        """
+
+        normalized = " ".join(text.split())
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        return f"{task}:{model_name}:{backend}:{threshold}:{text_hash}"
+
+    def get(self, key: str) -> Tuple[float, bool]:
+        """
+        Looks up a result in memory first, then on disk.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            Tuple[float, bool]: The probability and verdict, or None if the result is not cached.
+        """
+
+        if not self.enabled:
+            return None
+
+        result = self.memory.get(key)
+
+        if result is None and self.path is not None:
+            with self._db_lock:
+                row = (
+                    self._connect()
+                    .execute(
+                        "SELECT prob, verdict FROM guard_results WHERE key = ?", (key,)
+                    )
+                    .fetchone()
+                )
+
+            if row is not None:
+                result = (row[0], bool(row[1]))
+                self.memory.put(key, result)
+
+        GUARD_CACHE_REQUESTS.labels(result="miss" if result is None else "hit").inc()
+
+        return result
+
+    def put(self, key: str, prob: float, verdict: bool):
+        """
+        Stores a result in memory and, if enabled, on disk.
+
+        Args:
+            key (str): The cache key.
+            prob (float): The probability of the positive class.
+            verdict (bool): The verdict of the result.
+        """
+
+        if not self.enabled:
+            return
+
+        self.memory.put(key, (prob, verdict))
+
+        if self.path is not None:
+            with self._db_lock:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO guard_results VALUES (?, ?, ?)",
+                    (key, prob, int(verdict)),
+                )
+                db.commit()
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+
 class CurveGuardHanlder:
-    def __init__(self, model_dict):
+    def __init__(
+        self,
+        model_dict,
+        chunk_batch_size=8,
+        chunk_stride=64,
+        cache: GuardResultCache = None,
+    ):
         """
         Initializes the CurveGuardHanlder with the given model dictionary.
 
         Args:
-            model_dict (dict): A dictionary containing the model, tokenizer, and device information.
+            model_dict (dict): A dictionary containing the model, tokenizer, backend, and device information.
+            chunk_batch_size (int, optional): The number of chunks of a long input scored per forward pass. Defaults to 8.
+            chunk_stride (int, optional): The number of overlapping tokens between consecutive chunks. Defaults to 64.
+            cache (GuardResultCache, optional): The result cache. Defaults to None, which disables caching.
         """
 
         self.model = model_dict["model"]
         self.model_name = model_dict["model_name"]
+        self.backend = model_dict["backend"]
         self.tokenizer = model_dict["tokenizer"]
         self.device = model_dict["device"]
 
+        self.chunk_batch_size = chunk_batch_size
+        self.chunk_stride = chunk_stride
+        self.cache = cache
+
         self.support_tasks = {"jailbreak": {"positive_class": 2, "threshold": 0.5}}
 
-    def _split_text_into_chunks(self, text, max_num_words=300):
+    def _tokenize_into_chunks(self, text, max_length=512):
         """
-        Splits the input text into chunks of up to `max_num_words` words.
+        Tokenizes the input text once into chunks of up to `max_length` tokens. Consecutive
+        chunks overlap by `chunk_stride` tokens, so content at chunk edges is always seen whole.
 
         Args:
             text (str): The input text to be split.
-            max_num_words (int, optional): The maximum number of words in each chunk. Defaults to 300.
+            max_length (int, optional): The maximum number of tokens in each chunk. Defaults to 512.
 
         Returns:
-            List[str]: A list of text chunks.
+            BatchEncoding: The model inputs of all chunks with their character offsets.
         """
 
-        words = text.split()
-
-        chunks = [
-            " ".join(words[i : i + max_num_words])
-            for i in range(0, len(words), max_num_words)
-        ]
-
-        return chunks
+        return self.tokenizer(
+            text,
+            truncation=True,
+            max_length=max_length,
+            stride=self.chunk_stride,
+            return_overflowing_tokens=True,
+            return_offsets_mapping=True,
+            padding=True,
+            return_tensors="pt",
+        )
 
     @staticmethod
     def softmax(x):
         """
-        Computes the softmax of the input array.
+        Computes the softmax of the input array over its last axis.
 
         Args:
-            x (np.ndarray): The input array.
+            x (np.ndarray): The input array, either a single row of logits or a batch of rows.
 
         Returns:
             np.ndarray: The softmax of the input.
         """
-        return np.exp(x) / np.exp(x).sum(axis=0)
+        return np.exp(x) / np.exp(x).sum(axis=-1, keepdims=True)
+
+    def _forward(self, task, inputs) -> np.ndarray:
+        """
+        Runs one forward pass over tokenized inputs.
+
+        Args:
+            task (str): The task to perform (e.g., "jailbreak").
+            inputs (dict): The tokenized model inputs, already on the model device.
+
+        Returns:
+            np.ndarray: The probability of the positive class for each input row.
+        """
+
+        with torch.no_grad():
+            logits = self.model(**inputs).logits.cpu().detach().numpy()
+            probs = CurveGuardHanlder.softmax(logits)[
+                :, self.support_tasks[task]["positive_class"]
+            ]
+
+        return probs
+
+    def _predict_texts(self, task, texts, max_length=512) -> List[float]:
+        """
+        Computes the probability of the positive class for a batch of texts in one padded forward pass.
+
+        Args:
+            task (str): The task to perform (e.g., "jailbreak").
+            texts (List[str]): The input texts to classify.
+            max_length (int, optional): The maximum length for tokenization. Defaults to 512.
+
+        Returns:
+            List[float]: The probability of the positive class for each text.
+        """
+
+        inputs = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=max_length,
+            padding=True,
+            return_tensors="pt",
+        ).to(self.device)
+
+        return self._forward(task, inputs).tolist()
 
     def _predict_text(self, task, text, max_length=512) -> GuardResponse:
         """
@@ -72,27 +293,164 @@ class CurveGuardHanlder:
             GuardResponse: A GuardResponse object containing the prediction.
         """
 
-        inputs = self.tokenizer(
-            text, truncation=True, max_length=max_length, return_tensors="pt"
-        ).to(self.device)
+        prob = self._predict_texts(task, [text], max_length=max_length)[0]
+        verdict = prob > self.support_tasks[task]["threshold"]
 
-        with torch.no_grad():
-            logits = self.model(**inputs).logits.cpu().detach().numpy()[0]
-            prob = CurveGuardHanlder.softmax(logits)[
-                self.support_tasks[task]["positive_class"]
-            ].item()
+        return GuardResponse(task=task, input=text, prob=prob, verdict=verdict)
 
-        verdict = prob > self.support_tasks[task]["threshold"]
+    def _predict_long_text(self, task, text, max_length=512) -> GuardResponse:
+        """
+        Predicts the result for a long text. The text is tokenized into overlapping chunks, which
+        are scored `chunk_batch_size` at a time, stopping at the first batch with a positive chunk.
+
+        Args:
+            task (str): The task to perform (e.g., "jailbreak").
+            text (str): The input text to classify.
+            max_length (int, optional): The maximum number of tokens in each chunk. Defaults to 512.
+
+        Returns:
+            GuardResponse: A GuardResponse object containing the prediction.
+        """
+
+        prob, verdict = 0.0, False
+
+        encoding = self._tokenize_into_chunks(text, max_length)
+        offset_mapping = encoding.pop("offset_mapping")
+        encoding.pop("overflow_to_sample_mapping", None)
+
+        num_chunks = len(encoding["input_ids"])
+        threshold = self.support_tasks[task]["threshold"]
+
+        for start in range(0, num_chunks, self.chunk_batch_size):
+            inputs = {
+                key: value[start : start + self.chunk_batch_size].to(self.device)
+                for key, value in encoding.items()
+            }
+
+            chunk_probs = self._forward(task, inputs)
+            max_idx = int(chunk_probs.argmax())
+
+            if chunk_probs[max_idx] > threshold:
+                prob = chunk_probs[max_idx].item()
+                verdict = True
+
+                # special and padding tokens have empty offsets
+                offsets = offset_mapping[start + max_idx]
+                offsets = offsets[offsets[:, 1] > 0]
+                logger.info(
+                    f"[Curve-Guard] - chunk {start + max_idx + 1}/{num_chunks} "
+                    f"(chars {int(offsets[0, 0])}-{int(offsets[-1, 1])}) exceeds the threshold"
+                )
+                break
 
         return GuardResponse(task=task, input=text, prob=prob, verdict=verdict)
 
-    def predict(self, req: GuardRequest, max_num_words=300) -> GuardResponse:
+    def predict_batch(
+        self, reqs: List[GuardRequest], max_length=512
+    ) -> List[GuardResponse]:
+        """
+        Makes predictions for a batch of GuardRequests. Cached results are returned without
+        inference. Inputs that fit in `max_length` tokens are classified together in one padded
+        forward pass per task, longer inputs are split into chunks.
+
+        Args:
+            reqs (List[GuardRequest]): The GuardRequest objects containing the input text and task.
+            max_length (int, optional): Inputs with more tokens are split into chunks. Defaults to 512.
+
+        Returns:
+            List[GuardResponse]: A GuardResponse object for each request, in the same order.
+
+        Note:
+            currently only support jailbreak check
+        """
+
+        for req in reqs:
+            if req.task not in self.support_tasks:
+                raise NotImplementedError(f"{req.task} is not supported!")
+
+        logger.info(f"[Curve-Guard] - Prediction (batch size: {len(reqs)})")
+
+        results: List[GuardResponse] = [None] * len(reqs)
+        cache_keys: List[str] = [None] * len(reqs)
+
+        uncached: List[int] = []
+        for idx, req in enumerate(reqs):
+            if self.cache is not None and self.cache.enabled:
+                cache_keys[idx] = GuardResultCache.make_key(
+                    req.task,
+                    self.model_name,
+                    self.backend,
+                    self.support_tasks[req.task]["threshold"],
+                    req.input,
+                )
+                cached = self.cache.get(cache_keys[idx])
+
+                if cached is not None:
+                    prob, verdict = cached
+                    results[idx] = GuardResponse(
+                        task=req.task, input=req.input, prob=prob, verdict=verdict
+                    )
+                    continue
+
+            uncached.append(idx)
+
+        # route on the token count, a few words of code, URLs or CJK text can be many tokens.
+        # Every token but a leading word marker and the special tokens covers at least one
+        # byte, so inputs with few enough bytes fit without being tokenized here
+        max_bytes = max_length - self.tokenizer.num_special_tokens_to_add() - 1
+        to_count = [
+            idx for idx in uncached if len(reqs[idx].input.encode()) > max_bytes
+        ]
+        num_tokens = {}
+        if to_count:
+            encoding = self.tokenizer(
+                [reqs[idx].input for idx in to_count],
+                return_attention_mask=False,
+                verbose=False,
+            )
+            for idx, input_ids in zip(to_count, encoding["input_ids"]):
+                num_tokens[idx] = len(input_ids)
+
+        # group short inputs by task so that each group is one forward pass
+        short_inputs: Dict[str, List[int]] = {}
+        for idx in uncached:
+            req = reqs[idx]
+            if num_tokens.get(idx, 0) <= max_length:
+                short_inputs.setdefault(req.task, []).append(idx)
+            else:
+                results[idx] = self._predict_long_text(req.task, req.input, max_length)
+
+        for task, indices in short_inputs.items():
+            probs = self._predict_texts(
+                task, [reqs[idx].input for idx in indices], max_length
+            )
+
+            for idx, prob in zip(indices, probs):
+                results[idx] = GuardResponse(
+                    task=task,
+                    input=reqs[idx].input,
+                    prob=prob,
+                    verdict=prob > self.support_tasks[task]["threshold"],
+                )
+
+        for key, result in zip(cache_keys, results):
+            if key is not None:
+                self.cache.put(key, result.prob, result.verdict)
+
+        for result in results:
+            logger.info(
+                f"[response]: {result.task}: {'True' if result.verdict else 'False'} (prob: {result.prob:.2f})"
+            )
+
+        return results
+
+    def predict(self, req: GuardRequest, max_length=512) -> GuardResponse:
         """
         Makes a prediction based on the GuardRequest input.
 
         Args:
             req (GuardRequest): The GuardRequest object containing the input text and task.
-            max_num_words (int, optional): The maximum number of words in each chunk if splitting is needed. Defaults to 300.
+            max_length (int, optional): Inputs with more tokens are split into chunks. Defaults to 512.
 
         Returns:
             GuardResponse: A GuardResponse object containing the prediction.
@@ -101,45 +459,102 @@ class CurveGuardHanlder:
             currently only support jailbreak check
         """
 
-        if req.task not in self.support_tasks:
-            raise NotImplementedError(f"{req.task} is not supported!")
-
-        logger.info("[Curve-Guard] - Prediction")
-        logger.info(f"[request]: {req.input}")
+        return self.predict_batch([req], max_length)[0]
 
-        if len(req.input.split()) < max_num_words:
-            result = self._predict_text(req.task, req.input)
-        else:
-            prob, verdict = 0.0, False
+    def warm_up(self, seq_lengths=(16, 128, 512), task="jailbreak") -> float:
+        """
+        Runs one forward pass at each sequence length, so that the first requests do not pay
+        for lazy initialization and kernel selection. The result cache is not used.
 
-            # split into chunks if text is long
-            text_chunks = self._split_text_into_chunks(req.input)
+        Args:
+            seq_lengths (Tuple[int], optional): The padded sequence lengths to run. Defaults to (16, 128, 512).
+            task (str, optional): The task to perform. Defaults to "jailbreak".
 
-            for chunk in text_chunks:
-                chunk_result = self._predict_text(req.task, chunk)
+        Returns:
+            float: The warm-up duration in seconds.
+        """
 
-                if chunk_result.verdict:
-                    prob = chunk_result.prob
-                    verdict = True
-                    break
+        start_time = time.perf_counter()
 
-            result = GuardResponse(
-                task=req.task, input=req.input, prob=prob, verdict=verdict
-            )
+        for seq_length in seq_lengths:
+            inputs = self.tokenizer(
+                " ".join(["warm"] * seq_length),
+                truncation=True,
+                max_length=seq_length,
+                padding="max_length",
+                return_tensors="pt",
+            ).to(self.device)
+            self._forward(task, inputs)
 
+        warm_up_latency = time.perf_counter() - start_time
         logger.info(
-            f"[response]: {req.task}: {'True' if result.verdict else 'False'} (prob: {result.prob:.2f})"
+            f"[Curve-Guard] - warmed up at lengths {list(seq_lengths)} in {warm_up_latency:.3f}s"
         )
 
-        return result
+        return warm_up_latency
+
+
+GUARD_BACKENDS = ["eager", "int8", "onnx"]
+
+
+def _load_guard_model(model_name: str, device: str, backend: str):
+    """
+    Loads the Curve-Guard model for the given inference backend.
+
+    Args:
+        model_name (str): The name of the model on the Hugging Face Hub.
+        device (str): The device to use for model inference.
+        backend (str): One of
+            - "eager": fp32 torch eager mode.
+            - "int8": torch dynamic int8 quantization of all linear layers, CPU only.
+            - "onnx": ONNX Runtime export through `optimum`, installed with `pip install optimum[onnxruntime]`.
+
+    Returns:
+        The loaded model, callable with tokenized inputs and returning an output with `logits`.
+    """
+
+    if backend == "eager":
+        return AutoModelForSequenceClassification.from_pretrained(
+            model_name, device_map=device, low_cpu_mem_usage=True
+        )
+
+    if backend == "int8":
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_name, device_map="cpu", low_cpu_mem_usage=True
+        )
+        return torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
 
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+        except ImportError as e:
+            raise ImportError(
+                "The `onnx` backend requires `optimum[onnxruntime]` to be installed."
+            ) from e
 
-def get_guardrail_handler(model_name: str = "curvelaboratory/Curve-Guard", device: str = None):
+        return ORTModelForSequenceClassification.from_pretrained(
+            model_name, export=True
+        )
+
+    raise ValueError(f"Unknown backend `{backend}`, expected one of {GUARD_BACKENDS}")
+
+
+def get_guardrail_handler(
+    model_name: str = "curvelaboratory/Curve-Guard",
+    device: str = None,
+    backend: str = "eager",
+    cache_config: Dict = None,
+):
     """
     Initializes and returns an instance of CurveGuardHanlder based on the specified device.
 
     Args:
+        model_name (str, optional): The name of the model on the Hugging Face Hub.
         device (str, optional): The device to use for model inference (e.g., "cpu" or "cuda"). Defaults to None.
+        backend (str, optional): The inference backend, one of "eager", "int8" or "onnx". Defaults to "eager".
+        cache_config (Dict, optional): The arguments of the GuardResultCache. Defaults to None, which disables caching.
 
     Returns:
         CurveGuardHanlder: An instance of CurveGuardHanlder configured for the specified device.
@@ -148,13 +563,215 @@ def get_guardrail_handler(model_name: str = "curvelaboratory/Curve-Guard", devic
     if device is None:
         device = utils.get_device()
 
+    # quantized and ONNX Runtime models run on CPU
+    if backend != "eager" and device != "cpu":
+        logger.info(
+            f"[Curve-Guard] - `{backend}` backend runs on cpu instead of {device}"
+        )
+        device = "cpu"
+
     guardrail_dict = {
         "device": device,
         "model_name": model_name,
+        "backend": backend,
         "tokenizer": AutoTokenizer.from_pretrained(model_name, trust_remote_code=True),
-        "model": AutoModelForSequenceClassification.from_pretrained(
-            model_name, device_map=device, low_cpu_mem_usage=True
+        "model": _load_guard_model(model_name, device, backend),
+    }
+
+    cache = GuardResultCache(**cache_config) if cache_config else None
+
+    return CurveGuardHanlder(model_dict=guardrail_dict, cache=cache)
+
+
+def check_backend_parity(
+    reference: CurveGuardHanlder,
+    candidate: CurveGuardHanlder,
+    texts: List[str],
+    task: str = "jailbreak",
+    batch_size: int = 16,
+) -> Dict[str, float]:
+    """
+    Compares the predictions of a candidate backend against a reference backend, usually eager.
+
+    Args:
+        reference (CurveGuardHanlder): The reference handler.
+        candidate (CurveGuardHanlder): The handler to check.
+        texts (List[str]): The input texts to classify.
+        task (str, optional): The task to perform. Defaults to "jailbreak".
+        batch_size (int, optional): The number of texts per forward pass. Defaults to 16.
+
+    Returns:
+        Dict[str, float]: The maximum and mean absolute difference of the positive class
+        probability, and the fraction of texts with the same verdict.
+    """
+
+    reference_probs, candidate_probs = [], []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start : start + batch_size]
+        reference_probs.extend(reference._predict_texts(task, batch))
+        candidate_probs.extend(candidate._predict_texts(task, batch))
+
+    reference_probs = np.array(reference_probs)
+    candidate_probs = np.array(candidate_probs)
+    threshold = reference.support_tasks[task]["threshold"]
+
+    diff = np.abs(reference_probs - candidate_probs)
+
+    return {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "verdict_agreement": float(
+            np.mean((reference_probs > threshold) == (candidate_probs > threshold))
         ),
     }
 
-    return CurveGuardHanlder(model_dict=guardrail_dict)
+
+def set_torch_threads(intra_op_threads: int = None, inter_op_threads: int = None):
+    """
+    Sets the torch thread budget of the current process.
+
+    Args:
+        intra_op_threads (int, optional): Threads used inside a single op. Defaults to the torch default.
+        inter_op_threads (int, optional): Threads used to run independent ops. Defaults to the torch default.
+    """
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # can only be set once, before any inter-op parallel work has started
+            logger.warning(f"[Curve-Guard] - Cannot set inter-op threads: {e}")
+
+
+# Handler of a process pool worker, loaded once per worker by `_init_guard_worker`
+_worker_handler: CurveGuardHanlder = None
+
+
+def _init_guard_worker(
+    model_name, device, backend, intra_op_threads, inter_op_threads, cache_config
+):
+    global _worker_handler
+
+    set_torch_threads(intra_op_threads, inter_op_threads)
+    _worker_handler = get_guardrail_handler(model_name, device, backend, cache_config)
+
+
+def _worker_predict_batch(reqs: List[GuardRequest]) -> List[GuardResponse]:
+    return _worker_handler.predict_batch(reqs)
+
+
+def _worker_warm_up(seq_lengths) -> float:
+    return _worker_handler.warm_up(seq_lengths)
+
+
+class CurveGuardExecutor:
+    """
+    Runs Curve-Guard inference on a dedicated worker pool so that forward passes never block
+    the event loop.
+
+    Two executor types are supported:
+        - "thread": a thread pool sharing the handler of this process. Torch releases the GIL
+          during forward passes, so the thread budget below bounds CPU usage.
+        - "process": a process pool where each worker loads its own copy of the model once.
+
+    Attributes:
+        executor_type (str): Either "thread" or "process".
+        num_workers (int): The number of workers in the pool.
+    """
+
+    def __init__(
+        self,
+        handler: CurveGuardHanlder = None,
+        executor_type: str = "thread",
+        num_workers: int = 1,
+        intra_op_threads: int = None,
+        inter_op_threads: int = None,
+        model_name: str = "curvelaboratory/Curve-Guard",
+        device: str = None,
+        backend: str = "eager",
+        cache_config: Dict = None,
+    ):
+        self.handler = handler
+        self.executor_type = executor_type
+        self.num_workers = num_workers
+
+        if executor_type == "thread":
+            if handler is None:
+                raise ValueError("A handler is required for the thread executor.")
+
+            set_torch_threads(intra_op_threads, inter_op_threads)
+            self.executor = ThreadPoolExecutor(
+                max_workers=num_workers, thread_name_prefix="curve-guard"
+            )
+        elif executor_type == "process":
+            # spawn instead of fork, forking a process with running threads is unsafe
+            self.executor = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_guard_worker,
+                initargs=(
+                    model_name,
+                    device,
+                    backend,
+                    intra_op_threads,
+                    inter_op_threads,
+                    cache_config,
+                ),
+            )
+        else:
+            raise ValueError(f"Unknown executor type: {executor_type}")
+
+    async def predict_batch(self, reqs: List[GuardRequest]) -> List[GuardResponse]:
+        """
+        Makes predictions for a batch of GuardRequests on the worker pool.
+
+        Args:
+            reqs (List[GuardRequest]): The GuardRequest objects containing the input text and task.
+
+        Returns:
+            List[GuardResponse]: A GuardResponse object for each request, in the same order.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        if self.executor_type == "thread":
+            return await loop.run_in_executor(
+                self.executor, self.handler.predict_batch, reqs
+            )
+
+        return await loop.run_in_executor(self.executor, _worker_predict_batch, reqs)
+
+    async def warm_up(self, seq_lengths=(16, 128, 512)) -> float:
+        """
+        Warms up the handler of every worker. With a process pool, this also starts the
+        workers and loads their models.
+
+        Args:
+            seq_lengths (Tuple[int], optional): The padded sequence lengths to run. Defaults to (16, 128, 512).
+
+        Returns:
+            float: The warm-up duration in seconds.
+        """
+
+        loop = asyncio.get_running_loop()
+        start_time = time.perf_counter()
+
+        if self.executor_type == "thread":
+            # the workers share one handler
+            await loop.run_in_executor(self.executor, self.handler.warm_up, seq_lengths)
+        else:
+            # workers are busy loading their model, so concurrent jobs spread over them
+            await asyncio.gather(
+                *[
+                    loop.run_in_executor(self.executor, _worker_warm_up, seq_lengths)
+                    for _ in range(self.num_workers)
+                ]
+            )
+
+        return time.perf_counter() - start_time
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
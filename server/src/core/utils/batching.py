@@ -0,0 +1,184 @@
+import time
+import asyncio
+import src.commons.utils as utils
+
+from typing import Any, Awaitable, Callable, List
+from src.commons.metrics import Gauge, Histogram
+
+
+logger = utils.get_server_logger()
+
+
+BATCH_QUEUE_DEPTH = Gauge(
+    "curve_batch_queue_depth",
+    "Number of items waiting to be batched.",
+    ["batcher"],
+)
+BATCH_SIZE = Histogram(
+    "curve_batch_size",
+    "Number of items processed together in one batch.",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_WAIT_SECONDS = Histogram(
+    "curve_batch_wait_seconds",
+    "Time an item waited in the queue before its batch was processed.",
+    ["batcher"],
+)
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests into batches and processes each batch with a single call.
+
+    A batch is closed when it reaches `max_batch_size` items or when its first item has
+    waited `max_wait_ms` milliseconds, whichever comes first. Every caller receives the
+    result at its own position in the batch.
+
+    Attributes:
+        process_batch (Callable): An async function mapping a list of items to a list of results.
+        max_batch_size (int): The maximum number of items in a batch.
+        max_wait_ms (float): The maximum time to wait for more items once a batch is started.
+        max_concurrent_batches (int): The maximum number of batches processed at the same time.
+        name (str): The name of the batcher, used as metric label.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 1,
+        name: str = "default",
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.name = name
+
+        self._queue: asyncio.Queue = None
+        self._worker: asyncio.Task = None
+        self._loop: asyncio.AbstractEventLoop = None
+        self._batch_tasks = set()
+
+        self._queue_depth = BATCH_QUEUE_DEPTH.labels(batcher=name)
+        self._batch_size = BATCH_SIZE.labels(batcher=name)
+        self._wait_seconds = BATCH_WAIT_SECONDS.labels(batcher=name)
+
+    def _ensure_worker(self):
+        loop = asyncio.get_running_loop()
+
+        # the queue and worker are bound to the event loop that serves requests
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Adds an item to the next batch and waits for its result.
+
+        Args:
+            item (Any): The item to process.
+
+        Returns:
+            Any: The result of the item.
+        """
+
+        self._ensure_worker()
+
+        future = self._loop.create_future()
+        self._queue.put_nowait((item, future, time.perf_counter()))
+        self._queue_depth.inc()
+
+        return await future
+
+    async def _collect(self) -> List:
+        """
+        Waits for the first item and collects more items until the batch is full or the wait is over.
+        """
+
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        self._queue_depth.dec(len(batch))
+
+        return batch
+
+    async def _process(self, batch: List):
+        # callers that went away do not need a result
+        batch = [entry for entry in batch if not entry[1].done()]
+        if not batch:
+            return
+
+        try:
+            results = await self.process_batch([item for item, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                # the caller may have gone away while the batch was processed
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+
+            # retry items one by one so that a single bad item does not fail the others
+            logger.warning(
+                f"[{self.name}] - batch failed, retrying items one by one: {e}"
+            )
+            for entry in batch:
+                await self._process([entry])
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self):
+        # while all slots are busy, new items keep accumulating into the next batch
+        slots = asyncio.Semaphore(self.max_concurrent_batches)
+
+        while True:
+            await slots.acquire()
+            batch = await self._collect()
+
+            now = time.perf_counter()
+            self._batch_size.observe(len(batch))
+            for _, _, enqueue_time in batch:
+                self._wait_seconds.observe(now - enqueue_time)
+
+            task = self._loop.create_task(self._process(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+
+    async def close(self):
+        """
+        Stops the worker. Items still in the queue are cancelled.
+        """
+
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+
+        # let the batches already being processed deliver their results
+        await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
+            self._queue_depth.dec()
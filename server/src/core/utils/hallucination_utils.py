@@ -1,7 +1,7 @@
 import json
 import math
-import torch
 import itertools
+import numpy as np
 
 
 from typing import Dict, List, Tuple
@@ -26,6 +26,20 @@ PARAMETER_VALUE_END_TOKEN = ('",', "}}\n", "',")
 
 BRACKETS = {"(": ")", "{": "}", "[": "]"}
 
+LN_2 = math.log(2)
+
+# Patterns matched against the end of the generated content, with spaces removed
+SUFFIX_PATTERNS = (
+    FUNC_NAME_START_PATTERN
+    + FIRST_PARAM_NAME_START_PATTERN
+    + PARAMETER_NAME_END_TOKENS
+    + PARAMETER_NAME_START_PATTERN
+    + PARAMETER_VALUE_START_PATTERN
+    + PARAMETER_VALUE_END_TOKEN
+)
+# Only the last characters of the content can match, so only those are kept
+SUFFIX_LENGTH = max(len(pattern) for pattern in SUFFIX_PATTERNS)
+
 
 # Thresholds
 class MaskToken(Enum):
@@ -65,7 +79,7 @@ def check_threshold(entropy: float, varentropy: float, thd: Dict) -> bool:
     return entropy > thd["entropy"] and varentropy > thd["varentropy"]
 
 
-def calculate_uncertainty(log_probs: List[float]) -> Tuple[float, float]:
+def calculate_uncertainty(log_probs: List[float]) -> Tuple[float, float, float]:
     """
     Calculate the entropy and variance of entropy (varentropy) from log probabilities.
 
@@ -74,18 +88,55 @@ def calculate_uncertainty(log_probs: List[float]) -> Tuple[float, float]:
 
     Returns:
         tuple: A tuple containing:
-            - log_probs (list of float): The input log probabilities as a list.
             - entropy (float): The calculated entropy.
             - varentropy (float): The calculated variance of entropy.
+            - probability (float): The probability of the first (sampled) token.
+    """
+    # plain floats, a handful of top logprobs does not amortize array creation
+    token_probs = [math.exp(log_prob) for log_prob in log_probs]
+    entropy = -sum(lp * p for lp, p in zip(log_probs, token_probs)) / LN_2
+    varentropy = (
+        sum(p * (lp / LN_2) for lp, p in zip(log_probs, token_probs))
+        + len(log_probs) * entropy**2
+    )
+    return entropy, varentropy, token_probs[0]
+
+
+def calculate_uncertainty_batch(
+    log_probs: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the entropy, varentropy and first token probability of many tokens at once.
+
+    Args:
+        log_probs (np.ndarray): A matrix of top log probabilities with one row per token. Rows
+            with fewer top log probabilities are padded with `-inf`, which is ignored.
+
+    Returns:
+        tuple: A tuple of arrays with one value per row, as returned by `calculate_uncertainty`.
     """
-    log_probs = torch.tensor(log_probs)
-    token_probs = torch.exp(log_probs)
-    entropy = -torch.sum(log_probs * token_probs, dim=-1) / math.log(2, math.e)
-    varentropy = torch.sum(
-        token_probs * (log_probs / math.log(2, math.e)) + entropy.unsqueeze(-1) ** 2,
-        dim=-1,
+    log_probs = np.asarray(log_probs, dtype=np.float64)
+    valid = np.isfinite(log_probs)
+    log_probs = np.where(valid, log_probs, 0.0)
+    token_probs = np.where(valid, np.exp(log_probs), 0.0)
+
+    entropy = -np.sum(log_probs * token_probs, axis=-1) / LN_2
+    varentropy = (
+        np.sum(token_probs * (log_probs / LN_2), axis=-1)
+        + valid.sum(axis=-1) * entropy**2
     )
-    return entropy.item(), varentropy.item(), token_probs[0].item()
+    return entropy, varentropy, token_probs[..., 0]
+
+
+def pad_log_probs(log_probs: List[List[float]]) -> np.ndarray:
+    """
+    Stacks top log probabilities of different lengths into a matrix padded with `-inf`.
+    """
+    width = max((len(row) for row in log_probs), default=0)
+    padded = np.full((len(log_probs), width), -np.inf)
+    for idx, row in enumerate(log_probs):
+        padded[idx, : len(row)] = row
+    return padded
 
 
 def is_parameter_required(
@@ -141,6 +192,9 @@ class HallucinationState:
         hallucination_message (str): Message describing the hallucination.
         parameter_name (list): List of extracted parameter names.
         token_probs_map (list): List mapping tokens to their entropy and variance of entropy.
+        content_suffix (str): The last `SUFFIX_LENGTH` characters of the content without spaces.
+        uncertainty (tuple): Precomputed entropy, varentropy and probability arrays with one value
+            per token, used instead of computing them token by token when scoring a full trace.
     """
 
     def __init__(self, response_iterator=None, function=None):
@@ -156,6 +210,8 @@ class HallucinationState:
         self.error_message: str = ""
         self.parameter_name: List[str] = []
         self.token_probs_map: List[Tuple[str, float, float]] = []
+        self.content_suffix: str = ""
+        self.uncertainty: Tuple[np.ndarray, np.ndarray, np.ndarray] = None
         self.response_iterator = response_iterator
         self._process_function(function)
         self.open_bracket = False
@@ -196,6 +252,7 @@ class HallucinationState:
         """
         self.tokens.append(token)
         self.logprobs.append(logprob)
+        self._append_content(token)
         self._process_token()
         return self.hallucination
 
@@ -204,36 +261,56 @@ class HallucinationState:
 
     def __next__(self):
         if self.response_iterator is not None:
-            try:
-                r = next(self.response_iterator)
-                if hasattr(r.choices[0].delta, "content"):
-                    token_content = r.choices[0].delta.content
-                    if token_content:
-                        try:
-                            logprobs = [
-                                p.logprob
-                                for p in r.choices[0].logprobs.content[0].top_logprobs
-                            ]
-                        except Exception as e:
-                            raise ValueError(
-                                f"Error extracting logprobs from response: {e}"
-                            )
-                        if token_content == END_TOOL_CALL_TOKEN:
-                            self._reset_parameters()
-                        else:
-                            self.append_and_check_token_hallucination(
-                                token_content, logprobs
-                            )
-                        return token_content
-            except StopIteration:
-                raise StopIteration
+            return self._process_chunk(next(self.response_iterator))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.response_iterator is not None:
+            return self._process_chunk(await self.response_iterator.__anext__())
+        raise StopAsyncIteration
+
+    def _process_chunk(self, r):
+        """
+        Processes a single streamed chunk from the model response.
+
+        Args:
+            r: A chat completion chunk with `delta` content and top logprobs.
+
+        Returns:
+            str: The token content of the chunk, or None if the chunk carries no content.
+        """
+        if hasattr(r.choices[0].delta, "content"):
+            token_content = r.choices[0].delta.content
+            if token_content:
+                try:
+                    logprobs = [
+                        p.logprob for p in r.choices[0].logprobs.content[0].top_logprobs
+                    ]
+                except Exception as e:
+                    raise ValueError(f"Error extracting logprobs from response: {e}")
+                if token_content == END_TOOL_CALL_TOKEN:
+                    self._reset_parameters()
+                else:
+                    self.append_and_check_token_hallucination(token_content, logprobs)
+                return token_content
+
+    def _append_content(self, token):
+        """
+        Appends a token to the rolling content suffix, so that each token costs O(1)
+        instead of joining all tokens generated so far.
+        """
+        self.content_suffix = (self.content_suffix + token.replace(" ", ""))[
+            -SUFFIX_LENGTH:
+        ]
 
     def _process_token(self):
         """
         Processes the current token and updates the state and mask accordingly.
         Detects hallucinations based on the token type and log probabilities.
         """
-        content = "".join(self.tokens).replace(" ", "")
+        content = self.content_suffix
         if self.tokens[-1] == TOOL_CALL_TOKEN:
             self.mask.append(MaskToken.TOOL_CALL)
             self._check_logprob()
@@ -344,8 +421,13 @@ class HallucinationState:
         Checks the log probability of the current token and updates the token probability map.
         Detects hallucinations based on entropy and variance of entropy.
         """
-        probs = self.logprobs[-1]
-        entropy, varentropy, probability = calculate_uncertainty(probs)
+        if self.uncertainty is not None:
+            idx = len(self.tokens) - 1
+            entropy, varentropy, probability = (
+                values[idx].item() for values in self.uncertainty
+            )
+        else:
+            entropy, varentropy, probability = calculate_uncertainty(self.logprobs[-1])
         self.token_probs_map.append((self.tokens[-1], entropy, varentropy, probability))
 
         if check_threshold(
@@ -392,3 +474,83 @@ class HallucinationState:
         """
         f_len = self._count_consecutive_token(MaskToken.FUNCTION_NAME)
         self.function_name = "".join(self.tokens[:-1][-f_len:])
+
+
+def score_hallucination(
+    tokens: List[str],
+    logprobs: List[List[float]],
+    function: List[Dict],
+    threshold_dict: Dict = None,
+) -> Dict:
+    """
+    Scores a complete generation offline, with the same state machine as the streaming check.
+    Uncertainty is computed for all tokens in one vectorized pass, and every checked token is
+    reported instead of stopping at the first hallucination.
+
+    Args:
+        tokens (List[str]): The generated tokens.
+        logprobs (List[List[float]]): The top log probabilities of each token, the sampled token first.
+        function (List[Dict]): The tools available to the model.
+        threshold_dict (Dict, optional): Thresholds by mask token, defaults to `HALLUCINATION_THRESHOLD_DICT`.
+
+    Returns:
+        Dict: A dictionary of results, including:
+            - "hallucination": A boolean indicating if any checked token is uncertain.
+            - "checks": A list with the function name, parameter name, entropy, varentropy,
+              probability and verdict of each checked token.
+    """
+    if len(tokens) != len(logprobs):
+        raise ValueError(
+            f"Expected one row of logprobs per token, got {len(logprobs)} rows for {len(tokens)} tokens"
+        )
+
+    state = HallucinationState(function=function)
+    if threshold_dict is not None:
+        state.HALLUCINATION_THRESHOLD_DICT = threshold_dict
+
+    # the closing tag is not part of the state machine tokens, as in `_process_chunk`
+    state.uncertainty = calculate_uncertainty_batch(
+        pad_log_probs(
+            [
+                token_logprobs
+                for token, token_logprobs in zip(tokens, logprobs)
+                if token != END_TOOL_CALL_TOKEN
+            ]
+        )
+    )
+
+    checks = []
+    for token, token_logprobs in zip(tokens, logprobs):
+        if token == END_TOOL_CALL_TOKEN:
+            state._reset_parameters()
+            continue
+
+        num_checks = len(state.token_probs_map)
+        state.append_and_check_token_hallucination(token, token_logprobs)
+
+        if len(state.token_probs_map) == num_checks:
+            continue
+
+        _, entropy, varentropy, probability = state.token_probs_map[-1]
+        mask = state.mask[-1]
+        is_value = mask == MaskToken.PARAMETER_VALUE
+
+        checks.append(
+            {
+                "token": token,
+                "mask": mask.value,
+                "function_name": state.function_name if is_value else None,
+                "parameter_name": state.parameter_name[-1] if is_value else None,
+                "entropy": entropy,
+                "varentropy": varentropy,
+                "probability": probability,
+                "hallucination": check_threshold(
+                    entropy, varentropy, state.HALLUCINATION_THRESHOLD_DICT[mask.value]
+                ),
+            }
+        )
+
+    return {
+        "hallucination": any(check["hallucination"] for check in checks),
+        "checks": checks,
+    }
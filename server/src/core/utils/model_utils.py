@@ -1,21 +1,60 @@
+import os
 import json
+import time
+import asyncio
 
-from openai import OpenAI
-from pydantic import BaseModel
-from typing import Any, Dict, List, Optional
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 from overrides import final
+from src.commons.cache import LRUCache, fingerprint
 
 
+# Number of rendered system prompts kept per handler, one entry per distinct tool set
+SYSTEM_PROMPT_CACHE_SIZE = int(os.getenv("CURVE_SYSTEM_PROMPT_CACHE_SIZE", "256"))
+
+# Request budget when the gateway does not send one, as `CURVE_FC_REQUEST_TIMEOUT_MS` of the gateway
+DEFAULT_REQUEST_TIMEOUT_MS = int(os.getenv("CURVE_REQUEST_TIMEOUT_MS", "120000"))
+
+# Upper bound of each pipeline stage in seconds, within the remaining request budget
+STAGE_TIMEOUTS = {
+    "intent": float(os.getenv("CURVE_INTENT_TIMEOUT_S", "30")),
+    "function": float(os.getenv("CURVE_FUNCTION_TIMEOUT_S", "90")),
+    "prefill": float(os.getenv("CURVE_PREFILL_TIMEOUT_S", "30")),
+}
+
+
+# Message of the cancellation of an upstream call that exceeded its stage timeout, which
+# tells it apart from the cancellation of a request whose client went away
+STAGE_TIMEOUT_CANCEL_MESSAGE = "stage timeout"
+
+
+class StageTimeoutError(asyncio.TimeoutError):
+    """
+    Raised when a pipeline stage does not finish within its timeout.
+
+    Attributes:
+        stage (str): The stage that timed out.
+    """
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} timed out after {timeout:.3f}s")
+        self.stage = stage
+
+
+# Mutable defaults of request models are built by a factory, a plain `[]` default is deep
+# copied for every message of a conversation when the request is validated
 class Message(BaseModel):
     role: Optional[str] = ""
     content: Optional[str] = ""
     tool_call_id: Optional[str] = ""
-    tool_calls: Optional[List[Dict[str, Any]]] = []
+    tool_calls: Optional[List[Dict[str, Any]]] = Field(default_factory=list)
 
 
 class ChatMessage(BaseModel):
-    messages: List[Message] = []
-    tools: List[Dict[str, Any]] = []
+    messages: List[Message] = Field(default_factory=list)
+    tools: List[Dict[str, Any]] = Field(default_factory=list)
+    metadata: Optional[Dict[str, str]] = Field(default_factory=dict)
 
 
 class Choice(BaseModel):
@@ -33,6 +72,17 @@ class ChatCompletionResponse(BaseModel):
     metadata: Optional[Dict[str, str]] = {}
 
 
+class BatchItemResponse(BaseModel):
+    index: int
+    status_code: int = 200
+    response: ChatCompletionResponse
+
+
+class BatchChatCompletionResponse(BaseModel):
+    object: Optional[str] = "list"
+    data: List[BatchItemResponse] = []
+
+
 class GuardRequest(BaseModel):
     input: str
     task: str
@@ -46,13 +96,147 @@ class GuardResponse(BaseModel):
     metadata: Optional[Dict[str, str]] = {}
 
 
+class PipelineContext:
+    """
+    Per-request state of the function calling pipeline. Handlers are shared across
+    requests, so everything produced while serving a request is kept here instead.
+
+    Attributes:
+        request (ChatMessage): The request being served.
+        stream: The streamed model response consumed by Curve-Function, if any.
+        hallucination_state (HallucinationState): Hallucination state built over the stream.
+        timings (Dict[str, float]): Latency of each pipeline stage in seconds.
+        prefill (bool): Whether parameter gathering (prompt prefilling) was engaged.
+        tool_calls (List[Dict[str, Any]]): Tool calls emitted while the response was streaming.
+        on_tool_call (Callable): Called with each tool call as soon as it is generated and verified.
+        deadline (float): The `time.monotonic()` time by which the request must be served.
+    """
+
+    def __init__(
+        self,
+        request: ChatMessage,
+        on_tool_call: Callable[[Dict[str, Any]], None] = None,
+        deadline: float = None,
+    ):
+        if deadline is None:
+            deadline = time.monotonic() + DEFAULT_REQUEST_TIMEOUT_MS / 1000
+
+        self.request = request
+        self.deadline = deadline
+        self.stream = None
+        self.hallucination_state = None
+        self.timings: Dict[str, float] = {}
+        self.prefill: bool = False
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.on_tool_call = on_tool_call
+        self._tools_fingerprint: str = None
+        self._held_tool_calls: List[Dict[str, Any]] = None
+        self._on_tool_call_held: Callable[[Dict[str, Any]], None] = None
+
+    @property
+    def tools_fingerprint(self) -> str:
+        """
+        A stable hash of the request tools, computed once and shared by all handlers.
+        """
+
+        if self._tools_fingerprint is None:
+            self._tools_fingerprint = fingerprint(self.request.tools)
+
+        return self._tools_fingerprint
+
+    def hold_tool_calls(self):
+        """
+        Holds back the tool calls passed to `on_tool_call` until `release_tool_calls`, e.g.
+        while a speculative Curve-Function call runs before Curve-Intent has answered.
+        """
+
+        if self.on_tool_call is None or self._held_tool_calls is not None:
+            return
+
+        self._held_tool_calls = []
+        self._on_tool_call_held = self.on_tool_call
+        self.on_tool_call = self._held_tool_calls.append
+
+    def release_tool_calls(self, emit: bool):
+        """
+        Stops holding back tool calls, passing the held ones to `on_tool_call` if `emit`
+        and dropping them otherwise.
+        """
+
+        if self._held_tool_calls is None:
+            return
+
+        held_tool_calls, self._held_tool_calls = self._held_tool_calls, None
+        self.on_tool_call, self._on_tool_call_held = self._on_tool_call_held, None
+
+        if emit:
+            for tool_call in held_tool_calls:
+                self.on_tool_call(tool_call)
+
+    def timeout(self, stage: str) -> float:
+        """
+        The timeout of a stage in seconds, bounded by the remaining request budget.
+        """
+
+        return min(STAGE_TIMEOUTS[stage], self.deadline - time.monotonic())
+
+    async def run_stage(self, stage: str, awaitable: Awaitable) -> Any:
+        """
+        Awaits an upstream call of a stage, cancelling it if it does not finish in time.
+
+        Args:
+            stage (str): The stage of the call, one of `STAGE_TIMEOUTS`.
+            awaitable (Awaitable): The upstream call.
+
+        Returns:
+            Any: The result of the call.
+
+        Raises:
+            StageTimeoutError: If the call does not finish within the timeout of the stage.
+        """
+
+        timeout = max(self.timeout(stage), 0)
+        task = asyncio.ensure_future(awaitable)
+
+        try:
+            await asyncio.wait([task], timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            raise
+
+        if not task.done():
+            task.cancel(STAGE_TIMEOUT_CANCEL_MESSAGE)
+            await asyncio.gather(task, return_exceptions=True)
+            raise StageTimeoutError(stage, timeout)
+
+        try:
+            return task.result()
+        except asyncio.TimeoutError as e:
+            # a timeout of an inner stage is reported as is
+            if isinstance(e, StageTimeoutError):
+                raise
+            raise StageTimeoutError(stage, timeout) from e
+
+    @property
+    def hallucination(self) -> bool:
+        """
+        Whether hallucination was detected while streaming the function call.
+        """
+
+        if self.hallucination_state is None:
+            return False
+
+        return self.hallucination_state.hallucination
+
+
 # ================================================================================================
 
 
 class CurveBaseHandler:
     def __init__(
         self,
-        client: OpenAI,
+        client: AsyncOpenAI,
         model_name: str,
         task_prompt: str,
         tool_prompt_template: str,
@@ -63,7 +247,7 @@ class CurveBaseHandler:
         Initializes the base handler.
 
         Args:
-            client (OpenAI): An OpenAI client instance.
+            client (AsyncOpenAI): An async OpenAI client instance, or an `EndpointPool` of clients.
             model_name (str): Name of the model to use.
             task_prompt (str): The main task prompt for the system.
             tool_prompt (str): A prompt to describe tools.
@@ -79,6 +263,9 @@ class CurveBaseHandler:
 
         self.generation_params = generation_params
 
+        # rendered system prompts keyed by the tools fingerprint
+        self.system_prompt_cache = LRUCache(max_size=SYSTEM_PROMPT_CACHE_SIZE)
+
     def _convert_tools(self, tools: List[Dict[str, Any]]) -> str:
         """
         Converts a list of tools into the desired internal representation.
@@ -93,9 +280,39 @@ class CurveBaseHandler:
         raise NotImplementedError()
 
     @final
-    def _format_system_prompt(self, tools: List[Dict[str, Any]]) -> str:
+    def _format_system_prompt(
+        self, tools: List[Dict[str, Any]], tools_fingerprint: str = None
+    ) -> str:
+        """
+        Formats the system prompt using provided tools. Rendered prompts are cached by the
+        fingerprint of the tools, so a changed tool set always renders a new prompt.
+
+        Args:
+            tools (List[Dict[str, Any]]): A list of tools represented as dictionaries.
+            tools_fingerprint (str, optional): A precomputed `fingerprint(tools)`.
+
+        Returns:
+            str: A formatted system prompt.
+        """
+
+        if not self.system_prompt_cache.enabled:
+            return self._render_system_prompt(tools)
+
+        if tools_fingerprint is None:
+            tools_fingerprint = fingerprint(tools)
+
+        system_prompt = self.system_prompt_cache.get(tools_fingerprint)
+
+        if system_prompt is None:
+            system_prompt = self._render_system_prompt(tools)
+            self.system_prompt_cache.put(tools_fingerprint, system_prompt)
+
+        return system_prompt
+
+    @final
+    def _render_system_prompt(self, tools: List[Dict[str, Any]]) -> str:
         """
-        Formats the system prompt using provided tools.
+        Renders the system prompt using provided tools.
 
         Args:
             tools (List[Dict[str, Any]]): A list of tools represented as dictionaries.
@@ -123,6 +340,7 @@ class CurveBaseHandler:
         tools: List[Dict[str, Any]] = None,
         extra_instruction: str = None,
         max_tokens=4096,
+        tools_fingerprint: str = None,
     ):
         """
         Processes a list of messages and formats them appropriately.
@@ -132,6 +350,7 @@ class CurveBaseHandler:
             tools (List[Dict[str, Any]], optional): A list of tools to include in the system prompt.
             extra_instruction (str, optional): Additional instructions to append to the last user message.
             max_tokens (int): Maximum allowed token count, assuming ~4 characters per token on average.
+            tools_fingerprint (str, optional): A precomputed fingerprint of the tools.
 
         Returns:
             List[Dict[str, Any]]: A list of processed message dictionaries.
@@ -141,7 +360,10 @@ class CurveBaseHandler:
 
         if tools:
             processed_messages.append(
-                {"role": "system", "content": self._format_system_prompt(tools)}
+                {
+                    "role": "system",
+                    "content": self._format_system_prompt(tools, tools_fingerprint),
+                }
             )
 
         for message in messages:
@@ -185,12 +407,15 @@ class CurveBaseHandler:
 
         return processed_messages
 
-    async def chat_completion(self, req: ChatMessage) -> ChatCompletionResponse:
+    async def chat_completion(
+        self, req: ChatMessage, ctx: PipelineContext = None
+    ) -> ChatCompletionResponse:
         """
         Abstract method for generating chat completions.
 
         Args:
             req (ChatMessage): A chat message request object.
+            ctx (PipelineContext, optional): The per-request pipeline context.
 
         Raises:
             NotImplementedError: Method should be overridden in subclasses.
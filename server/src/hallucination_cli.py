@@ -0,0 +1,110 @@
+import sys
+import json
+import argparse
+
+import src.commons.utils as utils
+
+from src.core.utils.hallucination_utils import (
+    HALLUCINATION_THRESHOLD_DICT,
+    score_hallucination,
+)
+
+
+logger = utils.get_server_logger()
+
+
+def rescore_traces(input_file, output_file, threshold_dict=None):
+    """
+    Scores every trace of a JSONL file and writes one result per line.
+
+    Each input line is a JSON object with `tokens`, `logprobs` (the top log probabilities
+    of each token) and `tools`. Any other field, like an `id`, is copied to the result.
+
+    Returns:
+        Tuple[int, int]: The number of traces and the number of traces with hallucination.
+    """
+
+    num_traces, num_hallucinations = 0, 0
+
+    for line_number, line in enumerate(input_file, start=1):
+        if not line.strip():
+            continue
+
+        try:
+            trace = json.loads(line)
+            if not isinstance(trace, dict):
+                raise ValueError(f"expected a JSON object, got {type(trace).__name__}")
+
+            result = score_hallucination(
+                trace.pop("tokens"),
+                trace.pop("logprobs"),
+                trace.pop("tools"),
+                threshold_dict,
+            )
+        except (KeyError, ValueError) as e:
+            logger.error(f"[CLI] - Skipping line {line_number}: {e!r}")
+            continue
+
+        num_traces += 1
+        num_hallucinations += result["hallucination"]
+        output_file.write(json.dumps({**trace, **result}) + "\n")
+
+    return num_traces, num_hallucinations
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-score hallucination on recorded Curve-Function traces."
+    )
+    parser.add_argument(
+        "input",
+        nargs="?",
+        default="-",
+        help="JSONL file of traces with `tokens`, `logprobs` and `tools` (default: stdin).",
+    )
+    parser.add_argument(
+        "--output",
+        default="-",
+        help="JSONL file to write the results to (default: stdout).",
+    )
+    parser.add_argument(
+        "--thresholds",
+        default=None,
+        help="JSON file of thresholds by mask token, overriding the default thresholds.",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Re-score hallucination on a JSONL file of traces, e.g. to evaluate threshold changes.
+    """
+
+    args = parse_args()
+
+    threshold_dict = HALLUCINATION_THRESHOLD_DICT
+    if args.thresholds is not None:
+        with open(args.thresholds) as f:
+            threshold_dict = {**HALLUCINATION_THRESHOLD_DICT, **json.load(f)}
+
+    input_file = sys.stdin if args.input == "-" else open(args.input)
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    try:
+        num_traces, num_hallucinations = rescore_traces(
+            input_file, output_file, threshold_dict
+        )
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    logger.info(
+        f"[CLI] - Scored {num_traces} traces, {num_hallucinations} with hallucination"
+    )
+
+
+if __name__ == "__main__":
+    main()
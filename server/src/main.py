@@ -1,18 +1,51 @@
 import json
 import os
 import time
+import asyncio
 import logging
 import src.commons.utils as utils
 
-from src.commons.globals import handler_map
+from contextlib import asynccontextmanager
+from typing import Annotated, List
+from pydantic import BaseModel
+from src.commons.globals import (
+    CURVE_CLIENT,
+    MODEL_NAMES,
+    handler_map,
+    function_admission,
+    guard_admission,
+    guard_batcher,
+    guard_executor,
+    CURVE_BATCH_MAX_CONCURRENCY,
+    CURVE_FAST_SERIALIZATION,
+    CURVE_SPECULATIVE_FUNCTION_CALLING,
+    CURVE_WARM_UP,
+    CURVE_WARM_UP_CONNECTIONS,
+    CURVE_WARM_UP_SEQ_LENGTHS,
+)
+from src.commons.admission import AdmissionRejected
+from src.commons.serialization import ModelJSONResponse, json_body
+from src.commons.metrics import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
 from src.core.utils.model_utils import (
+    BatchChatCompletionResponse,
+    BatchItemResponse,
     ChatMessage,
     ChatCompletionResponse,
+    DEFAULT_REQUEST_TIMEOUT_MS,
     GuardRequest,
     GuardResponse,
+    PipelineContext,
+    StageTimeoutError,
 )
 
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from opentelemetry import trace
 from opentelemetry.sdk.trace import TracerProvider
 from opentelemetry.sdk.trace.export import BatchSpanProcessor
@@ -48,55 +81,332 @@ logging.getLogger("opentelemetry.exporter.otlp.proto.grpc.exporter").setLevel(
     logging.ERROR
 )
 
-app = FastAPI()
+WARM_UP_SECONDS = Gauge(
+    "curve_warm_up_seconds",
+    "Duration of the startup warm-up by step (guard, connections or total).",
+    ["step"],
+    merge="max",
+)
+READY = Gauge(
+    "curve_ready",
+    "Whether the model server is warmed up and ready to serve requests.",
+    merge="min",
+)
+
+
+async def warm_up():
+    """
+    Runs Curve-Guard forward passes at several sequence lengths and pre-opens connections
+    to the LLM endpoints, so that the first requests are served warm.
+    """
+
+    start_time = time.perf_counter()
+
+    guard_latency = await guard_executor.warm_up(CURVE_WARM_UP_SEQ_LENGTHS)
+    WARM_UP_SECONDS.labels(step="guard").set(guard_latency)
+
+    connections_start_time = time.perf_counter()
+    num_connections = await CURVE_CLIENT.warm_up(CURVE_WARM_UP_CONNECTIONS)
+    WARM_UP_SECONDS.labels(step="connections").set(
+        time.perf_counter() - connections_start_time
+    )
+
+    warm_up_latency = time.perf_counter() - start_time
+    WARM_UP_SECONDS.labels(step="total").set(warm_up_latency)
+    logger.info(
+        f"[Startup] - warmed up in {warm_up_latency:.3f}s, "
+        f"{num_connections} upstream connections opened"
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # models are loaded when `src.commons.globals` is imported, except the Curve-Guard
+    # models of a process pool, which its workers load during the warm-up
+    if CURVE_WARM_UP:
+        await warm_up()
+
+    app.state.ready = True
+    READY.set(1)
+
+    yield
+
+    app.state.ready = False
+    READY.set(0)
+
+    await guard_batcher.close()
+    guard_executor.shutdown()
+
+    guard_handler = handler_map.get("Curve-Guard")
+    if guard_handler is not None and guard_handler.cache is not None:
+        guard_handler.cache.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 FastAPIInstrumentor().instrument_app(app)
 
 
+SPECULATIVE_FUNCTION_CALLS = Counter(
+    "curve_speculative_function_calls_total",
+    "Speculative Curve-Function generations by outcome (used or cancelled).",
+    ["outcome"],
+)
+SPECULATIVE_SAVED_SECONDS = Counter(
+    "curve_speculative_saved_seconds_total",
+    "Latency saved by overlapping Curve-Function with Curve-Intent.",
+)
+SPECULATIVE_WASTED_SECONDS = Counter(
+    "curve_speculative_wasted_seconds_total",
+    "Generation time spent on cancelled speculative Curve-Function calls.",
+)
+SPECULATIVE_WASTED_TOKENS = Counter(
+    "curve_speculative_wasted_tokens_total",
+    "Tokens generated by cancelled speculative Curve-Function calls.",
+)
+REQUEST_TIMEOUTS = Counter(
+    "curve_request_timeouts_total",
+    "Requests that ran out of time, by the pipeline stage that timed out.",
+    ["stage"],
+)
+STAGE_LATENCY_SECONDS = Histogram(
+    "curve_stage_latency_seconds",
+    "Latency of each pipeline stage (intent, function, ttft, prefill or guard).",
+    ["stage"],
+)
+INTENT_RESULTS = Counter(
+    "curve_intent_results_total",
+    "Curve-Intent decisions by result (yes or no).",
+    ["result"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "curve_requests_in_flight",
+    "Requests being served by endpoint, including open streams.",
+    ["endpoint"],
+)
+
+# Request bodies of the hot endpoints, parsed and validated in one pass on the fast path
+if CURVE_FAST_SERIALIZATION:
+    ChatMessageBody = Annotated[ChatMessage, json_body(ChatMessage)]
+    ChatMessageListBody = Annotated[List[ChatMessage], json_body(List[ChatMessage])]
+    GuardRequestBody = Annotated[GuardRequest, json_body(GuardRequest)]
+else:
+    ChatMessageBody = ChatMessage
+    ChatMessageListBody = List[ChatMessage]
+    GuardRequestBody = GuardRequest
+
+# Headers carrying the request budget of the gateway in milliseconds, in order of preference
+REQUEST_TIMEOUT_HEADERS = [
+    "x-envoy-expected-rq-timeout-ms",
+    "x-envoy-upstream-rq-timeout-ms",
+]
+
+
+def get_deadline(request: Request) -> float:
+    """
+    Computes the `time.monotonic()` deadline of a request from its timeout header, if any.
+
+    Returns:
+        float: The deadline, or None to use the default request budget.
+    """
+
+    for header in REQUEST_TIMEOUT_HEADERS:
+        value = request.headers.get(header)
+        if value:
+            try:
+                return time.monotonic() + int(value) / 1000
+            except ValueError:
+                logger.warning(f"Ignoring invalid `{header}` header: {value}")
+
+    return None
+
+
+def observe_stage_latencies(ctx: PipelineContext):
+    """
+    Records the latency of every stage that ran for a request.
+    """
+
+    for stage, latency in ctx.timings.items():
+        STAGE_LATENCY_SECONDS.labels(stage=stage).observe(latency)
+
+
+def make_response(model: BaseModel, res: Response = None):
+    """
+    Returns the response model for FastAPI to encode, or renders it directly on the fast path.
+    The status code of `res` is kept either way.
+    """
+
+    if not CURVE_FAST_SERIALIZATION:
+        return model
+
+    # the status code of an injected response is only set on errors
+    status_code = 200
+    if res is not None and res.status_code is not None:
+        status_code = res.status_code
+
+    return ModelJSONResponse(model, status_code=status_code)
+
+
+def reject(e: AdmissionRejected, response_type: type) -> ModelJSONResponse:
+    """
+    Builds the fast 429 or 503 response of a request rejected by admission control.
+    """
+
+    error_messages = f"[Admission] - {e}"
+    logger.warning(error_messages)
+
+    return ModelJSONResponse(
+        response_type(metadata={"error": error_messages}),
+        status_code=e.status_code,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def report_timeout(res: Response, e: StageTimeoutError) -> str:
+    """
+    Records a stage timeout and sets the gateway timeout status on the response.
+
+    Returns:
+        str: The error message.
+    """
+
+    res.status_code = 504
+    REQUEST_TIMEOUTS.labels(stage=e.stage).inc()
+    return f"[Timeout] - {e}"
+
+
 @app.get("/healthz")
 async def healthz():
     return {"status": "ok"}
 
 
+@app.get("/readyz")
+async def readyz():
+    if not app.state.ready:
+        return JSONResponse({"status": "starting"}, status_code=503)
+
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/models")
 async def models():
     return {
         "object": "list",
-        "data": [{"id": model_name, "object": "model"} for model_name in handler_map],
+        "data": [{"id": model_name, "object": "model"} for model_name in MODEL_NAMES],
     }
 
 
-@app.post("/function_calling")
-async def function_calling(req: ChatMessage, res: Response):
-    logger.info("[Endpoint: /function_calling]")
-    logger.info(f"[request body]: {json.dumps(req.model_dump())}")
+async def function_chat_completion(
+    req: ChatMessage, ctx: PipelineContext
+) -> ChatCompletionResponse:
+    """
+    Runs Curve-Function for the request and records its latency on the context.
+    """
+
+    function_start_time = time.perf_counter()
+    try:
+        return await ctx.run_stage(
+            "function", handler_map["Curve-Function"].chat_completion(req, ctx)
+        )
+    finally:
+        ctx.timings["function"] = time.perf_counter() - function_start_time
+
+
+async def cancel_function_chat_completion(
+    function_task: asyncio.Task, ctx: PipelineContext
+) -> int:
+    """
+    Cancels a speculative Curve-Function call, which closes its upstream stream.
+
+    Returns:
+        int: The number of tokens generated before cancellation.
+    """
+
+    function_task.cancel()
+    await asyncio.gather(function_task, return_exceptions=True)
+
+    # the wasted generation is not a stage of the request
+    for stage in ("function", "ttft", "prefill"):
+        ctx.timings.pop(stage, None)
+
+    if ctx.hallucination_state is None:
+        return 0
+
+    return len(ctx.hallucination_state.tokens)
+
+
+async def run_function_calling(
+    req: ChatMessage, res: Response, ctx: PipelineContext
+) -> ChatCompletionResponse:
+    """
+    Runs the function calling pipeline (Curve-Intent, then Curve-Function) for a request.
+
+    Args:
+        req (ChatMessage): A chat message request object.
+        res (Response): The response whose status code is set on errors.
+        ctx (PipelineContext): The request-scoped state, the handlers in `handler_map` are shared across requests.
+
+    Returns:
+        ChatCompletionResponse: The final response, or an error response with the error in its metadata.
+    """
 
     final_response: ChatCompletionResponse = None
     error_messages = None
 
+    # speculatively start Curve-Function while Curve-Intent is running
+    function_task = None
+    if CURVE_SPECULATIVE_FUNCTION_CALLING and len(req.tools) > 0:
+        # tool calls are only streamed once Curve-Intent has confirmed the intent
+        ctx.hold_tool_calls()
+        function_task = asyncio.create_task(function_chat_completion(req, ctx))
+
     try:
         intent_start_time = time.perf_counter()
-        intent_response = await handler_map["Curve-Intent"].chat_completion(req)
+        intent_response = await handler_map["Curve-Intent"].chat_completion(req, ctx)
         intent_latency = time.perf_counter() - intent_start_time
+        ctx.timings["intent"] = intent_latency
+
+        has_intent = handler_map["Curve-Intent"].detect_intent(intent_response)
+        INTENT_RESULTS.labels(result="yes" if has_intent else "no").inc()
+        ctx.release_tool_calls(emit=has_intent)
 
-        if handler_map["Curve-Intent"].detect_intent(intent_response):
+        if has_intent:
             # TODO: measure agreement between intent detection and function calling
             try:
-                function_start_time = time.perf_counter()
-                final_response = await handler_map["Curve-Function"].chat_completion(req)
-                function_latency = time.perf_counter() - function_start_time
+                if function_task is None:
+                    final_response = await function_chat_completion(req, ctx)
+                else:
+                    final_response = await function_task
+                function_latency = ctx.timings["function"]
 
                 final_response.metadata = {
                     "intent_latency": str(round(intent_latency * 1000, 3)),
                     "function_latency": str(round(function_latency * 1000, 3)),
-                    "hallucination": str(
-                        handler_map["Curve-Function"].hallucination_state.hallucination
-                    ),
+                    "hallucination": str(ctx.hallucination),
                 }
+
+                if function_task is not None:
+                    # both calls started together, so the overlap is the saved latency
+                    saved_latency = min(intent_latency, function_latency)
+                    SPECULATIVE_FUNCTION_CALLS.labels(outcome="used").inc()
+                    SPECULATIVE_SAVED_SECONDS.inc(saved_latency)
+                    final_response.metadata["speculative_saved_latency"] = str(
+                        round(saved_latency * 1000, 3)
+                    )
+            except StageTimeoutError as e:
+                error_messages = report_timeout(res, e)
             except ValueError as e:
-                res.statuscode = 503
-                error_messages = f"[Curve-Function] - Error in tool call extraction: {e}"
+                res.status_code = 503
+                error_messages = (
+                    f"[Curve-Function] - Error in tool call extraction: {e}"
+                )
             except StopIteration as e:
-                res.statuscode = 500
+                res.status_code = 500
                 error_messages = f"[Curve-Function] - Error in hallucination check: {e}"
             except Exception as e:
                 res.status_code = 500
@@ -105,12 +415,42 @@ async def function_calling(req: ChatMessage, res: Response):
             intent_response.metadata = {
                 "intent_latency": str(round(intent_latency * 1000, 3)),
             }
+
+            if function_task is not None:
+                wasted_tokens = await cancel_function_chat_completion(
+                    function_task, ctx
+                )
+                SPECULATIVE_FUNCTION_CALLS.labels(outcome="cancelled").inc()
+                SPECULATIVE_WASTED_SECONDS.inc(intent_latency)
+                SPECULATIVE_WASTED_TOKENS.inc(wasted_tokens)
+                intent_response.metadata["speculative_wasted_latency"] = str(
+                    round(intent_latency * 1000, 3)
+                )
+                intent_response.metadata["speculative_wasted_tokens"] = str(
+                    wasted_tokens
+                )
+
             final_response = intent_response
 
+    except asyncio.CancelledError:
+        # the client went away while Curve-Intent was running
+        if function_task is not None:
+            await cancel_function_chat_completion(function_task, ctx)
+        raise
+    except StageTimeoutError as e:
+        error_messages = report_timeout(res, e)
+
+        if function_task is not None:
+            await cancel_function_chat_completion(function_task, ctx)
     except Exception as e:
         res.status_code = 500
         error_messages = f"[Curve-Intent] - Error in ChatCompletion: {e}"
 
+        if function_task is not None:
+            await cancel_function_chat_completion(function_task, ctx)
+
+    observe_stage_latencies(ctx)
+
     if error_messages is not None:
         logger.error(error_messages)
         final_response = ChatCompletionResponse(metadata={"error": error_messages})
@@ -118,21 +458,192 @@ async def function_calling(req: ChatMessage, res: Response):
     return final_response
 
 
+@app.post("/function_calling")
+async def function_calling(req: ChatMessageBody, res: Response, request: Request):
+    logger.info("[Endpoint: /function_calling]")
+    utils.sample_request_logs("/function_calling")
+    utils.log_payload(logger, "request body", req)
+
+    ctx = PipelineContext(req, deadline=get_deadline(request))
+
+    try:
+        async with function_admission.admit(ctx.deadline):
+            with REQUESTS_IN_FLIGHT.labels(
+                endpoint="/function_calling"
+            ).track_inprogress():
+                final_response = await run_function_calling(req, res, ctx)
+    except AdmissionRejected as e:
+        return reject(e, ChatCompletionResponse)
+
+    return make_response(final_response, res)
+
+
+@app.post("/function_calling/batch")
+async def function_calling_batch(reqs: ChatMessageListBody, request: Request):
+    logger.info(f"[Endpoint: /function_calling/batch] - {len(reqs)} conversations")
+    utils.sample_request_logs("/function_calling/batch")
+
+    # all items share the budget of the batch request, queued items included
+    deadline = get_deadline(request)
+    if deadline is None:
+        deadline = time.monotonic() + DEFAULT_REQUEST_TIMEOUT_MS / 1000
+
+    # bounds the number of concurrent generations one batch can start on the backend
+    semaphore = asyncio.Semaphore(CURVE_BATCH_MAX_CONCURRENCY)
+
+    async def run_item(index: int, req: ChatMessage) -> BatchItemResponse:
+        res = Response()
+        async with semaphore:
+            try:
+                ctx = PipelineContext(req, deadline=deadline)
+                # every item takes a slot, rejected items fail alone
+                async with function_admission.admit(ctx.deadline):
+                    response = await run_function_calling(req, res, ctx)
+            except AdmissionRejected as e:
+                res.status_code = e.status_code
+                response = ChatCompletionResponse(
+                    metadata={"error": f"[Admission] - {e}"}
+                )
+            except Exception as e:
+                error_messages = f"[Batch] - Error in item {index}: {e}"
+                logger.error(error_messages)
+                res.status_code = 500
+                response = ChatCompletionResponse(metadata={"error": error_messages})
+
+        return BatchItemResponse(
+            index=index, status_code=res.status_code, response=response
+        )
+
+    # items with the same tools share the cached system prompts of the handlers
+    with REQUESTS_IN_FLIGHT.labels(
+        endpoint="/function_calling/batch"
+    ).track_inprogress():
+        results = await asyncio.gather(
+            *[run_item(index, req) for index, req in enumerate(reqs)]
+        )
+
+    return make_response(BatchChatCompletionResponse(data=results))
+
+
+async def stream_function_calling(req: ChatMessage, deadline: float = None):
+    """
+    Runs the function calling pipeline and yields NDJSON events: a `tool_call` event for
+    each tool call as soon as it is generated and verified, then a `response` event with
+    the final response and its status code.
+
+    Emitted tool calls are final: once one was emitted, a later tool call that hallucinates
+    or fails verification is dropped, and the `response` event carries exactly the emitted
+    tool calls instead of a parameter gathering question. Tool calls of a speculative
+    Curve-Function call are held back until Curve-Intent confirms the intent, and dropped
+    if it does not.
+    """
+
+    # the generator runs outside of the endpoint, so it samples its own logs
+    utils.sample_request_logs("/function_calling/stream")
+    utils.log_payload(logger, "request body", req)
+
+    tool_calls = asyncio.Queue()
+    ctx = PipelineContext(req, on_tool_call=tool_calls.put_nowait, deadline=deadline)
+    res = Response()
+
+    pipeline_task = asyncio.create_task(run_function_calling(req, res, ctx))
+    in_flight = REQUESTS_IN_FLIGHT.labels(endpoint="/function_calling/stream")
+    in_flight.inc()
+
+    try:
+        while True:
+            next_tool_call = asyncio.ensure_future(tool_calls.get())
+            await asyncio.wait(
+                [next_tool_call, pipeline_task], return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if not next_tool_call.done():
+                next_tool_call.cancel()
+                break
+
+            yield json.dumps(
+                {"type": "tool_call", "tool_call": next_tool_call.result()}
+            ) + "\n"
+
+        # tool calls emitted right before the pipeline finished
+        while not tool_calls.empty():
+            yield json.dumps(
+                {"type": "tool_call", "tool_call": tool_calls.get_nowait()}
+            ) + "\n"
+
+        yield json.dumps(
+            {
+                "type": "response",
+                "status_code": res.status_code,
+                "response": pipeline_task.result().model_dump(),
+            }
+        ) + "\n"
+    finally:
+        # the client went away, stop generating
+        if not pipeline_task.done():
+            pipeline_task.cancel()
+            await asyncio.gather(pipeline_task, return_exceptions=True)
+
+        in_flight.dec()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    A streaming response holding an admission slot until the response is done, including
+    when the client goes away before the stream starts.
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+
+@app.post("/function_calling/stream")
+async def function_calling_stream(req: ChatMessageBody, request: Request):
+    logger.info("[Endpoint: /function_calling/stream]")
+
+    deadline = get_deadline(request)
+
+    # admitted before streaming, so that rejected requests get a 429 or 503 status
+    try:
+        await function_admission.acquire(deadline)
+    except AdmissionRejected as e:
+        return reject(e, ChatCompletionResponse)
+
+    return AdmittedStreamingResponse(
+        stream_function_calling(req, deadline),
+        function_admission.release,
+        media_type="application/x-ndjson",
+    )
+
+
 @app.post("/guardrails")
-async def guardrails(req: GuardRequest, res: Response, max_num_words=300):
+async def guardrails(req: GuardRequestBody, res: Response, max_num_words=300):
     logger.info("[Endpoint: /guardrails] - Gateway")
-    logger.info(f"[request body]: {json.dumps(req.model_dump())}")
+    utils.sample_request_logs("/guardrails")
+    utils.log_payload(logger, "request body", req)
 
     final_response: GuardResponse = None
     error_messages = None
 
     try:
-        guard_start_time = time.perf_counter()
-        final_response = handler_map["Curve-Guard"].predict(req)
-        guard_latency = time.perf_counter() - guard_start_time
+        async with guard_admission.admit():
+            guard_start_time = time.perf_counter()
+            with REQUESTS_IN_FLIGHT.labels(endpoint="/guardrails").track_inprogress():
+                final_response = await guard_batcher.submit(req)
+            guard_latency = time.perf_counter() - guard_start_time
+        STAGE_LATENCY_SECONDS.labels(stage="guard").observe(guard_latency)
         final_response.metadata = {
             "guard_latency": round(guard_latency * 1000, 3),
         }
+    except AdmissionRejected as e:
+        return reject(e, GuardResponse)
     except Exception as e:
         res.status_code = 500
         error_messages = f"[Curve-Guard]: {e}"
@@ -141,4 +652,4 @@ async def guardrails(req: GuardRequest, res: Response, max_num_words=300):
         logger.error(error_messages)
         final_response = GuardResponse(metadata={"error": error_messages})
 
-    return final_response
+    return make_response(final_response, res)
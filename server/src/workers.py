@@ -0,0 +1,334 @@
+"""
+Serves the model server with several forked workers sharing the preloaded models.
+
+`serve` binds the socket, imports the app, which loads the models, freezes the garbage
+collector and only then forks the workers. The workers share the memory pages of everything
+loaded before the fork copy-on-write, anything loaded after it is private to each worker.
+
+Each worker is a separate uvicorn server with its own state:
+    - The admission limits of each endpoint are divided between the workers, so that the
+      server as a whole admits about the configured number of requests. The kernel does not
+      spread connections perfectly evenly, so a busy worker may reject a little early.
+    - Metrics are recorded per worker and published every `METRICS_PUBLISH_INTERVAL` to a
+      directory shared by the workers. Whichever worker accepts a scrape renders the sum over
+      all workers, so counters do not jump between the values of different workers. The
+      counters of an exited worker keep counting towards the totals, its gauges are dropped.
+    - `CURVE_GUARD_EXECUTOR=process` is rejected: its pool loads a copy of the Curve-Guard
+      model in each worker after the fork, so the model would not be shared.
+
+Usage:
+    python -m src.workers [--host 0.0.0.0] [--port 51000] [--workers 2] [--threads-per-worker 0]
+"""
+
+import gc
+import os
+import math
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+
+import src.commons.utils as utils
+import src.commons.metrics as metrics
+
+from typing import Dict, List
+from src.commons.admission import AdmissionController
+
+
+logger = utils.get_server_logger()
+
+
+# A worker exiting sooner than this after it started is restarted after `RESTART_DELAY`,
+# so that a worker failing at startup is not forked in a tight loop
+MIN_WORKER_UPTIME = 5.0
+RESTART_DELAY = 1.0
+
+# A scrape sees the metrics of the other workers at most this many seconds old
+METRICS_PUBLISH_INTERVAL = 1.0
+
+
+def get_threads_per_worker(num_workers: int) -> int:
+    """
+    Splits the CPU cores evenly between the workers.
+    """
+
+    return max(1, (os.cpu_count() or 1) // num_workers)
+
+
+def split_admission_limits(controllers: List[AdmissionController], num_workers: int):
+    """
+    Divides the concurrency and queue limits of each controller between the workers.
+    """
+
+    for controller in controllers:
+        controller.max_concurrency = math.ceil(controller.max_concurrency / num_workers)
+        controller.max_queue_size = math.ceil(controller.max_queue_size / num_workers)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    """
+    Binds the listening socket in the parent process, the workers accept on the same socket.
+    """
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+
+    return sock
+
+
+def publish_metrics_periodically(interval: float = METRICS_PUBLISH_INTERVAL):
+    """
+    Publishes the metrics of the worker every `interval` seconds until it exits.
+    """
+
+    def publish_loop():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.publish()
+            except OSError as e:
+                logger.warning(f"[Workers] - failed to publish metrics: {e!r}")
+
+    threading.Thread(target=publish_loop, name="metrics-publisher", daemon=True).start()
+
+
+def run_worker(app, sock: socket.socket, threads_per_worker: int) -> int:
+    """
+    Serves the app on the shared socket in a forked worker.
+
+    Returns:
+        int: The exit code of the worker.
+    """
+
+    import uvicorn
+
+    from src.core.guardrails import set_torch_threads
+
+    # uvicorn handles these signals itself to shut down gracefully
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    set_torch_threads(threads_per_worker)
+
+    # the values recorded before the fork are published by the supervisor
+    metrics.REGISTRY.reset()
+    metrics.publish()
+    publish_metrics_periodically()
+
+    server = uvicorn.Server(uvicorn.Config(app, lifespan="on"))
+    server.run(sockets=[sock])
+    metrics.publish()
+
+    return 0 if server.started else 1
+
+
+class WorkerSupervisor:
+    """
+    Forks server workers from a parent process that has already loaded the models, so that
+    the workers share the model weights copy-on-write, and restarts workers that exit.
+
+    Each worker has its own event loop, caches and share of the admission limits, and
+    publishes its metrics to the shared metrics directory. SIGTERM or SIGINT stops the
+    workers gracefully, workers still running after `shutdown_timeout` are killed.
+
+    Attributes:
+        app: The ASGI app, imported in the parent process.
+        sock (socket.socket): The listening socket shared by the workers.
+        num_workers (int): The number of workers.
+        threads_per_worker (int): The torch intra-op thread budget of each worker.
+        shutdown_timeout (float): Seconds to wait for the workers to stop.
+    """
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        num_workers: int,
+        threads_per_worker: int,
+        shutdown_timeout: float = 30.0,
+    ):
+        self.app = app
+        self.sock = sock
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.shutdown_timeout = shutdown_timeout
+
+        # pid -> monotonic start time
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+
+        if pid == 0:
+            exit_code = 1
+            try:
+                exit_code = run_worker(self.app, self.sock, self.threads_per_worker)
+            except BaseException as e:
+                logger.error(f"[Workers] - worker {os.getpid()} failed: {e!r}")
+            finally:
+                # never return into the supervisor loop of the parent
+                utils.stop_log_listener()
+                os._exit(exit_code)
+
+        self.workers[pid] = time.monotonic()
+        logger.info(
+            f"[Workers] - started worker {pid} ({self.threads_per_worker} torch threads)"
+        )
+
+    def stop(self, signum=None, frame=None):
+        if not self.stopping:
+            logger.info("[Workers] - stopping workers")
+
+        self.stopping = True
+        self.signal_workers(signal.SIGTERM)
+
+    def signal_workers(self, signum: int):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        """
+        Collects the workers that exited and restarts them unless the supervisor is stopping.
+        """
+
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+
+            if pid == 0:
+                return
+
+            start_time = self.workers.pop(pid, None)
+            if start_time is None:
+                continue
+
+            metrics.retire(pid)
+            if self.stopping:
+                continue
+
+            logger.warning(
+                f"[Workers] - worker {pid} exited with code "
+                f"{os.waitstatus_to_exitcode(status)}, restarting"
+            )
+            if time.monotonic() - start_time < MIN_WORKER_UPTIME:
+                time.sleep(RESTART_DELAY)
+            self.spawn()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for _ in range(self.num_workers):
+            self.spawn()
+
+        while not self.stopping:
+            self.reap()
+            time.sleep(0.5)
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        if self.workers:
+            logger.warning(f"[Workers] - killing workers {list(self.workers)}")
+            self.signal_workers(signal.SIGKILL)
+            while self.workers:
+                self.reap()
+                time.sleep(0.1)
+
+        self.sock.close()
+        logger.info("[Workers] - all workers stopped")
+
+
+def serve(host: str, port: int, num_workers: int, threads_per_worker: int = 0):
+    """
+    Loads the models once and serves the app with `num_workers` forked workers.
+
+    Args:
+        host (str): The host to bind.
+        port (int): The port to bind.
+        num_workers (int): The number of workers.
+        threads_per_worker (int, optional): The torch thread budget of each worker, 0 to split the CPU cores evenly. Defaults to 0.
+    """
+
+    sock = bind_socket(host, port)
+
+    # importing the app loads the models, the workers inherit them
+    from src.main import app
+    from src.commons.globals import (
+        CURVE_GUARD_EXECUTOR,
+        function_admission,
+        guard_admission,
+    )
+
+    if CURVE_GUARD_EXECUTOR == "process" and num_workers > 1:
+        sock.close()
+        raise ValueError(
+            "CURVE_GUARD_EXECUTOR=process loads a Curve-Guard model per worker, "
+            "use the thread executor with multiple workers."
+        )
+
+    split_admission_limits([function_admission, guard_admission], num_workers)
+
+    # the workers render the metrics summed over the published values of all workers,
+    # the values recorded while loading the models are published once by the supervisor
+    metrics.REGISTRY.shared_dir = tempfile.mkdtemp(prefix="curve-metrics-")
+    metrics.publish(gauges=False)
+
+    # objects allocated so far are never collected, so the garbage collector of a worker
+    # does not write to their memory pages and break copy-on-write sharing
+    gc.collect()
+    gc.freeze()
+
+    try:
+        WorkerSupervisor(
+            app,
+            sock,
+            num_workers,
+            threads_per_worker or get_threads_per_worker(num_workers),
+        ).run()
+    finally:
+        shutil.rmtree(metrics.REGISTRY.shared_dir, ignore_errors=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Serve the model server with multiple workers sharing the models. "
+        "Metrics are summed over the workers."
+    )
+    parser.add_argument("--host", default="0.0.0.0", help="Host to bind.")
+    parser.add_argument("--port", type=int, default=51000, help="Port to bind.")
+    parser.add_argument(
+        "--workers", type=int, default=2, help="Number of workers (default: 2)."
+    )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=0,
+        help="Torch threads of each worker (default: CPU cores divided by workers).",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    serve(args.host, args.port, args.workers, args.threads_per_worker)
+
+
+if __name__ == "__main__":
+    main()
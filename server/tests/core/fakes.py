@@ -0,0 +1,231 @@
+import math
+import asyncio
+
+from types import SimpleNamespace
+
+
+CERTAIN_LOGPROBS = [0.0] + [-20.0] * 9
+UNCERTAIN_LOGPROBS = [math.log(0.1)] * 10
+# uncertain at half the hallucination thresholds of parameter values, but below them
+SOFT_UNCERTAIN_LOGPROBS = [math.log(0.96)] + [math.log(0.04 / 9)] * 9
+
+get_weather_api = {
+    "type": "function",
+    "function": {
+        "name": "get_current_weather",
+        "description": "Get current weather at a location.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "location": {"type": "str", "format": "City, State"},
+                "days": {"type": "str"},
+            },
+            "required": ["location", "days"],
+        },
+    },
+}
+
+# recorded token stream of a single tool call
+tool_call_tokens = [
+    "<tool_call>",
+    "\n",
+    '{"',
+    "name",
+    '":',
+    ' "',
+    "get",
+    "_current",
+    "_weather",
+    '",',
+    ' "',
+    "arguments",
+    '":',
+    ' {"',
+    "location",
+    '":',
+    ' "',
+    "Seattle",
+    ",",
+    " WA",
+    '",',
+    ' "',
+    "days",
+    '":',
+    ' "',
+    "7",
+    '"}}\n',
+    "</tool_call>",
+]
+
+
+def repeat_tool_calls(num_tokens, tokens=tool_call_tokens):
+    """
+    A recorded stream of consecutive tool calls with at least `num_tokens` tokens.
+    """
+
+    repeated = []
+    while len(repeated) < num_tokens:
+        repeated += tokens + ["\n"]
+    return repeated
+
+
+def make_chunk(token, logprobs=CERTAIN_LOGPROBS):
+    top_logprobs = [SimpleNamespace(logprob=logprob) for logprob in logprobs]
+    return SimpleNamespace(
+        choices=[
+            SimpleNamespace(
+                delta=SimpleNamespace(content=token),
+                logprobs=SimpleNamespace(
+                    content=[SimpleNamespace(top_logprobs=top_logprobs)]
+                ),
+            )
+        ]
+    )
+
+
+def make_chunks(
+    tokens=tool_call_tokens, uncertain_token=None, soft_uncertain_token=None
+):
+    logprobs = {
+        uncertain_token: UNCERTAIN_LOGPROBS,
+        soft_uncertain_token: SOFT_UNCERTAIN_LOGPROBS,
+    }
+    return [
+        make_chunk(token, logprobs.get(token, CERTAIN_LOGPROBS)) for token in tokens
+    ]
+
+
+class FakeAsyncStream:
+    """
+    Mimics `openai.AsyncStream` over a list of recorded chunks.
+    """
+
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = iter(chunks)
+        self.delay = delay
+        self.consumed = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+        self.consumed += 1
+        return chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def make_completion(content):
+    message = SimpleNamespace(content=content)
+    completion = SimpleNamespace(choices=[SimpleNamespace(message=message)])
+    completion.model_dump = lambda: {"choices": [{"message": {"content": content}}]}
+    return completion
+
+
+class FakeCompletions:
+    """
+    Mimics `AsyncOpenAI().chat.completions` for the intent, function and prefill calls.
+    """
+
+    def __init__(
+        self,
+        intent="Yes",
+        tokens=tool_call_tokens,
+        uncertain_token=None,
+        soft_uncertain_token=None,
+        hallucinate_when=None,
+        prefill_content="Could you provide the number of days?",
+        delay=0.0,
+    ):
+        self.intent = intent
+        self.tokens = tokens
+        self.uncertain_token = uncertain_token
+        self.soft_uncertain_token = soft_uncertain_token
+        self.hallucinate_when = hallucinate_when
+        self.prefill_content = prefill_content
+        self.delay = delay
+        self.calls = []
+        self.streams = []
+
+    async def create(self, messages, model, stream=False, extra_body=None, **kwargs):
+        extra_body = extra_body or {}
+        self.calls.append({"model": model, "stream": stream, "messages": messages})
+
+        if stream:
+            uncertain_token = self.uncertain_token
+            if self.hallucinate_when and self.hallucinate_when not in str(messages):
+                uncertain_token = None
+            chunks = make_chunks(
+                self.tokens, uncertain_token, self.soft_uncertain_token
+            )
+            self.streams.append(FakeAsyncStream(chunks, delay=self.delay))
+            return self.streams[-1]
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+        if extra_body.get("continue_final_message"):
+            return make_completion(self.prefill_content)
+
+        return make_completion(self.intent)
+
+
+class FakeAsyncOpenAI:
+    def __init__(self, **kwargs):
+        self.chat = SimpleNamespace(completions=FakeCompletions(**kwargs))
+
+
+def get_guard_tokenizer():
+    """
+    A word-level fast tokenizer, so that chunking goes through the real tokenizer code path.
+    """
+
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    vocab = {"[PAD]": 0, "[UNK]": 1, "jailbreak": 2}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token="[PAD]", unk_token="[UNK]"
+    )
+
+
+class FakeGuardModel:
+    """
+    Classifies inputs containing the `jailbreak` token as the positive class (index 2).
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, input_ids, attention_mask=None, **kwargs):
+        import torch
+
+        self.batch_sizes.append(len(input_ids))
+        positive = (input_ids == 2).any(dim=-1, keepdim=True).float()
+        logits = torch.cat(
+            [10 * (1 - positive), torch.zeros_like(positive), 10 * positive], dim=-1
+        )
+        return SimpleNamespace(logits=logits)
+
+
+def get_fake_guard_dict():
+    return {
+        "model": FakeGuardModel(),
+        "model_name": "Curve-Guard",
+        "backend": "eager",
+        "tokenizer": get_guard_tokenizer(),
+        "device": "cpu",
+    }
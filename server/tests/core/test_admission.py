@@ -0,0 +1,114 @@
+import time
+import asyncio
+import pytest
+
+from src.commons.admission import AdmissionController, AdmissionRejected
+from src.workers import split_admission_limits
+
+
+async def hold(controller, seconds, deadline=None):
+    async with controller.admit(deadline):
+        await asyncio.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_admission_limits_concurrency():
+    controller = AdmissionController(
+        "test", max_concurrency=2, max_queue_size=4, max_queue_ms=1000
+    )
+
+    max_in_flight = 0
+
+    async def run():
+        nonlocal max_in_flight
+        async with controller.admit():
+            max_in_flight = max(max_in_flight, controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[run() for _ in range(6)])
+
+    assert max_in_flight == 2
+    assert controller.in_flight == 0
+    assert controller.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_admission_rejects_when_queue_is_full():
+    controller = AdmissionController(
+        "test", max_concurrency=1, max_queue_size=1, max_queue_ms=1000, retry_after=3
+    )
+
+    holder = asyncio.create_task(hold(controller, 0.05))
+    waiter = asyncio.create_task(hold(controller, 0))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire()
+
+    assert (e.value.reason, e.value.status_code, e.value.retry_after) == (
+        "queue_full",
+        429,
+        3,
+    )
+
+    # the queued request is served once the slot is released
+    await asyncio.gather(holder, waiter)
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_deadline", [False, True])
+async def test_admission_rejects_after_queue_time(use_deadline):
+    controller = AdmissionController(
+        "test",
+        max_concurrency=1,
+        max_queue_size=1,
+        max_queue_ms=10 if not use_deadline else 1000,
+    )
+    deadline = time.monotonic() + 0.01 if use_deadline else None
+
+    holder = asyncio.create_task(hold(controller, 0.1))
+    await asyncio.sleep(0)
+
+    start_time = time.perf_counter()
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire(deadline)
+
+    assert (e.value.reason, e.value.status_code) == ("queue_timeout", 503)
+    assert time.perf_counter() - start_time < 0.1
+    assert controller.queue_depth == 0
+
+    await holder
+    assert controller.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    controller = AdmissionController(
+        "test", max_concurrency=1, max_queue_size=1, max_queue_ms=1000
+    )
+
+    holder = asyncio.create_task(hold(controller, 0.02))
+    waiter = asyncio.create_task(hold(controller, 0))
+    await asyncio.sleep(0)
+    assert controller.queue_depth == 1
+
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert controller.queue_depth == 0
+
+    await holder
+    assert controller.in_flight == 0
+
+
+def test_admission_limits_are_split_between_workers():
+    controllers = [
+        AdmissionController("test", max_concurrency=64, max_queue_size=128),
+        AdmissionController("disabled"),
+    ]
+
+    split_admission_limits(controllers, num_workers=3)
+
+    assert [c.max_concurrency for c in controllers] == [22, 0]
+    assert [c.max_queue_size for c in controllers] == [43, 0]
+    assert controllers[1].enabled is False
@@ -0,0 +1,71 @@
+import asyncio
+import pytest
+
+from src.core.utils.batching import MicroBatcher
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_batches_concurrent_items():
+    batches = []
+
+    async def process_batch(items):
+        batches.append(items)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait_ms=20, name="test")
+
+    results = await asyncio.gather(*[batcher.submit(i) for i in range(6)])
+    await batcher.close()
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    assert [len(batch) for batch in batches] == [4, 2]
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_isolates_failing_items():
+    async def process_batch(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait_ms=20, name="test")
+
+    results = await asyncio.gather(
+        batcher.submit("a"),
+        batcher.submit("bad"),
+        batcher.submit("b"),
+        return_exceptions=True,
+    )
+    await batcher.close()
+
+    assert results[0] == "A"
+    assert isinstance(results[1], ValueError)
+    assert results[2] == "B"
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_failing_item_of_cancelled_caller():
+    batch_tasks = []
+    started = asyncio.Event()
+
+    async def process_batch(items):
+        batch_tasks.append(asyncio.current_task())
+        started.set()
+        await asyncio.sleep(0.02)
+        if "bad" in items:
+            raise ValueError("bad item")
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait_ms=1, name="test")
+
+    caller = asyncio.create_task(batcher.submit("bad"))
+    await started.wait()
+    caller.cancel()
+    await asyncio.gather(caller, return_exceptions=True)
+
+    await asyncio.gather(*batch_tasks, return_exceptions=True)
+
+    # the error of the cancelled caller is dropped instead of failing the batch task
+    assert batch_tasks[0].exception() is None
+    assert await batcher.submit("a") == "A"
+    await batcher.close()
@@ -0,0 +1,55 @@
+import time
+
+from src.commons.cache import LRUCache, fingerprint
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint({"a": 1, "b": [1, 2]}) == fingerprint({"b": [1, 2], "a": 1})
+    assert fingerprint({"a": 1}) != fingerprint({"a": 2})
+
+
+def test_lru_cache_eviction():
+    cache = LRUCache(max_size=2)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is the least recently used entry
+    cache.put("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(max_size=2, ttl=0.01)
+
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(max_size=0)
+
+    cache.put("a", 1)
+
+    assert cache.enabled is False
+    assert cache.get("a") is None
+
+
+def test_lru_cache_memory_cap():
+    cache = LRUCache(max_size=100, max_bytes=30, sizeof=lambda key, value: 10)
+
+    for key in "abcd":
+        cache.put(key, key)
+
+    assert len(cache) == 3
+    assert cache.current_bytes == 30
+    assert cache.get("a") is None
@@ -0,0 +1,154 @@
+import time
+import httpx
+import openai
+import asyncio
+import pytest
+
+from types import SimpleNamespace
+from src.commons.endpoint_pool import Endpoint, EndpointPool
+from src.core.utils.model_utils import ChatMessage, PipelineContext, StageTimeoutError
+from .fakes import FakeAsyncOpenAI
+
+
+class FailingCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, *args, **kwargs):
+        self.calls += 1
+        raise openai.APIConnectionError(request=httpx.Request("POST", "http://test"))
+
+
+class ConnectingClient:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.connections = 0
+        self.models = SimpleNamespace(list=self.list_models)
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def list_models(self):
+        if self.fail:
+            raise openai.APIConnectionError(request=httpx.Request("GET", "http://test"))
+        self.connections += 1
+
+
+def get_pool(num_endpoints=2, **kwargs):
+    return EndpointPool(
+        [
+            Endpoint(f"http://vllm-{idx}", FakeAsyncOpenAI(delay=0.01))
+            for idx in range(num_endpoints)
+        ],
+        **kwargs,
+    )
+
+
+async def consume(pool):
+    stream = await pool.chat.completions.create(
+        messages=[], model="Curve-Function", stream=True
+    )
+    async for _ in stream:
+        pass
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy", ["least_outstanding", "ewma"])
+async def test_endpoint_pool_spreads_streams(policy):
+    pool = get_pool(policy=policy)
+
+    await asyncio.gather(*[consume(pool) for _ in range(4)])
+
+    # streams keep their endpoint busy until exhausted, so the load is split evenly
+    assert [len(e.client.chat.completions.streams) for e in pool.endpoints] == [2, 2]
+    assert [e.in_flight for e in pool.endpoints] == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_endpoint_pool_in_flight_limit():
+    pool = get_pool(num_endpoints=1, max_in_flight=1)
+    endpoint = pool.endpoints[0]
+
+    max_in_flight = 0
+
+    async def watch():
+        nonlocal max_in_flight
+        while True:
+            max_in_flight = max(max_in_flight, endpoint.in_flight)
+            await asyncio.sleep(0.001)
+
+    watcher = asyncio.create_task(watch())
+    await asyncio.gather(*[consume(pool) for _ in range(3)])
+    watcher.cancel()
+
+    assert max_in_flight == 1
+    assert len(endpoint.client.chat.completions.streams) == 3
+
+
+@pytest.mark.asyncio
+async def test_endpoint_pool_ejects_failing_endpoint():
+    pool = get_pool(eject_failures=2)
+    failing = pool.endpoints[0]
+    failing.client.chat.completions = FailingCompletions()
+
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            await pool.chat.completions.create(messages=[], model="Curve-Intent")
+
+    assert failing.ejected
+
+    # every request now goes to the healthy endpoint
+    for _ in range(3):
+        await pool.chat.completions.create(messages=[], model="Curve-Intent")
+
+    assert failing.client.chat.completions.calls == 2
+    assert len(pool.endpoints[1].client.chat.completions.calls) == 3
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("stream", [False, True])
+async def test_endpoint_pool_ejects_hanging_endpoint(stream):
+    pool = get_pool(num_endpoints=1, eject_failures=1)
+    # the stream hangs between tokens, the completion before returning
+    pool.endpoints[0].client = FakeAsyncOpenAI(delay=10)
+    ctx = PipelineContext(
+        ChatMessage(messages=[], tools=[]), deadline=time.monotonic() + 0.02
+    )
+
+    request = (
+        consume(pool)
+        if stream
+        else pool.chat.completions.create(messages=[], model="Curve-Intent")
+    )
+    with pytest.raises(StageTimeoutError):
+        await ctx.run_stage("function", request)
+
+    assert pool.endpoints[0].ejected
+    assert pool.endpoints[0].in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_endpoint_pool_cancelled_request_is_not_a_failure():
+    pool = get_pool(num_endpoints=1, eject_failures=1)
+    pool.endpoints[0].client = FakeAsyncOpenAI(delay=10)
+
+    # the client went away
+    task = asyncio.create_task(consume(pool))
+    await asyncio.sleep(0.02)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert not pool.endpoints[0].ejected
+    assert pool.endpoints[0].in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_endpoint_pool_warm_up():
+    clients = [ConnectingClient(), ConnectingClient(fail=True)]
+    pool = EndpointPool(
+        [Endpoint(f"http://vllm-{idx}", client) for idx, client in enumerate(clients)]
+    )
+
+    # an unreachable endpoint does not fail the warm-up
+    assert await pool.warm_up(connections=2) == 2
+    assert clients[0].connections == 2
@@ -1,7 +1,7 @@
 import pytest
 
 from src.commons.globals import handler_map
-from src.core.utils.model_utils import ChatMessage, Message
+from src.core.utils.model_utils import ChatMessage, Message, PipelineContext
 
 
 # define function
@@ -150,19 +150,17 @@ def get_greeting_data():
 )
 async def test_function_calling(get_data_func):
     req, intent, hallucination, parameter_gathering = get_data_func()
+    ctx = PipelineContext(req)
 
-    intent_response = await handler_map["Curve-Intent"].chat_completion(req)
+    intent_response = await handler_map["Curve-Intent"].chat_completion(req, ctx)
 
     assert handler_map["Curve-Intent"].detect_intent(intent_response) == intent
 
     if intent:
         function_calling_response = await handler_map["Curve-Function"].chat_completion(
-            req
-        )
-        assert (
-            handler_map["Curve-Function"].hallucination_state.hallucination
-            == hallucination
+            req, ctx
         )
+        assert ctx.hallucination == hallucination
         response_txt = function_calling_response.choices[0].message.content
 
         if parameter_gathering:
@@ -1,5 +1,19 @@
+import time
+import logging
+import torch
+import asyncio
+import pytest
+
 from unittest.mock import patch, MagicMock
-from src.core.guardrails import get_guardrail_handler
+from src.core.guardrails import (
+    CurveGuardExecutor,
+    CurveGuardHanlder,
+    GuardResultCache,
+    check_backend_parity,
+    get_guardrail_handler,
+)
+from src.core.utils.model_utils import GuardRequest
+from .fakes import get_fake_guard_dict, get_guard_tokenizer
 
 
 # Test for `get_guardrail_handler()` function on `cuda`
@@ -40,3 +54,257 @@ def test_guardrail_handler_on_mps(mock_auto_model, mock_tokenizer):
         device_map=device,
         low_cpu_mem_usage=True,
     )
+
+
+def test_guardrail_predict_batch():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+
+    reqs = [
+        GuardRequest(input="hello there", task="jailbreak"),
+        GuardRequest(input="a jailbreak attempt", task="jailbreak"),
+        GuardRequest(input="how is the weather?", task="jailbreak"),
+    ]
+
+    results = guardrail.predict_batch(reqs)
+
+    assert [result.verdict for result in results] == [False, True, False]
+    assert [result.input for result in results] == [req.input for req in reqs]
+    # all short inputs are classified in a single forward pass
+    assert guardrail.model.batch_sizes == [3]
+
+
+def test_guardrail_routes_on_token_count():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+
+    # three words but over 600 tokens, the positive token is past the first 512 tokens
+    text = "see " + ".".join(["x"] * 300) + " jailbreak"
+    assert len(text.split()) == 3
+
+    result = guardrail.predict(GuardRequest(input=text, task="jailbreak"))
+
+    assert result.verdict is True
+    # the input is split into chunks instead of being truncated to 512 tokens
+    assert guardrail.model.batch_sizes == [2]
+
+
+def test_guardrail_tokenizes_short_inputs_once():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+    guardrail.tokenizer = MagicMock(wraps=guardrail.tokenizer)
+    guardrail.tokenizer.num_special_tokens_to_add.return_value = 0
+
+    guardrail.predict_batch(
+        [
+            GuardRequest(input="hello there", task="jailbreak"),
+            GuardRequest(input="a jailbreak attempt", task="jailbreak"),
+        ]
+    )
+
+    # inputs with fewer bytes than tokens fit are not tokenized just to be counted
+    assert guardrail.tokenizer.call_count == 1
+    assert guardrail.model.batch_sizes == [2]
+
+
+def test_guardrail_predict_batch_does_not_log_inputs(caplog):
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+
+    # runs in an executor thread, where the log sampling of the request does not apply
+    with caplog.at_level(logging.DEBUG, logger="server"):
+        guardrail.predict(GuardRequest(input="a secret input", task="jailbreak"))
+
+    assert not any("secret" in message for message in caplog.messages)
+
+
+def test_guardrail_result_cache():
+    guardrail = CurveGuardHanlder(
+        model_dict=get_fake_guard_dict(), cache=GuardResultCache(max_size=16)
+    )
+
+    guardrail.predict(GuardRequest(input="a jailbreak attempt", task="jailbreak"))
+    results = guardrail.predict_batch(
+        [
+            GuardRequest(input="a  jailbreak\nattempt ", task="jailbreak"),
+            GuardRequest(input="hello there", task="jailbreak"),
+        ]
+    )
+
+    assert [result.verdict for result in results] == [True, False]
+    # the whitespace variant is served from the cache, only the new input is classified
+    assert guardrail.model.batch_sizes == [1, 1]
+    assert guardrail.cache.memory.hits == 1
+
+
+def test_guardrail_result_cache_on_disk(tmp_path):
+    path = str(tmp_path / "guard_cache.db")
+    req = GuardRequest(input="a jailbreak attempt", task="jailbreak")
+
+    cache = GuardResultCache(max_size=16, path=path)
+    CurveGuardHanlder(model_dict=get_fake_guard_dict(), cache=cache).predict(req)
+    cache.close()
+
+    # a new handler, e.g. after a restart, finds the result on disk
+    guardrail = CurveGuardHanlder(
+        model_dict=get_fake_guard_dict(),
+        cache=GuardResultCache(max_size=16, path=path),
+    )
+    result = guardrail.predict(req)
+
+    assert result.verdict
+    assert guardrail.model.batch_sizes == []
+
+
+def test_guardrail_result_cache_keyed_by_backend(tmp_path):
+    path = str(tmp_path / "guard_cache.db")
+    req = GuardRequest(input="a jailbreak attempt", task="jailbreak")
+
+    cache = GuardResultCache(max_size=16, path=path)
+    CurveGuardHanlder(model_dict=get_fake_guard_dict(), cache=cache).predict(req)
+    cache.close()
+
+    # after switching the backend, the results of the previous backend are not served
+    guardrail = CurveGuardHanlder(
+        model_dict={**get_fake_guard_dict(), "backend": "int8"},
+        cache=GuardResultCache(max_size=16, path=path),
+    )
+    result = guardrail.predict(req)
+
+    assert result.verdict
+    assert guardrail.model.batch_sizes == [1]
+
+
+def test_guardrail_long_input_chunks_with_early_exit():
+    guardrail = CurveGuardHanlder(
+        model_dict=get_fake_guard_dict(), chunk_batch_size=2, chunk_stride=8
+    )
+
+    # 10 chunks of 64 tokens, the positive token is in the 4th chunk
+    words = ["hello"] * 640
+    words[200] = "jailbreak"
+
+    result = guardrail._predict_long_text("jailbreak", " ".join(words), max_length=64)
+
+    assert result.verdict is True
+    # the batch of chunks 3-4 is positive, so chunks 5-10 are never scored
+    assert guardrail.model.batch_sizes == [2, 2]
+
+
+def test_guardrail_long_input_overlapping_chunks():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict(), chunk_stride=8)
+
+    text = " ".join(["hello"] * 1000)
+    encoding = guardrail._tokenize_into_chunks(text, max_length=64)
+
+    input_ids = encoding["input_ids"]
+    assert input_ids.shape[1] == 64
+    # consecutive chunks share `chunk_stride` tokens
+    offsets = encoding["offset_mapping"]
+    assert offsets[1][0].tolist() == offsets[0][64 - 8].tolist()
+
+    result = guardrail._predict_long_text("jailbreak", text, max_length=64)
+    assert result.verdict is False
+    assert sum(guardrail.model.batch_sizes) == len(input_ids)
+
+
+@pytest.mark.asyncio
+async def test_guard_executor_keeps_event_loop_responsive():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+    executor = CurveGuardExecutor(handler=guardrail, executor_type="thread")
+
+    forward = guardrail.model
+
+    def slow_forward(*args, **kwargs):
+        time.sleep(0.2)
+        return forward(*args, **kwargs)
+
+    guardrail.model = slow_forward
+
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    results = await executor.predict_batch(
+        [GuardRequest(input="a jailbreak attempt", task="jailbreak")]
+    )
+    ticker.cancel()
+    executor.shutdown()
+
+    assert results[0].verdict is True
+    # the event loop kept running during the forward pass
+    assert ticks >= 5
+
+
+@pytest.mark.asyncio
+async def test_guard_executor_warm_up():
+    guardrail = CurveGuardHanlder(model_dict=get_fake_guard_dict())
+    executor = CurveGuardExecutor(handler=guardrail, executor_type="thread")
+
+    forward = guardrail.model
+    seq_lengths = []
+
+    def record_forward(input_ids, **kwargs):
+        seq_lengths.append(input_ids.shape[-1])
+        return forward(input_ids, **kwargs)
+
+    guardrail.model = record_forward
+
+    assert await executor.warm_up(seq_lengths=(16, 128)) > 0
+    executor.shutdown()
+
+    assert seq_lengths == [16, 128]
+
+
+def get_tiny_model():
+    from transformers import BertConfig, BertForSequenceClassification
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=8,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        num_labels=3,
+    )
+    return BertForSequenceClassification(config).eval()
+
+
+# Test for `get_guardrail_handler()` function with the `int8` backend
+@patch("src.core.guardrails.AutoTokenizer.from_pretrained")
+@patch("src.core.guardrails.AutoModelForSequenceClassification.from_pretrained")
+def test_guardrail_handler_int8_backend(mock_auto_model, mock_tokenizer):
+    mock_auto_model.return_value = get_tiny_model()
+    mock_tokenizer.return_value = get_guard_tokenizer()
+
+    guardrail = get_guardrail_handler(device="cuda", backend="int8")
+
+    # quantized models run on cpu
+    assert guardrail.device == "cpu"
+    mock_auto_model.assert_called_once_with(
+        guardrail.model_name,
+        device_map="cpu",
+        low_cpu_mem_usage=True,
+    )
+    assert any(
+        isinstance(module, torch.ao.nn.quantized.dynamic.Linear)
+        for module in guardrail.model.modules()
+    )
+
+    reference = CurveGuardHanlder(
+        model_dict={
+            "model": get_tiny_model(),
+            "model_name": guardrail.model_name,
+            "backend": "eager",
+            "tokenizer": get_guard_tokenizer(),
+            "device": "cpu",
+        }
+    )
+    texts = ["hello", "a jailbreak attempt", "jailbreak " * 20]
+
+    parity = check_backend_parity(reference, guardrail, texts)
+
+    assert parity["max_abs_diff"] < 0.05
+    assert parity["verdict_agreement"] == 1.0
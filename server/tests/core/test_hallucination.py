@@ -0,0 +1,199 @@
+import io
+import os
+import json
+import sys
+import math
+import subprocess
+import torch
+import pytest
+import numpy as np
+
+from src.core.utils.hallucination_utils import (
+    HallucinationState,
+    calculate_uncertainty,
+    calculate_uncertainty_batch,
+    pad_log_probs,
+    score_hallucination,
+)
+from src.hallucination_cli import rescore_traces
+from .fakes import (
+    CERTAIN_LOGPROBS,
+    UNCERTAIN_LOGPROBS,
+    FakeAsyncStream,
+    get_weather_api,
+    make_chunks,
+    repeat_tool_calls,
+    tool_call_tokens,
+)
+
+
+class FullJoinHallucinationState(HallucinationState):
+    """
+    Matches patterns against all tokens joined, as before the rolling content suffix.
+    """
+
+    def _append_content(self, token):
+        self.content_suffix = "".join(self.tokens).replace(" ", "")
+
+
+@pytest.mark.asyncio
+async def test_hallucination_state_async_iteration():
+    state = HallucinationState(
+        response_iterator=FakeAsyncStream(make_chunks()), function=[get_weather_api]
+    )
+
+    streamed = [token async for token in state]
+
+    assert streamed == tool_call_tokens
+    assert state.function_name == "get_current_weather"
+    assert state.parameter_name == ["location", "days"]
+    assert state.hallucination is False
+
+
+@pytest.mark.asyncio
+async def test_hallucination_state_detects_uncertain_value():
+    state = HallucinationState(
+        response_iterator=FakeAsyncStream(make_chunks(uncertain_token="Seattle")),
+        function=[get_weather_api],
+    )
+
+    async for _ in state:
+        if state.hallucination:
+            break
+
+    assert state.hallucination is True
+    assert state.tokens[-1] == "Seattle"
+
+
+def test_hallucination_state_sync_iteration():
+    state = HallucinationState(
+        response_iterator=iter(make_chunks()), function=[get_weather_api]
+    )
+
+    assert list(state) == tool_call_tokens
+    assert state.hallucination is False
+
+
+@pytest.mark.parametrize(
+    "tokens",
+    [
+        tool_call_tokens,
+        [token.replace('"', "'") for token in tool_call_tokens],
+        repeat_tool_calls(1000),
+    ],
+)
+@pytest.mark.parametrize("uncertain_token", [None, "Seattle", "<tool_call>"])
+def test_hallucination_state_matches_full_join(tokens, uncertain_token):
+    states = [
+        state_cls(
+            response_iterator=iter(make_chunks(tokens, uncertain_token)),
+            function=[get_weather_api],
+        )
+        for state_cls in (HallucinationState, FullJoinHallucinationState)
+    ]
+
+    for state in states:
+        for _ in state:
+            pass
+
+    rolling, full_join = states
+    assert rolling.mask == full_join.mask
+    assert rolling.function_name == full_join.function_name
+    assert rolling.parameter_name == full_join.parameter_name
+    assert rolling.token_probs_map == full_join.token_probs_map
+    assert rolling.hallucination == full_join.hallucination
+
+
+def torch_uncertainty(log_probs):
+    # the previous torch implementation, kept as reference
+    log_probs = torch.tensor(log_probs)
+    token_probs = torch.exp(log_probs)
+    entropy = -torch.sum(log_probs * token_probs, dim=-1) / math.log(2, math.e)
+    varentropy = torch.sum(
+        token_probs * (log_probs / math.log(2, math.e)) + entropy.unsqueeze(-1) ** 2,
+        dim=-1,
+    )
+    return entropy.item(), varentropy.item(), token_probs[0].item()
+
+
+def test_calculate_uncertainty_matches_torch():
+    rng = np.random.default_rng(0)
+    rows = [CERTAIN_LOGPROBS, UNCERTAIN_LOGPROBS] + [
+        np.log(rng.dirichlet(np.ones(10) * alpha)).tolist()
+        for alpha in (0.1, 0.5, 1.0, 5.0)
+    ]
+
+    expected = np.array([torch_uncertainty(row) for row in rows])
+
+    single = np.array([calculate_uncertainty(row) for row in rows])
+    batch = np.stack(calculate_uncertainty_batch(np.array(rows)), axis=-1)
+
+    np.testing.assert_allclose(single, expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(batch, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_calculate_uncertainty_batch_ignores_padding():
+    rows = [CERTAIN_LOGPROBS[:3], UNCERTAIN_LOGPROBS]
+
+    expected = np.array([calculate_uncertainty(row) for row in rows])
+    batch = np.stack(calculate_uncertainty_batch(pad_log_probs(rows)), axis=-1)
+
+    np.testing.assert_allclose(batch, expected, rtol=1e-9)
+
+
+def test_score_hallucination_reports_every_check():
+    # the first tool call hallucinates on `Seattle`, the second one is certain
+    tokens = repeat_tool_calls(2 * len(tool_call_tokens))
+    logprobs = [
+        UNCERTAIN_LOGPROBS if idx == tokens.index("Seattle") else CERTAIN_LOGPROBS
+        for idx in range(len(tokens))
+    ]
+
+    result = score_hallucination(tokens, logprobs, [get_weather_api])
+
+    value_checks = [check for check in result["checks"] if check["mask"] == "v"]
+    assert result["hallucination"] is True
+    assert [
+        (check["parameter_name"], check["hallucination"]) for check in value_checks
+    ] == [("location", True), ("days", False), ("location", False), ("days", False)]
+
+    # the same uncertainty as the streaming check
+    state = HallucinationState(
+        response_iterator=iter(make_chunks(tool_call_tokens, "Seattle")),
+        function=[get_weather_api],
+    )
+    for _ in state:
+        if state.hallucination:
+            break
+
+    streamed = state.token_probs_map[-1]
+    assert value_checks[0]["entropy"] == pytest.approx(streamed[1])
+    assert value_checks[0]["varentropy"] == pytest.approx(streamed[2])
+
+
+def test_rescore_traces_skips_malformed_lines():
+    trace = {
+        "id": "trace-1",
+        "tokens": tool_call_tokens,
+        "logprobs": [CERTAIN_LOGPROBS] * len(tool_call_tokens),
+        "tools": [get_weather_api],
+    }
+    lines = ["not json\n", "[1, 2]\n", '{"id": "no-tokens"}\n', json.dumps(trace)]
+    output = io.StringIO()
+
+    assert rescore_traces(lines, output) == (1, 0)
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result["id"] for result in results] == ["trace-1"]
+
+
+def test_hallucination_utils_do_not_import_torch():
+    # a fresh interpreter, torch is already loaded in this one
+    code = (
+        "import sys, src.core.utils.hallucination_utils, src.hallucination_cli; "
+        "sys.exit('torch' in sys.modules)"
+    )
+
+    server_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+
+    assert subprocess.run([sys.executable, "-c", code], cwd=server_dir).returncode == 0
@@ -0,0 +1,55 @@
+import logging
+
+import src.commons.utils as utils
+
+from src.commons.utils import LazyJSON, log_payload, sample_request_logs
+from src.core.utils.model_utils import ChatMessage
+
+
+logger = logging.getLogger("server.test")
+
+
+def test_lazy_json_truncates():
+    payload = ChatMessage(messages=[{"role": "user", "content": "x" * 100}])
+
+    assert str(LazyJSON(payload)).startswith('{"messages":[{"role":"user"')
+    assert str(LazyJSON(payload, max_chars=10)).startswith(str(LazyJSON(payload))[:10])
+    assert str(LazyJSON(payload, max_chars=10)).endswith("... (truncated)")
+
+
+def test_lazy_json_serializes_only_the_logged_prefix():
+    content = "x" * 10_000_000
+    payload = ChatMessage(messages=[{"role": "user", "content": content}] * 10)
+
+    text = str(LazyJSON(payload, max_chars=64))
+
+    assert text == str(LazyJSON(payload))[:64] + "... (truncated)"
+    assert str(LazyJSON([{"a": ""}, 1, "x"], max_chars=64)) == '[{"a":""},1,"x"]'
+
+
+def test_log_payload_is_truncated_above_debug(caplog, monkeypatch):
+    monkeypatch.setattr(utils, "LOG_PAYLOAD_MAX_CHARS", 8)
+
+    with caplog.at_level(logging.INFO, logger="server.test"):
+        log_payload(logger, "request", {"content": "x" * 100})
+
+    assert caplog.messages == ['[request]: {"conten... (truncated)']
+
+    caplog.clear()
+    with caplog.at_level(logging.DEBUG, logger="server.test"):
+        log_payload(logger, "request", {"content": "x" * 100})
+
+    assert caplog.messages == ['[request]: {"content":"' + "x" * 100 + '"}']
+
+
+def test_log_payload_sampling(caplog, monkeypatch):
+    monkeypatch.setattr(utils, "LOG_SAMPLE_RATES", {"/sampled": 1.0, "/dropped": 0.0})
+
+    with caplog.at_level(logging.INFO, logger="server.test"):
+        sample_request_logs("/dropped")
+        log_payload(logger, "request", {"route": "/dropped"})
+
+        sample_request_logs("/sampled")
+        log_payload(logger, "request", {"route": "/sampled"})
+
+    assert caplog.messages == ['[request]: {"route":"/sampled"}']
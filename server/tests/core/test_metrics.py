@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+
+from src.commons.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    MetricRegistry,
+    generate_latest,
+    published_path,
+    retire,
+)
+
+
+def test_counter_sums_threads():
+    registry = MetricRegistry()
+    counter = Counter("requests_total", "Requests.", registry=registry)
+
+    def work():
+        for _ in range(1000):
+            counter.inc()
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 8000
+
+
+def test_gauge_set_and_track_inprogress():
+    registry = MetricRegistry()
+    gauge = Gauge("in_flight", "In flight.", registry=registry)
+
+    gauge.set(3)
+    with gauge.track_inprogress():
+        assert gauge.value == 4
+    assert gauge.value == 3
+
+
+def test_histogram_buckets():
+    registry = MetricRegistry()
+    histogram = Histogram(
+        "latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry
+    )
+
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert histogram.bucket_counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 2.65
+
+
+def test_generate_latest():
+    registry = MetricRegistry()
+    counter = Counter("requests_total", "Requests.", ["result"], registry=registry)
+    histogram = Histogram(
+        "latency_seconds",
+        "Latency.",
+        ["stage"],
+        buckets=(0.1, 1.0),
+        registry=registry,
+    )
+
+    counter.labels(result='a "quoted"\nvalue').inc(2)
+    histogram.labels(stage="intent").observe(0.5)
+
+    assert generate_latest(registry) == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{result="a \\"quoted\\"\\nvalue"} 2\n'
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{stage="intent",le="0.1"} 0\n'
+        'latency_seconds_bucket{stage="intent",le="1"} 1\n'
+        'latency_seconds_bucket{stage="intent",le="+Inf"} 1\n'
+        'latency_seconds_sum{stage="intent"} 0.5\n'
+        'latency_seconds_count{stage="intent"} 1\n'
+    )
+
+
+def test_generate_latest_sums_workers(tmp_path):
+    registry = MetricRegistry()
+    registry.shared_dir = str(tmp_path)
+    counter = Counter("requests_total", "Requests.", ["result"], registry=registry)
+    in_flight = Gauge("in_flight", "In flight.", registry=registry)
+    ready = Gauge("ready", "Ready.", merge="min", registry=registry)
+    histogram = Histogram(
+        "latency_seconds", "Latency.", buckets=(1.0,), registry=registry
+    )
+
+    counter.labels(result="ok").inc(2)
+    in_flight.set(1)
+    ready.set(1)
+    histogram.observe(0.5)
+
+    # another worker that served one failed request and is not ready yet
+    other_pid = os.getpid() + 1
+    with open(published_path(str(tmp_path), other_pid), "w") as f:
+        json.dump(
+            {
+                "requests_total": [[["ok"], [3]], [["error"], [1]]],
+                "in_flight": [[[], [2]]],
+                "ready": [[[], [0]]],
+                "latency_seconds": [[[], [0, 1, 2.0, 1]]],
+            },
+            f,
+        )
+
+    output = generate_latest(registry)
+
+    assert 'requests_total{result="ok"} 5\n' in output
+    assert 'requests_total{result="error"} 1\n' in output
+    assert "in_flight 3\n" in output
+    assert "ready 0\n" in output
+    assert 'latency_seconds_bucket{le="1"} 1\n' in output
+    assert 'latency_seconds_bucket{le="+Inf"} 2\n' in output
+    assert "latency_seconds_sum 2.5\n" in output
+    assert "latency_seconds_count 2\n" in output
+
+    # the counters of an exited worker keep counting, its gauges are dropped
+    retire(other_pid, registry)
+    output = generate_latest(registry)
+
+    assert 'requests_total{result="ok"} 5\n' in output
+    assert "in_flight 1\n" in output
+    assert "ready 1\n" in output
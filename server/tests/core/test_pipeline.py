@@ -0,0 +1,337 @@
+import time
+import asyncio
+import pytest
+
+from src.core.function_calling import (
+    FUNCTION_SAVED_TOKENS,
+    CurveFunctionConfig,
+    CurveFunctionHandler,
+    CurveIntentConfig,
+    CurveIntentHandler,
+    INTENT_CACHE_METADATA_KEY,
+)
+from src.core.utils.model_utils import (
+    ChatMessage,
+    Message,
+    PipelineContext,
+    StageTimeoutError,
+)
+from .fakes import FakeAsyncOpenAI, get_weather_api, tool_call_tokens
+
+
+def get_request(content="How is the weather in Seattle in 7 days?"):
+    return ChatMessage(
+        messages=[Message(role="user", content=content)], tools=[get_weather_api]
+    )
+
+
+def get_function_handler(client):
+    return CurveFunctionHandler(client, "Curve-Function", CurveFunctionConfig)
+
+
+@pytest.mark.asyncio
+async def test_intent_handler():
+    handler = CurveIntentHandler(
+        FakeAsyncOpenAI(intent="No"), "Curve-Intent", CurveIntentConfig
+    )
+
+    response = await handler.chat_completion(get_request())
+
+    assert handler.detect_intent(response) is False
+
+
+@pytest.mark.asyncio
+async def test_intent_handler_cache():
+    client = FakeAsyncOpenAI(intent="Yes")
+    handler = CurveIntentHandler(client, "Curve-Intent", CurveIntentConfig)
+
+    for _ in range(2):
+        response = await handler.chat_completion(get_request())
+        assert handler.detect_intent(response) is True
+
+    # whitespace differences map to the same cache entry
+    await handler.chat_completion(
+        get_request("How is the  weather in  Seattle in 7 days?")
+    )
+    assert len(client.chat.completions.calls) == 1
+    assert handler.cache.hits == 2
+
+    req = get_request()
+    req.metadata = {INTENT_CACHE_METADATA_KEY: "bypass"}
+    await handler.chat_completion(req)
+    assert len(client.chat.completions.calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_function_handler_tool_call():
+    handler = get_function_handler(FakeAsyncOpenAI())
+    ctx = PipelineContext(get_request())
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    tool_calls = response.choices[0].message.tool_calls
+    assert tool_calls[0]["function"]["name"] == "get_current_weather"
+    assert tool_calls[0]["function"]["arguments"] == {
+        "location": "Seattle, WA",
+        "days": "7",
+    }
+    assert ctx.hallucination is False
+    assert ctx.prefill is False
+    assert 0 < ctx.timings["ttft"] < ctx.timings.get("function", float("inf"))
+
+
+@pytest.mark.asyncio
+async def test_function_handler_hallucination_engages_prefill():
+    client = FakeAsyncOpenAI(uncertain_token="Seattle")
+    handler = get_function_handler(client)
+    ctx = PipelineContext(get_request())
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    assert ctx.hallucination is True
+    assert ctx.prefill is True
+    assert "prefill" in ctx.timings
+
+    # the stream is closed at the uncertain token instead of generating up to `max_tokens`
+    stream = client.chat.completions.streams[0]
+    assert stream.closed is True
+    assert stream.consumed == tool_call_tokens.index("Seattle") + 1
+    assert (
+        response.choices[0].message.content == client.chat.completions.prefill_content
+    )
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_keep_separate_state():
+    # both requests share one handler, but only the second one hallucinates
+    handler = get_function_handler(
+        FakeAsyncOpenAI(
+            uncertain_token="Seattle", hallucinate_when="tomorrow", delay=0.001
+        )
+    )
+    ctxs = [
+        PipelineContext(get_request("How is the weather in Seattle in 7 days?")),
+        PipelineContext(get_request("How is the weather in Seattle tomorrow?")),
+    ]
+
+    await asyncio.gather(*[handler.chat_completion(ctx.request, ctx) for ctx in ctxs])
+
+    assert ctxs[0].hallucination is False
+    assert ctxs[0].prefill is False
+    assert ctxs[1].hallucination is True
+    assert ctxs[1].prefill is True
+
+
+@pytest.mark.asyncio
+async def test_cancelled_function_call_closes_stream():
+    client = FakeAsyncOpenAI(delay=0.01)
+    handler = get_function_handler(client)
+    ctx = PipelineContext(get_request())
+
+    task = asyncio.create_task(handler.chat_completion(ctx.request, ctx))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    stream = client.chat.completions.streams[0]
+    assert task.cancelled()
+    assert stream.closed is True
+    assert stream.consumed < len(tool_call_tokens)
+
+
+@pytest.mark.asyncio
+async def test_function_handler_emits_tool_calls_while_streaming():
+    client = FakeAsyncOpenAI(tokens=tool_call_tokens + ["\n"] + tool_call_tokens)
+    handler = get_function_handler(client)
+
+    stream_progress = []
+    ctx = PipelineContext(
+        get_request(),
+        on_tool_call=lambda _: stream_progress.append(
+            client.chat.completions.streams[0].consumed
+        ),
+    )
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    # each tool call is emitted as soon as its closing tag is consumed
+    assert stream_progress == [len(tool_call_tokens), 2 * len(tool_call_tokens) + 1]
+
+    tool_calls = response.choices[0].message.tool_calls
+    assert [tool_call["id"] for tool_call in tool_calls] == [
+        tool_call["id"] for tool_call in ctx.tool_calls
+    ]
+
+
+@pytest.mark.asyncio
+async def test_function_handler_keeps_emitted_tool_calls_on_hallucination():
+    # the second tool call hallucinates its `days` parameter
+    second_tool_call = ["8" if token == "7" else token for token in tool_call_tokens]
+    client = FakeAsyncOpenAI(
+        tokens=tool_call_tokens + ["\n"] + second_tool_call, uncertain_token="8"
+    )
+    handler = get_function_handler(client)
+
+    emitted = []
+    ctx = PipelineContext(get_request(), on_tool_call=emitted.append)
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    assert len(emitted) == 1
+    assert ctx.hallucination is True
+    # the response finalizes with the emitted tool call instead of gathering parameters
+    assert ctx.prefill is False
+    assert [call["stream"] for call in client.chat.completions.calls] == [True]
+    assert response.choices[0].message.tool_calls == emitted
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("intent", ["Yes", "No"])
+async def test_speculative_tool_calls_are_held_until_intent(intent):
+    client = FakeAsyncOpenAI(intent=intent, delay=0.01)
+    intent_handler = CurveIntentHandler(client, "Curve-Intent", CurveIntentConfig)
+    function_handler = get_function_handler(FakeAsyncOpenAI())
+
+    emitted = []
+    ctx = PipelineContext(get_request(), on_tool_call=emitted.append)
+
+    # the speculative flow of `run_function_calling`
+    ctx.hold_tool_calls()
+    function_task = asyncio.create_task(
+        function_handler.chat_completion(ctx.request, ctx)
+    )
+    intent_response = await intent_handler.chat_completion(ctx.request, ctx)
+
+    # the tool call was generated while Curve-Intent was running, but not emitted
+    assert len(ctx.tool_calls) == 1
+    assert emitted == []
+
+    has_intent = intent_handler.detect_intent(intent_response)
+    ctx.release_tool_calls(emit=has_intent)
+    await function_task
+
+    assert emitted == (ctx.tool_calls if intent == "Yes" else [])
+
+
+@pytest.mark.asyncio
+async def test_invalid_tools_close_stream():
+    client = FakeAsyncOpenAI()
+    handler = get_function_handler(client)
+    req = get_request()
+    req.tools = [{"type": "function", "function": {"name": "get_current_weather"}}]
+
+    with pytest.raises(KeyError):
+        await handler.chat_completion(req, PipelineContext(req))
+
+    assert client.chat.completions.streams[0].closed is True
+
+
+@pytest.mark.asyncio
+async def test_non_tool_answer_closes_stream():
+    client = FakeAsyncOpenAI(tokens=["Sure", ",", " which", " city", "?"])
+    handler = get_function_handler(client)
+    ctx = PipelineContext(get_request())
+    saved_tokens = FUNCTION_SAVED_TOKENS.value
+
+    await handler.chat_completion(ctx.request, ctx)
+
+    stream = client.chat.completions.streams[0]
+    assert stream.closed is True
+    assert stream.consumed == 1
+    assert (
+        FUNCTION_SAVED_TOKENS.value - saved_tokens
+        == CurveFunctionConfig.GENERATION_PARAMS["max_tokens"] - 1
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("uncertain_token", ["7", None])
+async def test_hedged_prefill(uncertain_token):
+    # `Seattle` is likely a hallucination, `7` is one
+    client = FakeAsyncOpenAI(
+        soft_uncertain_token="Seattle", uncertain_token=uncertain_token, delay=0.01
+    )
+    handler = get_function_handler(client)
+    handler.hedge_prefill = True
+    ctx = PipelineContext(get_request())
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    # parameter gathering starts before the stream ends in both cases
+    assert [call["stream"] for call in client.chat.completions.calls] == [True, False]
+
+    if uncertain_token is None:
+        assert ctx.prefill is False
+        assert response.choices[0].message.tool_calls
+    else:
+        assert ctx.prefill is True
+        # the prefill response was ready before the hallucination was detected
+        assert ctx.timings["prefill"] < 0.01
+        assert (
+            response.choices[0].message.content
+            == client.chat.completions.prefill_content
+        )
+
+
+@pytest.mark.asyncio
+async def test_cancelled_hedged_prefill_is_awaited():
+    client = FakeAsyncOpenAI(soft_uncertain_token="Seattle", delay=0.01)
+    handler = get_function_handler(client)
+    handler.hedge_prefill = True
+    ctx = PipelineContext(get_request())
+
+    prefill_cancelled = []
+
+    async def slow_prefill(messages):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            prefill_cancelled.append(True)
+            raise
+
+    handler._engage_parameter_gathering = slow_prefill
+
+    response = await handler.chat_completion(ctx.request, ctx)
+
+    # the tool call is certain, the hedged prefill is cancelled before the response returns
+    assert response.choices[0].message.tool_calls
+    assert prefill_cancelled == [True]
+
+
+@pytest.mark.asyncio
+async def test_intent_stage_timeout():
+    handler = CurveIntentHandler(
+        FakeAsyncOpenAI(delay=0.1), "Curve-Intent", CurveIntentConfig
+    )
+    ctx = PipelineContext(get_request(), deadline=time.monotonic() + 0.02)
+
+    with pytest.raises(StageTimeoutError) as e:
+        await handler.chat_completion(ctx.request, ctx)
+
+    assert e.value.stage == "intent"
+
+
+@pytest.mark.asyncio
+async def test_function_stage_timeout_closes_stream():
+    client = FakeAsyncOpenAI(delay=0.01)
+    handler = get_function_handler(client)
+    ctx = PipelineContext(get_request(), deadline=time.monotonic() + 0.05)
+
+    with pytest.raises(StageTimeoutError) as e:
+        await ctx.run_stage("function", handler.chat_completion(ctx.request, ctx))
+
+    assert e.value.stage == "function"
+    assert client.chat.completions.streams[0].closed is True
+
+
+@pytest.mark.asyncio
+async def test_prefill_stage_timeout():
+    client = FakeAsyncOpenAI(tokens=["Sure"], delay=0.05)
+    handler = get_function_handler(client)
+    ctx = PipelineContext(get_request(), deadline=time.monotonic() + 0.01)
+
+    # the stream is not bounded here, but parameter gathering has no budget left
+    with pytest.raises(StageTimeoutError) as e:
+        await handler.chat_completion(ctx.request, ctx)
+
+    assert e.value.stage == "prefill"
@@ -0,0 +1,61 @@
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+from typing import Annotated
+
+from src.commons.serialization import ModelJSONResponse, json_body
+from src.core.utils.model_utils import (
+    ChatCompletionResponse,
+    ChatMessage,
+    Choice,
+    GuardResponse,
+)
+
+
+def test_model_json_response_matches_default_encoding():
+    tool_call = {
+        "id": "call_1234",
+        "function": {"arguments": {"days": 7, "threshold": 1e-05, "unit": None}},
+    }
+    responses = [
+        ChatCompletionResponse(
+            choices=[Choice(message={"content": "12°C in Москва 🌧\n\x00\u2028"})],
+            metadata={"intent_latency": "1.234"},
+        ),
+        # floats are formatted by `json.dumps`, not by `pydantic_core`
+        ChatCompletionResponse(choices=[Choice(message={"tool_calls": [tool_call]})]),
+        GuardResponse(prob=1e-05, verdict=True, metadata={"guard_latency": "0.1"}),
+    ]
+
+    for response in responses:
+        assert (
+            ModelJSONResponse(response).body
+            == JSONResponse(jsonable_encoder(response)).body
+        )
+
+
+def test_json_body():
+    app = FastAPI()
+
+    @app.post("/default")
+    async def default(req: ChatMessage):
+        return req
+
+    @app.post("/fast")
+    async def fast(req: Annotated[ChatMessage, json_body(ChatMessage)]):
+        return ModelJSONResponse(req)
+
+    client = TestClient(app)
+
+    body = {"messages": [{"role": "user", "content": "hi"}], "tools": []}
+    assert client.post("/fast", json=body).content == (
+        client.post("/default", json=body).content
+    )
+
+    invalid = {"messages": [{"role": 1}]}
+    default_response = client.post("/default", json=invalid)
+    fast_response = client.post("/fast", json=invalid)
+    assert fast_response.status_code == default_response.status_code == 422
+    assert fast_response.json()["detail"][0]["loc"] == ["body", "messages", 0, "role"]
+    assert fast_response.json() == default_response.json()
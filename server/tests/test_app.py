@@ -1,3 +1,4 @@
+import json
 import pytest
 import httpx
 
@@ -45,3 +46,42 @@ async def test_function_calling_endpoint():
         }
         response = await client.post("/function_calling", json=request_data)
         assert response.status_code == 200
+
+
+# Unit test for the streaming function calling endpoint
+@pytest.mark.asyncio
+async def test_function_calling_stream_endpoint():
+    request_data = {
+        "messages": [{"role": "user", "content": "Hello!"}],
+        "tools": [],
+    }
+    response = client.post("/function_calling/stream", json=request_data)
+    assert response.status_code == 200
+
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert events[-1]["type"] == "response"
+
+
+# Unit test for the batch function calling endpoint
+@pytest.mark.asyncio
+async def test_function_calling_batch_endpoint():
+    request_data = [
+        {"messages": [{"role": "user", "content": "Hello!"}], "tools": []},
+        {"messages": [{"role": "user", "content": "How are you?"}], "tools": []},
+    ]
+    response = client.post("/function_calling/batch", json=request_data)
+    assert response.status_code == 200
+    assert [item["index"] for item in response.json()["data"]] == [0, 1]
+    assert [item["status_code"] for item in response.json()["data"]] == [200, 200]
+
+
+# Unit tests for the readiness endpoint, ready once the startup warm-up is done.
+# The app shuts down the guard executor on exit, so this test runs last.
+@pytest.mark.asyncio
+async def test_readyz():
+    assert client.get("/readyz").status_code == 503
+
+    with TestClient(app) as started_client:
+        response = started_client.get("/readyz")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok"}